@@ -0,0 +1,223 @@
+# Concurrent load on the agent graph, offline, with the fake chat model.
+#
+#   python benchmarks/agent_load.py --sessions 1 8 32 --turns 3 --mode async --output agent_load.json
+#
+# Every simulated session is one conversation (its own thread_id) that asks --turns
+# evaluation questions one after the other; all sessions of a level run at the
+# same time:
+#   - sync:   one thread per session calling get_agent_response,
+#   - stream: one thread per session consuming stream_agent_response (adds TTFT),
+#   - async:  one task per session on a single event loop calling aget_agent_response.
+# The chat model is the local stand-in of fake_llm.py (--llm-latency-ms,
+# --tokens-per-second), so only retrieval and graph orchestration are really
+# exercised and nothing leaves the machine (use RETRIEVER_BACKEND=numpy to drop the
+# Qdrant server as well). For every concurrency level the report gives throughput,
+# latency percentiles, errors, resident memory and the mean time of each pipeline
+# stage (from the tracing histograms).
+
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "code"))
+
+# Benchmark conversations are throwaway, keep them out of the app's conversation store
+os.environ.setdefault("CONVERSATION_DB", "")
+
+import config
+import tracing
+from agent_prep import get_shared_agent, get_agent_response, stream_agent_response, aget_agent_response
+
+EVAL_FILES = [
+    "Final_ECC_CSCC_Evaluation_AR_Dataset.xlsx",
+    "Final_ECC_CSCC_Evaluation_ENG_Dataset.xlsx",
+]
+
+
+def load_questions(limit):
+    questions = []
+    for name in EVAL_FILES:
+        df = pd.read_excel(os.path.join(ROOT_DIR, "evaluation", "evaluation datasets", name))
+        questions.extend(str(q) for q in df[df.columns[0]].dropna())
+    return questions[:limit] if limit else questions
+
+
+def rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        # Linux fallback
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+class PeakMemory:
+    """Samples the resident memory in the background and keeps the maximum."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def session_questions(questions, session, turns):
+    return [questions[(session * turns + turn) % len(questions)] for turn in range(turns)]
+
+
+def run_sync(graph, questions, sessions, turns, stream):
+    samples = []  # (latency s, time to first token s or None, answer)
+    lock = threading.Lock()
+
+    def session(index):
+        config = {"configurable": {"thread_id": f"load-{uuid.uuid4()}"}}
+        for question in session_questions(questions, index, turns):
+            start = time.perf_counter()
+            if stream:
+                stats = {}
+                answer = "".join(stream_agent_response(question, graph, config, stats))
+                first_token = stats.get("time_to_first_token")
+            else:
+                answer = get_agent_response(question, graph, config)
+                first_token = None
+            with lock:
+                samples.append((time.perf_counter() - start, first_token, answer))
+
+    with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="session") as pool:
+        list(pool.map(session, range(sessions)))
+    return samples
+
+
+async def run_async(graph, questions, sessions, turns):
+    samples = []
+
+    async def session(index):
+        config = {"configurable": {"thread_id": f"load-{uuid.uuid4()}"}}
+        for question in session_questions(questions, index, turns):
+            start = time.perf_counter()
+            answer = await aget_agent_response(question, graph, config)
+            samples.append((time.perf_counter() - start, None, answer))
+
+    await asyncio.gather(*(session(index) for index in range(sessions)))
+    return samples
+
+
+def percentiles(values, prefix):
+    values = np.array(values) * 1000
+    return {
+        f"{prefix}_ms_p50": round(float(np.percentile(values, 50)), 1),
+        f"{prefix}_ms_p95": round(float(np.percentile(values, 95)), 1),
+        f"{prefix}_ms_p99": round(float(np.percentile(values, 99)), 1),
+    }
+
+
+def stage_means(before, after):
+    # Mean milliseconds per stage over the requests of one level
+    means = {}
+    for stage, (count, total) in sorted(after.items()):
+        count_before, total_before = before.get(stage, (0, 0.0))
+        if count > count_before:
+            means[stage] = round((total - total_before) / (count - count_before) * 1000, 2)
+    return means
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput, latency and memory of the agent under concurrent sessions.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--turns", type=int, default=3, help="questions per session, in one conversation")
+    parser.add_argument("--mode", choices=["sync", "stream", "async"], default="async")
+    parser.add_argument("--llm", choices=["fake", "deepseek"], default="fake")
+    parser.add_argument("--llm-latency-ms", type=float, default=config.FAKE_LLM_LATENCY_MS)
+    parser.add_argument("--tokens-per-second", type=float, default=config.FAKE_LLM_TOKENS_PER_SECOND)
+    parser.add_argument("--answer-tokens", type=int, default=config.FAKE_LLM_ANSWER_TOKENS)
+    parser.add_argument("--no-retrieval-cache", action="store_true", help="every question goes to the vector store")
+    parser.add_argument("--question-limit", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    # Read when the agent is built
+    config.LLM_PROVIDER = args.llm
+    config.FAKE_LLM_LATENCY_MS = args.llm_latency_ms
+    config.FAKE_LLM_TOKENS_PER_SECOND = args.tokens_per_second
+    config.FAKE_LLM_ANSWER_TOKENS = args.answer_tokens
+    if args.no_retrieval_cache:
+        config.RETRIEVAL_CACHE_SIZE = 0
+
+    questions = load_questions(args.question_limit)
+    baseline_mb = rss_mb()
+    graph, _ = get_shared_agent()
+    # Warm-up: first embedding, first Qdrant connection, lazy imports
+    get_agent_response(questions[0], graph, {"configurable": {"thread_id": f"load-{uuid.uuid4()}"}})
+    loaded_mb = rss_mb()
+    print(f"{len(questions)} questions, agent loaded ({loaded_mb:.0f} MB)")
+
+    results = []
+    for sessions in args.sessions:
+        before = tracing.metrics.totals("grc_stage_duration_seconds")
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            if args.mode == "async":
+                samples = asyncio.run(run_async(graph, questions, sessions, args.turns))
+            else:
+                samples = run_sync(graph, questions, sessions, args.turns, stream=args.mode == "stream")
+            wall_s = time.perf_counter() - start
+        after = tracing.metrics.totals("grc_stage_duration_seconds")
+
+        row = {
+            "sessions": sessions,
+            "requests": len(samples),
+            "errors": sum(answer.startswith("An error occurred") for _, _, answer in samples),
+            "throughput_rps": round(len(samples) / wall_s, 2),
+            **percentiles([latency for latency, _, _ in samples], "latency"),
+            "rss_mb_peak": round(memory.peak, 1),
+            "stage_ms_mean": stage_means(before, after),
+        }
+        first_tokens = [first_token for _, first_token, _ in samples if first_token is not None]
+        if first_tokens:
+            row.update(percentiles(first_tokens, "ttft"))
+        results.append(row)
+        print(json.dumps({key: value for key, value in row.items() if key != "stage_ms_mean"}))
+
+    report = {
+        "mode": args.mode,
+        "llm": args.llm,
+        "llm_latency_ms": args.llm_latency_ms if args.llm == "fake" else None,
+        "tokens_per_second": args.tokens_per_second if args.llm == "fake" else None,
+        "backend": config.RETRIEVER_BACKEND,
+        "retrieval_cache": config.RETRIEVAL_CACHE_SIZE > 0,
+        "turns": args.turns,
+        "rss_mb_baseline": round(baseline_mb, 1),
+        "rss_mb_agent_loaded": round(loaded_mb, 1),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Compares embedding backends on latency, throughput and retrieval agreement.
+#
+#   python benchmarks/embedding_backends.py --backends torch onnx --threads 8
+#
+# Every backend embeds the same corpus chunks and evaluation questions (no cache).
+# Agreement is measured against the first backend (the current one, torch): for each
+# question the top-k control IDs of an exact cosine search over the corpus are
+# compared, reporting the mean overlap@k and how often the top-1 control matches.
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "code"))
+
+from embeddings import load_embedding_model
+from db_prep import chunk_by_control_units
+
+EVAL_FILES = [
+    "Final_ECC_CSCC_Evaluation_AR_Dataset.xlsx",
+    "Final_ECC_CSCC_Evaluation_ENG_Dataset.xlsx",
+]
+
+
+def load_corpus(limit):
+    files_dir = os.path.join(ROOT_DIR, "files")
+    chunks = []
+    for name in sorted(os.listdir(files_dir)):
+        with open(os.path.join(files_dir, name), "r", encoding="utf-8") as f:
+            chunks.extend(chunk_by_control_units(f.read()))
+    return chunks[:limit] if limit else chunks
+
+
+def load_questions(limit):
+    questions = []
+    for name in EVAL_FILES:
+        df = pd.read_excel(os.path.join(ROOT_DIR, "evaluation", "evaluation datasets", name))
+        questions.extend(str(q) for q in df[df.columns[0]].dropna())
+    return questions[:limit] if limit else questions
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+def run_backend(backend, threads, chunks, questions, k):
+    start = time.perf_counter()
+    model = load_embedding_model(backend=backend, cache_dir="", threads=threads)
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    corpus = normalize(model.embed_documents([chunk["content"] for chunk in chunks]))
+    corpus_s = time.perf_counter() - start
+
+    latencies = []
+    query_vectors = []
+    for question in questions:
+        start = time.perf_counter()
+        query_vectors.append(model.embed_query(question))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    scores = normalize(query_vectors) @ corpus.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    latencies.sort()
+    return {
+        "backend": backend,
+        "load_s": round(load_s, 2),
+        "corpus_chunks_per_s": round(len(chunks) / corpus_s, 2),
+        "query_ms_p50": round(statistics.median(latencies), 2),
+        "query_ms_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 2),
+        "queries_per_s": round(1000 * len(latencies) / sum(latencies), 2),
+    }, top
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends.")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx"])
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads for every backend")
+    parser.add_argument("--corpus-limit", type=int, default=0, help="only embed the first N chunks")
+    parser.add_argument("--question-limit", type=int, default=0)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    chunks = load_corpus(args.corpus_limit)
+    questions = load_questions(args.question_limit)
+    control_ids = np.array([chunk["id"] for chunk in chunks])
+    print(f"{len(chunks)} chunks, {len(questions)} questions")
+
+    results = []
+    reference = None
+    for backend in args.backends:
+        print(f"\nRunning backend '{backend}'...")
+        result, top = run_backend(backend, args.threads, chunks, questions, args.k)
+        ranked_ids = control_ids[top]
+        if reference is None:
+            reference = ranked_ids
+        # Overlap of the top-k control IDs with the reference backend
+        result[f"overlap_at_{args.k}"] = round(float(np.mean([
+            len(set(a) & set(b)) / len(set(a)) for a, b in zip(reference, ranked_ids)
+        ])), 4)
+        result["top1_agreement"] = round(float(np.mean(reference[:, 0] == ranked_ids[:, 0])), 4)
+        results.append(result)
+        print(json.dumps(result, indent=2))
+
+    report = {"k": args.k, "chunks": len(chunks), "questions": len(questions), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Recall against latency for Qdrant quantization / on-disk / HNSW settings.
+#
+#   python benchmarks/qdrant_recall.py --k 10 --output qdrant_recall.json
+#
+# The vectors and payloads of docs_collection are copied into one temporary
+# collection per storage setting. Every evaluation question is embedded once (through
+# the embedding cache) and searched with each combination of hnsw_ef / oversampling.
+# Recall@k is measured against an exact (brute force) search on the original
+# collection, so it only reflects the index/quantization approximation. The report
+# also estimates the RAM needed for the vectors, per point and for the whole corpus.
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointStruct, OptimizersConfigDiff
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "code"))
+
+import config
+from embeddings import load_embedding_model
+from qdrant_settings import collection_config, search_params, VECTOR_SIZE
+
+EVAL_FILES = [
+    "Final_ECC_CSCC_Evaluation_AR_Dataset.xlsx",
+    "Final_ECC_CSCC_Evaluation_ENG_Dataset.xlsx",
+]
+
+STORAGE_SETTINGS = [
+    {"quantization": "none", "on_disk": False},
+    {"quantization": "scalar", "on_disk": False},
+    {"quantization": "scalar", "on_disk": True},
+    {"quantization": "binary", "on_disk": True},
+]
+
+
+def load_questions(limit):
+    questions = []
+    for name in EVAL_FILES:
+        df = pd.read_excel(os.path.join(ROOT_DIR, "evaluation", "evaluation datasets", name))
+        questions.extend(str(q) for q in df[df.columns[0]].dropna())
+    return questions[:limit] if limit else questions
+
+
+def read_points(client, collection_name):
+    points = []
+    offset = None
+    while True:
+        batch, offset = client.scroll(
+            collection_name=collection_name, limit=256, offset=offset, with_payload=True, with_vectors=True
+        )
+        points.extend(batch)
+        if offset is None:
+            return points
+
+
+def ram_bytes_per_point(quantization, on_disk):
+    # Rough vector memory only (HNSW links and payloads not included)
+    original = 0 if on_disk else VECTOR_SIZE * 4
+    quantized = {"none": 0, "scalar": VECTOR_SIZE, "binary": VECTOR_SIZE // 8}[quantization]
+    return original + quantized
+
+
+def search(client, collection_name, vectors, k, params):
+    latencies = []
+    results = []
+    for vector in vectors:
+        start = time.perf_counter()
+        response = client.query_points(
+            collection_name=collection_name, query=vector, limit=k, search_params=params, with_payload=False
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([str(point.id) for point in response.points])
+    return results, np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency for Qdrant index settings.")
+    parser.add_argument("--collection", default=config.COLLECTION_NAME)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--hnsw-ef", type=int, nargs="+", default=[16, 64, 128])
+    parser.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0, 4.0])
+    parser.add_argument("--hnsw-m", type=int, default=0)
+    parser.add_argument("--hnsw-ef-construct", type=int, default=0)
+    parser.add_argument("--question-limit", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    client = QdrantClient(url=config.QDRANT_URL)
+    points = read_points(client, args.collection)
+    questions = load_questions(args.question_limit)
+    print(f"{len(points)} points, {len(questions)} questions")
+
+    embed_model = load_embedding_model()
+    vectors = embed_model.embed_documents(questions)
+
+    exact, _ = search(client, args.collection, vectors, args.k, search_params(exact=True))
+
+    results = []
+    for storage in STORAGE_SETTINGS:
+        name = f"{args.collection}_bench_{storage['quantization']}_{'disk' if storage['on_disk'] else 'ram'}"
+        if client.collection_exists(name):
+            client.delete_collection(name)
+        client.create_collection(
+            collection_name=name,
+            # Index straight away even though the corpus is small, otherwise Qdrant just brute-forces it
+            optimizers_config=OptimizersConfigDiff(indexing_threshold=1),
+            **collection_config(m=args.hnsw_m, ef_construct=args.hnsw_ef_construct, **storage),
+        )
+        for start in range(0, len(points), 256):
+            client.upsert(
+                collection_name=name,
+                points=[
+                    PointStruct(id=point.id, vector=point.vector, payload=point.payload)
+                    for point in points[start:start + 256]
+                ],
+                wait=True,
+            )
+
+        oversampling = args.oversampling if storage["quantization"] != "none" else [None]
+        for hnsw_ef, factor in itertools.product(args.hnsw_ef, oversampling):
+            params = search_params(hnsw_ef=hnsw_ef, oversampling=factor, rescore=True)
+            found, latencies = search(client, name, vectors, args.k, params)
+            recall = np.mean([len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(exact, found)])
+            row = {
+                **storage,
+                "hnsw_ef": hnsw_ef,
+                "oversampling": factor,
+                f"recall_at_{args.k}": round(float(recall), 4),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 2),
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+                "vector_ram_bytes_per_point": ram_bytes_per_point(**storage),
+                "vector_ram_mb_corpus": round(ram_bytes_per_point(**storage) * len(points) / 2**20, 2),
+            }
+            results.append(row)
+            print(json.dumps(row))
+
+        client.delete_collection(name)
+
+    report = {"collection": args.collection, "points": len(points), "k": args.k, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
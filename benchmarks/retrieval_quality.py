@@ -0,0 +1,198 @@
+# Retrieval quality and latency of HybridRetriever on the evaluation questions.
+#
+#   python benchmarks/retrieval_quality.py --top-k 5 10 --candidate-pool 20 50 --output retrieval.json
+#
+# The reference column of the evaluation spreadsheets names the control(s) that
+# answer each question ("ECC Guide, Section 1-1-1 ...", "١-٥-٣-١، ١-٥-٣-٢"). A
+# retrieved chunk is relevant when its control_id is one of them (and its guide is
+# the one named, when the reference names one). For every top_k / candidate pool
+# setting the report gives:
+#   - recall@k, hit rate@k, MRR@k and nDCG@k, for all questions and per subset
+#     (Arabic / English spreadsheet, questions that name a control ID or not),
+#   - p50/p95/p99 latency and single-threaded throughput of _get_relevant_documents.
+# No LLM is involved, and with --backend numpy nothing leaves the process either.
+# The retrieval cache is off; query vectors come from the embedding cache after the
+# untimed first pass (--no-embedding-cache puts the model back into every timing).
+# --shards searches the per-framework/language collections of `db_prep.py --shards`
+# instead of the single one, so the two layouts can be compared on the same questions.
+# The JSON report is stable across runs, diff it between releases.
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "code"))
+
+import config
+from agent_prep import build_retriever, extract_control_ids
+from bm25_index import normalize_arabic
+from context_packer import control_key
+from embeddings import load_embedding_model
+from language import query_framework
+
+EVAL_FILES = [
+    ("ar", "Final_ECC_CSCC_Evaluation_AR_Dataset.xlsx"),
+    ("en", "Final_ECC_CSCC_Evaluation_ENG_Dataset.xlsx"),
+]
+
+reference_id_pattern = re.compile(r'\d+(?:-\d+)+')
+
+
+def reference_controls(reference):
+    """(control IDs, framework or None) named by a reference cell."""
+    reference = normalize_arabic(str(reference))
+    ids = list(dict.fromkeys(reference_id_pattern.findall(reference)))
+    return ids, query_framework(reference)
+
+
+def load_questions(limit):
+    # (question, reference IDs, framework, spreadsheet language); rows without a
+    # control ID in the reference column (the English header row) are skipped
+    questions = []
+    skipped = 0
+    for language, name in EVAL_FILES:
+        df = pd.read_excel(os.path.join(ROOT_DIR, "evaluation", "evaluation datasets", name))
+        for question, reference in zip(df[df.columns[0]], df[df.columns[2]]):
+            ids, framework = reference_controls(reference)
+            if pd.isna(question) or not ids:
+                skipped += 1
+                continue
+            questions.append((str(question), ids, framework, language))
+    return (questions[:limit] if limit else questions), skipped
+
+
+def gain_matrix(results, questions, depth):
+    # gains[q, r] = 1 when the r-th chunk is the first one of a reference control
+    gains = np.zeros((len(questions), depth), dtype=np.float32)
+    for row, (docs, (_, ids, framework, _)) in enumerate(zip(results, questions)):
+        found = set()
+        for rank, doc in enumerate(docs[:depth]):
+            doc_framework, control_id = control_key(doc)
+            if control_id in ids and control_id not in found and framework in (None, doc_framework):
+                found.add(control_id)
+                gains[row, rank] = 1.0
+    return gains
+
+
+def ranking_metrics(gains, relevant_counts, cutoffs):
+    metrics = {}
+    discounts = 1.0 / np.log2(np.arange(2, gains.shape[1] + 2))
+    for k in cutoffs:
+        top = gains[:, :k]
+        hit = top.any(axis=1)
+        first = top.argmax(axis=1)
+        ideal = (np.arange(k)[None, :] < relevant_counts[:, None]) * discounts[:k]
+        metrics[f"recall_at_{k}"] = top.sum(axis=1) / relevant_counts
+        metrics[f"hit_rate_at_{k}"] = hit.astype(np.float32)
+        metrics[f"mrr_at_{k}"] = np.where(hit, 1.0 / (first + 1), 0.0)
+        metrics[f"ndcg_at_{k}"] = (top * discounts[:k]).sum(axis=1) / ideal.sum(axis=1)
+    return metrics
+
+
+def summarize(latencies, wall_s):
+    latencies = np.array(latencies)
+    return {
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        "latency_ms_p99": round(float(np.percentile(latencies, 99)), 3),
+        "latency_ms_mean": round(float(latencies.mean()), 3),
+        "throughput_qps": round(len(latencies) / wall_s, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k / MRR / nDCG and latency of HybridRetriever.")
+    parser.add_argument("--backend", choices=["qdrant", "numpy"], default=config.RETRIEVER_BACKEND)
+    parser.add_argument("--shards", action=argparse.BooleanOptionalAction, default=config.SHARDING)
+    parser.add_argument("--top-k", type=int, nargs="+", default=[10])
+    parser.add_argument("--candidate-pool", type=int, nargs="+", default=[config.RETRIEVAL_CANDIDATE_POOL])
+    parser.add_argument("--cutoffs", type=int, nargs="+", default=[1, 3, 5, 10], help="k of the metrics@k")
+    parser.add_argument("--repeats", type=int, default=3, help="timed passes over the questions")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="embed every query in every pass")
+    parser.add_argument("--question-limit", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    questions, skipped = load_questions(args.question_limit)
+    relevant_counts = np.array([len(ids) for _, ids, _, _ in questions], dtype=np.float32)
+    subsets = {
+        "all": np.ones(len(questions), dtype=bool),
+        "ar": np.array([language == "ar" for *_, language in questions], dtype=bool),
+        "en": np.array([language == "en" for *_, language in questions], dtype=bool),
+        "control_id_in_question": np.array([bool(extract_control_ids(q)) for q, *_ in questions], dtype=bool),
+    }
+    subsets["free_text"] = ~subsets["control_id_in_question"]
+    print(f"{len(questions)} questions ({skipped} rows without a reference control skipped)")
+
+    embed_model = load_embedding_model(cache_dir="" if args.no_embedding_cache else config.EMBEDDING_CACHE_DIR)
+    retriever = build_retriever(embed_model, backend=args.backend, use_cache=False, sharding=args.shards)
+    # With shards, every shard ranks its own top_k before they are merged
+    searchers = [retriever, *getattr(retriever, "shards", {}).values()]
+
+    results = []
+    for top_k, candidate_pool in itertools.product(args.top_k, args.candidate_pool):
+        for searcher in searchers:
+            searcher.top_k = top_k
+            searcher.candidate_pool = candidate_pool
+
+        # Untimed pass: the rankings the metrics are computed on, and warm caches/connections
+        rankings = [retriever._get_relevant_documents(question) for question, *_ in questions]
+
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for question, *_ in questions:
+                query_start = time.perf_counter()
+                retriever._get_relevant_documents(question)
+                latencies.append((time.perf_counter() - query_start) * 1000)
+        wall_s = time.perf_counter() - start
+
+        cutoffs = sorted({k for k in args.cutoffs if k <= top_k} | {top_k})
+        per_question = ranking_metrics(gain_matrix(rankings, questions, top_k), relevant_counts, cutoffs)
+        row = {
+            "top_k": top_k,
+            "candidate_pool": candidate_pool,
+            **summarize(latencies, wall_s),
+            "metrics": {
+                subset: {
+                    "questions": int(selected.sum()),
+                    **{
+                        name: round(float(values[selected].mean()), 4) if selected.any() else None
+                        for name, values in per_question.items()
+                    },
+                }
+                for subset, selected in subsets.items()
+            },
+        }
+        results.append(row)
+        print(json.dumps({key: value for key, value in row.items() if key != "metrics"}))
+
+    report = {
+        "backend": args.backend,
+        "shards": sorted(getattr(retriever, "shards", {})),
+        "collection": config.COLLECTION_NAME,
+        "embedding_model": config.EMBEDDING_MODEL_NAME,
+        "embedding_cache": not args.no_embedding_cache,
+        "hybrid_sparse": retriever.sparse_index is not None,
+        "partitioning": retriever.partitioning,
+        "cross_language_fallback": retriever.cross_language_fallback,
+        "questions": len(questions),
+        "repeats": args.repeats,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
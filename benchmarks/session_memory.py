@@ -0,0 +1,62 @@
+# Resident memory against the number of concurrent chat sessions.
+#
+#   python benchmarks/session_memory.py --sessions 4 --mode shared
+#   python benchmarks/session_memory.py --sessions 4 --mode isolated
+#
+# "isolated" is the old app.py behaviour (initialize_agent() per session, so one
+# e5 model per session); "shared" uses get_shared_agent() with a thread id per
+# session. Each session runs one retrieval so the model is actually exercised.
+# Run each mode in a fresh process, the numbers are process-wide.
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code"))
+
+from agent_prep import initialize_agent, get_shared_agent
+
+
+def rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        # Linux fallback
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure resident memory per concurrent session.")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--mode", choices=["shared", "isolated"], default="shared")
+    parser.add_argument("--query", default="What are the requirements for multi-factor authentication?")
+    args = parser.parse_args()
+
+    rows = [{"sessions": 0, "rss_mb": round(rss_mb(), 1)}]
+    print(f"baseline: {rows[0]['rss_mb']} MB")
+
+    sessions = []
+    for n in range(1, args.sessions + 1):
+        start = time.perf_counter()
+        if args.mode == "shared":
+            graph, retriever = get_shared_agent()
+        else:
+            graph, retriever = initialize_agent()
+        config = {"configurable": {"thread_id": f"bench-{uuid.uuid4()}"}}
+        retriever.invoke(args.query)
+        sessions.append((graph, retriever, config))
+
+        row = {"sessions": n, "rss_mb": round(rss_mb(), 1), "setup_s": round(time.perf_counter() - start, 2)}
+        rows.append(row)
+        print(f"{n} session(s): {row['rss_mb']} MB (setup {row['setup_s']}s)")
+
+    print(json.dumps({"mode": args.mode, "results": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# Search latency of the in-process NumPy index against the Qdrant server.
+#
+#   python benchmarks/vector_backends.py --k 10 --output vector_backends.json
+#
+# The points of docs_collection (vectors and payloads) are copied into a temporary
+# NumPy index, so both backends search exactly the same data. Every evaluation
+# question is embedded once and then searched on both backends:
+#   - unfiltered top-k,
+#   - top-k restricted to one control (control_id / relevant_ids filter, the same
+#     filter the retriever uses when a question names a control ID).
+# Only the search itself is timed (the embedding is excluded). The top-k overlap
+# with Qdrant shows that both return the same points.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Filter, FieldCondition, MatchAny
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "code"))
+
+import config
+from embeddings import load_embedding_model
+from numpy_index import NumpyVectorIndex, write_numpy_index
+from qdrant_settings import search_params
+
+EVAL_FILES = [
+    "Final_ECC_CSCC_Evaluation_AR_Dataset.xlsx",
+    "Final_ECC_CSCC_Evaluation_ENG_Dataset.xlsx",
+]
+
+
+def load_questions(limit):
+    questions = []
+    for name in EVAL_FILES:
+        df = pd.read_excel(os.path.join(ROOT_DIR, "evaluation", "evaluation datasets", name))
+        questions.extend(str(q) for q in df[df.columns[0]].dropna())
+    return questions[:limit] if limit else questions
+
+
+def read_points(client, collection_name):
+    points = []
+    offset = None
+    while True:
+        batch, offset = client.scroll(
+            collection_name=collection_name, limit=256, offset=offset, with_payload=True, with_vectors=True
+        )
+        points.extend(batch)
+        if offset is None:
+            return points
+
+
+def summarize(latencies):
+    latencies = np.array(latencies)
+    return {
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        "latency_ms_mean": round(float(latencies.mean()), 3),
+    }
+
+
+def timed(search, vectors, control_ids):
+    latencies = []
+    results = []
+    for vector, control_id in zip(vectors, control_ids):
+        start = time.perf_counter()
+        found = search(vector, control_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([str(point.id) for point in found])
+    return results, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the NumPy index with Qdrant.")
+    parser.add_argument("--collection", default=config.COLLECTION_NAME)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--question-limit", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    client = QdrantClient(url=config.QDRANT_URL)
+    points = read_points(client, args.collection)
+    questions = load_questions(args.question_limit)
+    print(f"{len(points)} points, {len(questions)} questions")
+
+    index_dir = tempfile.mkdtemp(prefix="numpy_index_")
+    try:
+        start = time.perf_counter()
+        write_numpy_index(
+            index_dir,
+            [str(point.id) for point in points],
+            np.array([point.vector for point in points], dtype=np.float32),
+            [point.payload for point in points],
+        )
+        index = NumpyVectorIndex(index_dir, args.collection)
+        load_s = time.perf_counter() - start
+
+        embed_model = load_embedding_model()
+        vectors = embed_model.embed_documents(questions)
+
+        # Filter every question on the control of its best unfiltered hit
+        control_ids = [
+            index.search(vector, 1)[0].payload["metadata"]["control_id"] for vector in vectors
+        ]
+        params = search_params()
+
+        def qdrant_search(vector, control_id):
+            query_filter = None
+            if control_id is not None:
+                query_filter = Filter(should=[
+                    FieldCondition(key="metadata.relevant_ids", match=MatchAny(any=[control_id])),
+                    FieldCondition(key="metadata.control_id", match=MatchAny(any=[control_id])),
+                ])
+            return client.query_points(
+                collection_name=args.collection,
+                query=vector,
+                query_filter=query_filter,
+                limit=args.k,
+                search_params=params,
+                with_payload=True,
+            ).points
+
+        def numpy_search(vector, control_id):
+            mask = None
+            if control_id is not None:
+                mask = index.mask(control_ids=[control_id], relevant_ids=[control_id])
+            return index.search(vector, args.k, mask=mask)
+
+        results = []
+        for mode, filters in (("unfiltered", [None] * len(vectors)), ("control_filter", control_ids)):
+            qdrant_found, qdrant_latencies = timed(qdrant_search, vectors, filters)
+            numpy_found, numpy_latencies = timed(numpy_search, vectors, filters)
+            overlap = np.mean([
+                len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(qdrant_found, numpy_found)
+            ])
+            for backend, latencies in (("qdrant", qdrant_latencies), ("numpy", numpy_latencies)):
+                row = {"backend": backend, "mode": mode, **summarize(latencies)}
+                if backend == "numpy":
+                    row[f"overlap_at_{args.k}_with_qdrant"] = round(float(overlap), 4)
+                results.append(row)
+                print(json.dumps(row))
+
+        report = {
+            "collection": args.collection,
+            "points": len(points),
+            "k": args.k,
+            "numpy_index_load_s": round(load_s, 3),
+            "numpy_index_mb": round(os.path.getsize(os.path.join(index_dir, "vectors.f32")) / 2**20, 2),
+            "results": results,
+        }
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
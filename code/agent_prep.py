@@ -2,12 +2,17 @@
 
 import os
 import re
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import arabic_reshaper
 from bidi.algorithm import get_display
 
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.schema import BaseRetriever
+from langchain.schema import BaseRetriever, Document
 from langchain.chat_models import init_chat_model
 
 
@@ -16,18 +21,35 @@ from pydantic import Field
 from typing import Any
 
 from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, MatchAny
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http.models import Filter, FieldCondition, MatchAny, MatchValue, QueryRequest
 import certifi
 
 from langgraph.graph import MessagesState, StateGraph
-from langchain_core.tools import tool
-from langchain_core.messages import SystemMessage
+from langchain_core.tools import StructuredTool
+from langchain_core.runnables import RunnableLambda
+from langchain_core.messages import SystemMessage, AIMessage, AIMessageChunk, trim_messages
+from langchain_core.messages.utils import count_tokens_approximately
 from langgraph.graph import END
 from langgraph.prebuilt import ToolNode, tools_condition
-from langgraph.checkpoint.memory import MemorySaver
 from dotenv import load_dotenv
 
+import config
+from embeddings import load_embedding_model
+from control_index import ControlHierarchy, normalize_control_id, control_sort_key, hierarchy_path
+from retrieval_cache import RetrievalCache
+from conversation_store import build_checkpointer
+from qdrant_settings import search_params
+from numpy_index import NumpyVectorIndex, numpy_index_path
+from bm25_index import BM25IndexFile, bm25_path, tokenize, reciprocal_rank_fusion
+from context_packer import pack_context, approx_tokens
+from ingest_pipeline import batched
+from query_router import QueryRouter
+from language import detect_language, query_framework
+from shards import load_shards, shards_path, route_shards, shared_query_vector, SharedQueryVector
+from tracing import span, trace_request, bind_context, start_metrics_server
+from fake_llm import FakeChatModel
+
 
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -43,153 +65,951 @@ os.environ['SSL_CERT_FILE'] = certifi.where()
 
 # Define auxiliary functions
 ## A function to extract contol IDs
+control_id_pattern = re.compile(r'\b\d+(?:.\d+){0,3}\b')
+
 def extract_control_ids(query: str):
-    return re.findall(r'\b\d+(?:.\d+){0,3}\b', query)
+    return control_id_pattern.findall(query)
 
 
-## A function to normalize IDs
-def normalize_control_id(raw_id):
-    # Arabic-Indic to Western numerals
-    arabic_to_western = str.maketrans("٠١٢٣٤٥٦٧٨٩۱۲۳۷۸", "012345678912378")
-    normalized = raw_id.translate(arabic_to_western)
-    
-    # Replace separators to standard format
-    normalized = normalized.replace('.', '-').replace(',', '-').strip()
-    
-    return normalized
+## Words that do not change what a control-ID lookup should return ("what is 2-3-1?")
+lookup_filler_words = {
+    # English
+    "what", "whats", "is", "are", "the", "a", "an", "of", "about", "for", "and", "or", "to", "in",
+    "me", "tell", "show", "give", "explain", "describe", "define", "mean", "means", "meaning",
+    "does", "do", "say", "says", "text", "details", "detail", "please", "control", "controls",
+    "subcontrol", "subcontrols", "sub", "clause", "id", "number", "ecc", "cscc", "nca",
+    # Arabic
+    "ما", "ماهو", "ماهي", "هو", "هي", "ماذا", "عن", "في", "من", "و", "او", "أو", "اشرح", "وضح",
+    "اعطني", "أعطني", "يقول", "ينص", "معنى", "نص", "تفاصيل", "الضابط", "ضابط", "الضوابط", "ضوابط",
+    "الفرعي", "رقم", "لو", "سمحت",
+}
+
+def has_free_text_intent(query: str):
+    # True when the query asks something beyond just naming control IDs
+    words = re.findall(r'\w+', control_id_pattern.sub(" ", query).lower())
+    return any(word not in lookup_filler_words and not word.isdigit() for word in words)
+
+
+def conversation_window(messages, token_budget):
+    # The human/AI turns the LLM gets to see: tool calls and retrieved contexts are
+    # dropped, and the oldest turns are trimmed so the history fits the token budget.
+    conversation_messages = [
+        message
+        for message in messages
+        if message.type in ("human", "system")
+        or (message.type == "ai" and not message.tool_calls)
+    ]
+    window = trim_messages(
+        conversation_messages,
+        max_tokens=token_budget,
+        token_counter=count_tokens_approximately,
+        strategy="last",
+        start_on="human",
+        include_system=True,
+    )
+    # Always keep the current question, even if it alone is over budget
+    if not window or window[-1] is not conversation_messages[-1]:
+        window = conversation_messages[-1:]
+    return window
+
+
+def llm_usage(prompt_messages, response):
+    # Token counts reported by the provider, estimated when it reports none (e.g. while streaming)
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return {"prompt_tokens": usage.get("input_tokens", 0), "completion_tokens": usage.get("output_tokens", 0)}
+    return {
+        "prompt_tokens": count_tokens_approximately(prompt_messages),
+        "completion_tokens": count_tokens_approximately([response]),
+        "tokens_estimated": True,
+    }
+
+
+## The partition of a search over a whole collection (or shard)
+whole_shard = {"language": None, "framework": None}
+
+
+def partition_key(partition):
+    return tuple(sorted(partition.items()))
+
+
+## Dense results fetched ahead by _batch_get_relevant_documents: (retriever id, partition key) -> points
+prefetched_dense = contextvars.ContextVar("prefetched_dense", default=None)
+
+## Whether the shards of a ShardedRetriever search skip the dense side, None to let each decide
+sparse_only = contextvars.ContextVar("sparse_only", default=None)
 
 
 class HybridRetriever(BaseRetriever):
-    retriever: Any = Field() # This is the QdrantVectorStore
+    retriever: Any = Field() # This is the QdrantVectorStore (None with the numpy backend)
     embedding_model: Any = Field() # This is the HuggingFaceEmbeddings model
     top_k: int = Field(default=10)
+    hierarchy: Any = Field(default=None) # ControlHierarchy saved by db_prep.py (optional)
+    cache: Any = Field(default=None) # RetrievalCache (optional)
+    async_client: Any = Field(default=None) # AsyncQdrantClient used by the async path (optional)
+    embed_executor: Any = Field(default=None) # Bounded executor that runs the embedding model for async calls
+    search_params: Any = Field(default=None) # Qdrant SearchParams (hnsw_ef, quantization oversampling/rescore)
+    vector_index: Any = Field(default=None) # NumpyVectorIndex searched in-process instead of Qdrant (optional)
+    sparse_index: Any = Field(default=None) # BM25Index whose hits are fused with the dense ones (optional)
+    rrf_k: int = Field(default=60)
+    sparse_only_max_terms: int = Field(default=3) # keyword queries up to this many terms may skip the dense search
+    sparse_only_min_coverage: float = Field(default=1.0) # idf-weighted share of those terms the top BM25 hit must match
+    sparse_only_min_idf: float = Field(default=0.0) # and the idf each of them must have (common terms need the dense side)
+    partitioning: bool = Field(default=False) # search only the question's language (and the framework it names)
+    cross_language_fallback: bool = Field(default=True) # fill missing top_k slots from the other language
+    candidate_pool: int = Field(default=50) # depth of the filtered / fused rankings before the top_k cut
+    shard_scores: bool = Field(default=False) # shard of a ShardedRetriever: dense / BM25 scores kept in the metadata
+
+    def _collection_name(self):
+        if self.vector_index is not None:
+            return self.vector_index.collection_name
+        return self.retriever.collection_name
+
+    def _expand_control_ids(self, control_ids):
+        # Expand through the hierarchy index: the IDs, their parents and sub-controls
+        return list(dict.fromkeys(
+            related for cid in control_ids for related in self.hierarchy.expand(cid)
+        ))
+
+    def _control_id_filter(self, control_ids):
+        if self.hierarchy is not None:
+            return Filter(
+                must=[FieldCondition(key="metadata.control_id", match=MatchAny(any=self._expand_control_ids(control_ids)))]
+            )
+        return Filter(
+            should=[
+                FieldCondition(
+                    key="metadata.relevant_ids",
+                    match=MatchAny(any=control_ids)
+                ),
+                FieldCondition(
+                    key="metadata.control_id",
+                    match=MatchAny(any=control_ids)
+                )
+            ]
+        )
+
+    def _partition(self, query):
+        # The language of the question (None when it has no letters, e.g. just "2-3-1")
+        # and the framework of config.FRAMEWORKS it names explicitly ("ECC", "critical systems", "DCC", ...)
+        if not self.partitioning:
+            return {"language": None, "framework": None}
+        return {"language": detect_language(query, default=None), "framework": query_framework(query)}
+
+    def _search_filter(self, control_ids, partition):
+        # Qdrant filter for the control IDs (if any) inside the language/framework partition
+        conditions = [
+            FieldCondition(key=f"metadata.{field}", match=MatchValue(value=value))
+            for field, value in partition.items()
+            if value is not None
+        ]
+        if not conditions:
+            return self._control_id_filter(control_ids) if control_ids else None
+        if control_ids:
+            conditions.append(self._control_id_filter(control_ids))
+        return Filter(must=conditions)
+
+    def _index_mask(self, index, control_ids, partition):
+        # Same rows as _search_filter, from the precomputed masks of the NumPy / BM25 index
+        if not control_ids and all(value is None for value in partition.values()):
+            return None
+        if not control_ids:
+            return index.mask(**partition)
+        if self.hierarchy is not None:
+            return index.mask(control_ids=self._expand_control_ids(control_ids), **partition)
+        return index.mask(control_ids=control_ids, relevant_ids=control_ids, **partition)
+
+    def _sparse_search(self, query, control_ids, partition):
+        # BM25 hits over the same chunks the dense search is restricted to, and whether
+        # they are good enough on their own (a short keyword query fully matched by the top hit)
+        if self.sparse_index is None:
+            return [], False
+        with span("sparse_search") as current:
+            # One version of the index for the mask and the search, even if db_prep.py rewrites it meanwhile
+            index = self.sparse_index.refresh()
+            mask = self._index_mask(index, control_ids, partition)
+            hits, coverage = index.search(query, self.candidate_pool, mask=mask)
+            decided = sparse_only.get()
+            confident = decided if decided is not None else (
+                bool(hits)
+                and len(set(tokenize(query))) <= self.sparse_only_max_terms
+                and coverage >= self.sparse_only_min_coverage
+                and index.min_idf(query) >= self.sparse_only_min_idf
+            )
+            current.set(candidates=len(hits), coverage=round(coverage, 3), sparse_only=confident)
+        return hits, confident
+
+    def _embed_query(self, query):
+        shared = shared_query_vector.get()
+        if shared is not None:
+            # Searched as one shard of a ShardedRetriever: the shards embed the query once between them
+            return shared.get(lambda: self._run_embedding(query))
+        return self._run_embedding(query)
+
+    def _run_embedding(self, query):
+        with span("embed_query"):
+            return self.embedding_model.embed_query(query)
+
+    async def _aembed_query(self, query):
+        shared = shared_query_vector.get()
+        if shared is not None:
+            return await shared.aget(lambda: self._arun_embedding(query))
+        return await self._arun_embedding(query)
+
+    async def _arun_embedding(self, query):
+        # Waiting for a free executor thread counts as part of the stage
+        with span("embed_query"):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.embed_executor, self.embedding_model.embed_query, query
+            )
+
+    def _fuse(self, dense_docs, sparse_hits):
+        # Reciprocal rank fusion of the dense and the BM25 ranking
+        if not sparse_hits:
+            return dense_docs[:self.top_k]
+        sparse_docs = self._points_to_documents(sparse_hits, "_sparse_score")
+        fused = reciprocal_rank_fusion(
+            [dense_docs, sparse_docs],
+            key=lambda doc: str(doc.metadata["_id"]),
+            k=self.rrf_k,
+        )[:self.top_k]
+        if self.shard_scores:
+            # A chunk found by both searches keeps both scores
+            sparse_scores = {str(doc.metadata["_id"]): doc.metadata["_sparse_score"] for doc in sparse_docs}
+            for doc in fused:
+                if str(doc.metadata["_id"]) in sparse_scores:
+                    doc.metadata["_sparse_score"] = sparse_scores[str(doc.metadata["_id"])]
+        return fused
+
+    def _hierarchy_order(self, control_ids):
+        # Requested IDs first, then their parents, then sub-controls in document order
+        order = {}
+        for cid in control_ids:
+            order.setdefault(cid, len(order))
+        if self.hierarchy is not None:
+            for cid in control_ids:
+                for related in self.hierarchy.expand(cid):
+                    order.setdefault(related, len(order))
+        return order
+
+    def _lookup_sort_key(self, order, control_id):
+        return (order.get(control_id, len(order)), control_sort_key(control_id))
+
+    def _lookup_control_ids(self, control_ids, partition):
+        # Fast path: read the matching points through the payload indexes, no embedding needed
+        with span("id_lookup", backend="qdrant") as current:
+            points, _ = self.retriever.client.scroll(
+                collection_name=self.retriever.collection_name,
+                scroll_filter=self._search_filter(control_ids, partition),
+                limit=256,  # scroll is not ranked, so take every match and order it below
+                with_payload=True,
+                with_vectors=False,
+            )
+            current.set(candidates=len(points))
+        return self._order_lookup(points, control_ids)
+
+    def _order_lookup(self, points, control_ids):
+        order = self._hierarchy_order(control_ids)
+        points.sort(key=lambda point: self._lookup_sort_key(order, point.payload["metadata"]["control_id"]))
+        return self._points_to_documents(points[:self.top_k])
+
+    def _points_to_documents(self, points, score_key=None):
+        # Same shape as the documents QdrantVectorStore returns
+        docs = [
+            Document(
+                page_content=point.payload["page_content"],
+                metadata={
+                    **point.payload["metadata"],
+                    "_id": point.id,
+                    "_collection_name": self._collection_name(),
+                },
+            )
+            for point in points
+        ]
+        if self.shard_scores and score_key:
+            # ShardedRetriever ranks the results of all its shards on these
+            for doc, point in zip(docs, points):
+                doc.metadata[score_key] = point.score
+        return docs
+
+    def _prefetched_dense(self, partition, k):
+        # (doc, score) pairs of this dense search if a batch already ran it, otherwise None
+        prefetched = prefetched_dense.get()
+        points = None if prefetched is None else prefetched.get((id(self), partition_key(partition)))
+        if points is None or k > self.candidate_pool:
+            return None
+        return [(doc, point.score) for doc, point in zip(self._points_to_documents(points[:k]), points)]
+
+    def _with_dense_scores(self, docs_and_scores):
+        if self.shard_scores:
+            for doc, score in docs_and_scores:
+                doc.metadata["_dense_score"] = score
+        return [doc for doc, _ in docs_and_scores]
 
     def _get_relevant_documents(self, query: str):
         # 1. Normalize and extract IDs
         raw_ids = extract_control_ids(query)
         control_ids = [normalize_control_id(cid) for cid in raw_ids]
+        return self._retrieve(query, control_ids)
 
-        # 2. Re-run with the corrected filter logic
+    def _retrieve(self, query, control_ids, lookup_cache=True):
+        # lookup_cache=False when the caller already found the query missing from the cache
+        with span("retrieval", control_ids=len(control_ids)) as current:
+            if self.cache is None:
+                docs = self._search(query, control_ids)
+                current.set(candidates=len(docs))
+                return docs
+
+            cached = self.cache.get(query, control_ids, self.top_k) if lookup_cache else None
+            current.set(cache_hit=cached is not None)
+            if cached is not None:
+                current.set(candidates=len(cached))
+                return cached
+            docs = self._search(query, control_ids)
+            self.cache.put(query, control_ids, self.top_k, docs)
+            current.set(candidates=len(docs))
+            return docs
+
+    def _fill_from_other_language(self, docs, other_docs):
+        # Keep the partition's results first, then add what the other language adds
+        seen = {str(doc.metadata["_id"]) for doc in docs}
+        extra = [doc for doc in other_docs if str(doc.metadata["_id"]) not in seen]
+        return docs + extra[:self.top_k - len(docs)]
+
+    def _search(self, query, control_ids):
+        partition = self._partition(query)
+        docs = self._search_partition(query, control_ids, partition)
+        if partition["language"] is not None and self.cross_language_fallback and len(docs) < self.top_k:
+            other_docs = self._search_partition(query, control_ids, {**partition, "language": None})
+            docs = self._fill_from_other_language(docs, other_docs)
+        return docs
+
+    def _search_partition(self, query, control_ids, partition):
+        if self.vector_index is not None:
+            return self._index_search(query, control_ids, partition)
+
+        # 2. Pure ID lookups ("what is 2-3-1?") skip the embedding model entirely
+        if control_ids and not has_free_text_intent(query):
+            return self._lookup_control_ids(control_ids, partition)
+
+        # 3. Keyword questions the BM25 index answers confidently skip the embedding model
+        sparse_hits, confident = self._sparse_search(query, control_ids, partition)
+        if confident:
+            return self._points_to_documents(sparse_hits[:self.top_k], "_sparse_score")
+
+        # 4. IDs plus a real question: dense search restricted to those controls
         if control_ids:
             # print(f"inside HybridRetriever and found control ids: {control_ids}")
-            # filter_obj = control_id_filter(query)
             # The QdrantVectorStore `similarity_search` method correctly takes a filter.
-            candidate_docs = self.retriever.similarity_search_with_score(
-                query=query,
-                k=50,  # Or a larger number to get a good pool
-                # filter=filter_obj
-                filter=Filter(
-                        should=[
-                            FieldCondition(
-                                key="metadata.relevant_ids",
-                                match=MatchAny(any=control_ids)
-                            ),
-                            FieldCondition(
-                                key="metadata.control_id",
-                                match=MatchAny(any=control_ids)
-                            )
-                        ]
+            vector = self._embed_query(query)
+            with span("dense_search", backend="qdrant", filtered=True) as current:
+                candidate_docs = self._prefetched_dense(partition, self.candidate_pool)
+                current.set(prefetched=candidate_docs is not None)
+                if candidate_docs is None:
+                    candidate_docs = self.retriever.similarity_search_with_score_by_vector(
+                        vector,
+                        k=self.candidate_pool,  # Or a larger number to get a good pool
+                        filter=self._search_filter(control_ids, partition),
+                        search_params=self.search_params,
                     )
-            )
+                current.set(candidates=len(candidate_docs))
             # print(f"finished filtered retrival. got: \n {candidate_docs}")
-            # You don't need to re-rank by score here, as the k=50 query is already sorted by Qdrant.
-            final_docs = []
-            for doc, _ in candidate_docs[:self.top_k]:
-                final_docs.append(doc)
-            return final_docs
+            # You don't need to re-rank by score here, as the candidate_pool query is already sorted by Qdrant.
+            final_docs = self._with_dense_scores(candidate_docs)
+            return self._fuse(final_docs, sparse_hits)
 
-        # 3. No control IDs, fall back to unfiltered search.
+        # 5. No control IDs, fall back to unfiltered search.
         # This is the correct way to call the retriever's search method.
         # return self.retriever._get_relevant_documents(query) 
-        candidate_docs = self.retriever.similarity_search(query, k=self.top_k)
+        vector = self._embed_query(query)
+        with span("dense_search", backend="qdrant", filtered=False) as current:
+            k = self.candidate_pool if sparse_hits else self.top_k  # a deeper dense ranking to fuse with
+            candidate_docs = self._prefetched_dense(partition, k)
+            current.set(prefetched=candidate_docs is not None)
+            if candidate_docs is None:
+                candidate_docs = self.retriever.similarity_search_with_score_by_vector(
+                    vector,
+                    k=k,
+                    filter=self._search_filter([], partition),
+                    search_params=self.search_params,
+                )
+            current.set(candidates=len(candidate_docs))
         # print(f"inside HybridRetriever and no ids detected. got: \n {candidate_docs}")
-        return candidate_docs
+        return self._fuse(self._with_dense_scores(candidate_docs), sparse_hits)
+
+    def _index_search(self, query, control_ids, partition):
+        # Same steps as _search_partition against the in-process index: exact scores, no network hop.
+        # One version of the index for the mask and the search, even if db_prep.py rewrites it meanwhile
+        index = self.vector_index.refresh()
+        mask = self._index_mask(index, control_ids, partition)
+        if control_ids and not has_free_text_intent(query):
+            with span("id_lookup", backend="numpy") as current:
+                points = index.scroll(mask)
+                current.set(candidates=len(points))
+            return self._order_lookup(points, control_ids)
+
+        sparse_hits, confident = self._sparse_search(query, control_ids, partition)
+        if confident:
+            return self._points_to_documents(sparse_hits[:self.top_k], "_sparse_score")
+
+        vector = self._embed_query(query)
+        with span("dense_search", backend="numpy", filtered=mask is not None) as current:
+            dense_points = index.search(vector, self.candidate_pool if sparse_hits else self.top_k, mask=mask)
+            current.set(candidates=len(dense_points))
+        return self._fuse(self._points_to_documents(dense_points, "_dense_score"), sparse_hits)
+
+    def _prefetch_targets(self, query, control_ids):
+        # (retriever, partition) of the first dense search this question runs
+        return [(self, self._partition(query))]
+
+    def _batch_get_relevant_documents(self, queries, batch_size=32):
+        """_get_relevant_documents of many questions at once.
+
+        The query vectors are computed in batched forward passes and, with Qdrant, the
+        first dense search of every question goes out in one batch request per
+        collection. Each question then runs the usual pipeline (cache, ID lookups,
+        BM25, cross-language fallback), which takes its vector and dense results from there.
+        """
+        control_ids = [[normalize_control_id(cid) for cid in extract_control_ids(query)] for query in queries]
+        # ID lookups need no vector, cached questions no search at all (each is looked up once)
+        cached, searched = {}, []
+        for i, query in enumerate(queries):
+            if control_ids[i] and not has_free_text_intent(query):
+                continue
+            hit = None if self.cache is None else self.cache.get(query, control_ids[i], self.top_k)
+            if hit is not None:
+                cached[i] = hit
+            else:
+                searched.append(i)
+
+        vectors = {}
+        with span("embed_batch", queries=len(searched)):
+            for batch in batched(searched, batch_size):
+                for i, vector in zip(batch, self.embedding_model.embed_documents([queries[i] for i in batch])):
+                    vectors[i] = vector
+
+        requests = {}  # retriever id -> (retriever, [(question, partition key, QueryRequest)])
+        for i in searched:
+            for searcher, partition in self._prefetch_targets(queries[i], control_ids[i]):
+                if searcher.retriever is None:
+                    continue  # in-process index, nothing to batch
+                requests.setdefault(id(searcher), (searcher, []))[1].append((
+                    i,
+                    partition_key(partition),
+                    QueryRequest(
+                        query=vectors[i],
+                        filter=searcher._search_filter(control_ids[i], partition),
+                        limit=searcher.candidate_pool,
+                        params=searcher.search_params,
+                        with_payload=True,
+                    ),
+                ))
+        prefetched = {i: {} for i in searched}
+        for searcher, entries in requests.values():
+            with span("dense_search_batch", backend="qdrant", queries=len(entries)):
+                for batch in batched(entries, batch_size):
+                    responses = searcher.retriever.client.query_batch_points(
+                        collection_name=searcher.retriever.collection_name,
+                        requests=[request for _, _, request in batch],
+                    )
+                    for (i, key, _), response in zip(batch, responses):
+                        prefetched[i][(id(searcher), key)] = response.points
+
+        results = []
+        for i, query in enumerate(queries):
+            if i in cached:
+                with span("retrieval", control_ids=len(control_ids[i]), cache_hit=True, candidates=len(cached[i])):
+                    results.append(cached[i])
+                continue
+            vector_token = shared_query_vector.set(SharedQueryVector(vectors[i]) if i in vectors else None)
+            dense_token = prefetched_dense.set(prefetched.get(i))
+            try:
+                results.append(self._retrieve(query, control_ids[i], lookup_cache=i not in vectors))
+            finally:
+                prefetched_dense.reset(dense_token)
+                shared_query_vector.reset(vector_token)
+        return results
 
     async def _aget_relevant_documents(self, query: str):
-        return self._get_relevant_documents(query)
-    
+        if self.async_client is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.embed_executor, bind_context(self._get_relevant_documents, query)
+            )
+
+        raw_ids = extract_control_ids(query)
+        control_ids = [normalize_control_id(cid) for cid in raw_ids]
 
+        with span("retrieval", control_ids=len(control_ids)) as current:
+            if self.cache is None:
+                docs = await self._asearch(query, control_ids)
+                current.set(candidates=len(docs))
+                return docs
 
-def initialize_agent():
-    
-    # Load the pre-built Chroma vector store
-    print("\nLoading the embedding model...\n")
-    # Define the embedding model used to create the store. It must be the same one.
-    model_name = "intfloat/multilingual-e5-large"
-    model_kwargs = {'device': 'cpu'}
-    encode_kwargs = {'normalize_embeddings': False}
-    embed_model = HuggingFaceEmbeddings(
-        model_name=model_name,
-        model_kwargs=model_kwargs,
-        encode_kwargs=encode_kwargs,
-    )
+            cached = self.cache.get(query, control_ids, self.top_k)
+            current.set(cache_hit=cached is not None)
+            if cached is not None:
+                current.set(candidates=len(cached))
+                return cached
+            docs = await self._asearch(query, control_ids)
+            self.cache.put(query, control_ids, self.top_k, docs)
+            current.set(candidates=len(docs))
+            return docs
 
-    # Load the vector store from the specified directory.
+    async def _asearch(self, query, control_ids):
+        partition = self._partition(query)
+        docs = await self._asearch_partition(query, control_ids, partition)
+        if partition["language"] is not None and self.cross_language_fallback and len(docs) < self.top_k:
+            other_docs = await self._asearch_partition(query, control_ids, {**partition, "language": None})
+            docs = self._fill_from_other_language(docs, other_docs)
+        return docs
+
+    async def _asearch_partition(self, query, control_ids, partition):
+        # Same steps as _search_partition, but Qdrant calls are awaited and the CPU-bound
+        # embedding runs on the bounded executor instead of blocking the event loop.
+        collection_name = self.retriever.collection_name
+
+        if control_ids and not has_free_text_intent(query):
+            with span("id_lookup", backend="qdrant") as current:
+                points, _ = await self.async_client.scroll(
+                    collection_name=collection_name,
+                    scroll_filter=self._search_filter(control_ids, partition),
+                    limit=256,
+                    with_payload=True,
+                    with_vectors=False,
+                )
+                current.set(candidates=len(points))
+            return self._order_lookup(points, control_ids)
+
+        sparse_hits, confident = self._sparse_search(query, control_ids, partition)
+        if confident:
+            return self._points_to_documents(sparse_hits[:self.top_k], "_sparse_score")
+
+        vector = await self._aembed_query(query)
+        with span("dense_search", backend="qdrant", filtered=bool(control_ids)) as current:
+            response = await self.async_client.query_points(
+                collection_name=collection_name,
+                query=vector,
+                query_filter=self._search_filter(control_ids, partition),
+                limit=self.candidate_pool if control_ids or sparse_hits else self.top_k,
+                search_params=self.search_params,
+                with_payload=True,
+            )
+            current.set(candidates=len(response.points))
+        return self._fuse(self._points_to_documents(response.points, "_dense_score"), sparse_hits)
+
+
+class ShardedRetriever(HybridRetriever):
+    """HybridRetriever over one collection per framework and language (see shards.py).
+
+    The question goes to the shards of its language and of the framework it names,
+    which are searched concurrently, each with the full hybrid pipeline of
+    HybridRetriever, and their rankings are merged into one top_k. The cache, the
+    control hierarchy and the cross-language fallback work as for a single collection.
+    """
+    shards: Any = Field() # collection name -> HybridRetriever searching that shard
+    manifest: Any = Field() # shard entries of shards.json, in search order
+    executor: Any = Field(default=None) # ThreadPoolExecutor searching the shards of sync calls
+
+    def _route(self, query):
+        # The shards of the question's partition, and those the cross-language fallback may add
+        if not self.partitioning:
+            return self.manifest, []
+        language = detect_language(query, default=None)
+        framework = query_framework(query)
+        shards = route_shards(self.manifest, language, framework)
+        if language is None or not self.cross_language_fallback:
+            return shards, []
+        return shards, [shard for shard in route_shards(self.manifest, None, framework) if shard not in shards]
+
+    def _prefetch_targets(self, query, control_ids):
+        return [(self.shards[shard["collection"]], whole_shard) for shard in self._route(query)[0]]
+
+    def _search_shard(self, shard, query, control_ids):
+        with span("shard_search", shard=shard["collection"]) as current:
+            docs = self.shards[shard["collection"]]._search_partition(query, control_ids, whole_shard)
+            current.set(candidates=len(docs))
+        return docs
+
+    async def _asearch_shard(self, shard, query, control_ids):
+        with span("shard_search", shard=shard["collection"]) as current:
+            docs = await self.shards[shard["collection"]]._asearch_partition(query, control_ids, whole_shard)
+            current.set(candidates=len(docs))
+        return docs
+
+    def _fan_out(self, query, control_ids, shards):
+        if len(shards) <= 1 or self.executor is None:
+            return [self._search_shard(shard, query, control_ids) for shard in shards]
+        futures = [
+            self.executor.submit(bind_context(self._search_shard, shard, query, control_ids))
+            for shard in shards
+        ]
+        return [future.result() for future in futures]
+
+    def _merge(self, rankings, control_ids, lookup):
+        if lookup:
+            # ID lookups keep the hierarchy order, whichever shard the controls are in
+            order = self._hierarchy_order(control_ids)
+            docs = [doc for ranking in rankings for doc in ranking]
+            docs.sort(key=lambda doc: self._lookup_sort_key(order, doc.metadata["control_id"]))
+            return docs[:self.top_k]
+        # The dense similarities of all shards are comparable and ranked across the shards.
+        # BM25 scores are not (every shard has its own IDF and length statistics), so each
+        # shard's own BM25 ranking is a list of its own, and all of them are fused by rank
+        docs = [doc for ranking in rankings for doc in ranking]
+        dense = sorted((doc for doc in docs if "_dense_score" in doc.metadata), key=lambda doc: -doc.metadata["_dense_score"])
+        sparse = [
+            sorted((doc for doc in ranking if "_sparse_score" in doc.metadata), key=lambda doc: -doc.metadata["_sparse_score"])
+            for ranking in rankings
+        ]
+        merged = reciprocal_rank_fusion(
+            [dense, *sparse],
+            key=lambda doc: str(doc.metadata["_id"]),
+            k=self.rrf_k,
+        )
+        for doc in docs:
+            doc.metadata.pop("_dense_score", None)
+            doc.metadata.pop("_sparse_score", None)
+        return merged[:self.top_k]
+
+    def _sparse_only(self, query, control_ids, lookup, partition):
+        # Whether the shards skip the dense search, decided once on the corpus-wide BM25
+        # statistics as for a single collection: shards that decided on their own would mix
+        # BM25-only rankings with hybrid ones. Without that index each shard decides.
+        if lookup or self.sparse_index is None:
+            return None
+        return self._sparse_search(query, control_ids, partition)[1]
+
+    def _search_shards(self, query, control_ids, shards, lookup, partition):
+        token = sparse_only.set(self._sparse_only(query, control_ids, lookup, partition))
+        try:
+            return self._merge(self._fan_out(query, control_ids, shards), control_ids, lookup)
+        finally:
+            sparse_only.reset(token)
+
+    async def _asearch_shards(self, query, control_ids, shards, lookup, partition):
+        token = sparse_only.set(self._sparse_only(query, control_ids, lookup, partition))
+        try:
+            rankings = await asyncio.gather(*(self._asearch_shard(shard, query, control_ids) for shard in shards))
+        finally:
+            sparse_only.reset(token)
+        return self._merge(rankings, control_ids, lookup)
+
+    def _search(self, query, control_ids):
+        shards, fallback = self._route(query)
+        partition = self._partition(query)
+        lookup = bool(control_ids) and not has_free_text_intent(query)
+        token = shared_query_vector.set(shared_query_vector.get() or SharedQueryVector())
+        try:
+            docs = self._search_shards(query, control_ids, shards, lookup, partition)
+            if fallback and len(docs) < self.top_k:
+                other_docs = self._search_shards(query, control_ids, fallback, lookup, {**partition, "language": None})
+                docs = self._fill_from_other_language(docs, other_docs)
+        finally:
+            shared_query_vector.reset(token)
+        return docs
 
-    print("\nLoading the Qdrant vector store...\n")
-    # client = QdrantClient(path="/langchain_qdrant")
-    client = QdrantClient(url="http://localhost:6333")
+    async def _asearch(self, query, control_ids):
+        shards, fallback = self._route(query)
+        partition = self._partition(query)
+        lookup = bool(control_ids) and not has_free_text_intent(query)
+        token = shared_query_vector.set(shared_query_vector.get() or SharedQueryVector())
+        try:
+            docs = await self._asearch_shards(query, control_ids, shards, lookup, partition)
+            if fallback and len(docs) < self.top_k:
+                other_docs = await self._asearch_shards(
+                    query, control_ids, fallback, lookup, {**partition, "language": None}
+                )
+                docs = self._fill_from_other_language(docs, other_docs)
+        finally:
+            shared_query_vector.reset(token)
+        return docs
+
+
+def open_collection(collection_name, embed_model, client):
+    """(QdrantVectorStore, None) for a Qdrant collection, (None, NumpyVectorIndex) without a client."""
+    if client is None:
+        # Exact search in this process over the index written by `db_prep.py --store numpy`
+        vector_index = NumpyVectorIndex(numpy_index_path(collection_name), collection_name)
+        print(f"\n✅ Vector index {collection_name} loaded successfully ({len(vector_index)} points)!\n")
+        return None, vector_index
     vector_store = QdrantVectorStore(
         client=client,
-        collection_name="docs_collection",
+        collection_name=collection_name,
         embedding=embed_model,
         # retrieval_mode=RetrievalMode.DENSE # default
     )
+    print(f"\n✅ Qdrant store {collection_name} loaded successfully!\n")
+    return vector_store, None
+
+
+def build_retriever(embed_model, embed_executor=None, backend=None, use_cache=True, sharding=None):
+    """HybridRetriever over the collection built by db_prep.py (no LLM involved), or a
+    ShardedRetriever over its shards when SHARDING is on."""
+    backend = backend or config.RETRIEVER_BACKEND
+    sharding = config.SHARDING if sharding is None else sharding
+    client = None
+    async_client = None
+    if backend == "numpy":
+        print("\nLoading the in-process vector index...\n")
+    else:
+        print("\nLoading the Qdrant vector store...\n")
+        # client = QdrantClient(path="/langchain_qdrant")
+        client = QdrantClient(url=config.QDRANT_URL)
+
+        # Async client, the async path awaits Qdrant instead of blocking a thread on it
+        async_client = AsyncQdrantClient(url=config.QDRANT_URL)
+
+    # Control hierarchy written by db_prep.py; without it the stored relevant_ids are used
+    hierarchy = None
+    if os.path.exists(hierarchy_path(config.COLLECTION_NAME)):
+        hierarchy = ControlHierarchy.load(hierarchy_path(config.COLLECTION_NAME))
+        print(f"Loaded control hierarchy ({len(hierarchy)} ids)\n")
+
+    # Repeated questions are answered from the cache until db_prep.py changes the collection
+    retrieval_cache = None
+    if use_cache and config.RETRIEVAL_CACHE_SIZE > 0:
+        retrieval_cache = RetrievalCache(
+            config.COLLECTION_NAME,
+            max_entries=config.RETRIEVAL_CACHE_SIZE,
+            ttl=config.RETRIEVAL_CACHE_TTL,
+            db_path=config.RETRIEVAL_CACHE_DB or None,
+        )
+
+    # BM25 index written by db_prep.py; without it retrieval is dense only. With shards
+    # every shard searches its own, and this corpus-wide one decides for all of them
+    # whether a question skips the dense search.
+    sparse_index = None
+    if config.HYBRID_SPARSE and os.path.exists(bm25_path(config.COLLECTION_NAME)):
+        sparse_index = BM25IndexFile(bm25_path(config.COLLECTION_NAME))
+        print(f"Loaded BM25 index ({len(sparse_index)} chunks)\n")
+
+    settings = dict(
+        embedding_model=embed_model,
+        top_k=10,
+        hierarchy=hierarchy,
+        async_client=async_client,
+        embed_executor=embed_executor,
+        search_params=search_params(),
+        rrf_k=config.RRF_K,
+        sparse_only_max_terms=config.SPARSE_ONLY_MAX_TERMS,
+        sparse_only_min_coverage=config.SPARSE_ONLY_MIN_COVERAGE,
+        sparse_only_min_idf=config.SPARSE_ONLY_MIN_IDF,
+        partitioning=config.RETRIEVAL_PARTITIONING,
+        cross_language_fallback=config.CROSS_LANGUAGE_FALLBACK,
+        candidate_pool=config.RETRIEVAL_CANDIDATE_POOL,
+    )
+
+    if not sharding:
+        vector_store, vector_index = open_collection(config.COLLECTION_NAME, embed_model, client)
+        return HybridRetriever(
+            retriever=vector_store,
+            vector_index=vector_index,
+            sparse_index=sparse_index,
+            cache=retrieval_cache,
+            **settings,
+        )
+
+    manifest = load_shards(config.COLLECTION_NAME)
+    if not manifest:
+        raise RuntimeError(f"No shards in {shards_path(config.COLLECTION_NAME)}, run `python code/db_prep.py --shards` first")
+    shards = {}
+    for shard in manifest:
+        vector_store, vector_index = open_collection(shard["collection"], embed_model, client)
+        shard_sparse_index = None
+        if config.HYBRID_SPARSE and os.path.exists(bm25_path(shard["collection"])):
+            shard_sparse_index = BM25IndexFile(bm25_path(shard["collection"]))
+        # The cache sits in front of the fan-out, not in front of every shard
+        shards[shard["collection"]] = HybridRetriever(
+            retriever=vector_store,
+            vector_index=vector_index,
+            sparse_index=shard_sparse_index,
+            shard_scores=True,
+            **settings,
+        )
+    print(f"Loaded {len(shards)} shards\n")
+
+    return ShardedRetriever(
+        retriever=None,
+        shards=shards,
+        manifest=manifest,
+        executor=ThreadPoolExecutor(max_workers=config.SHARD_SEARCH_WORKERS, thread_name_prefix="shard"),
+        sparse_index=sparse_index,
+        cache=retrieval_cache,
+        **settings,
+    )
+
+
+def serialize_docs(retrieved_docs):
+    return "\n\n".join(
+        (f"metadata: {doc.metadata}\nContent: {doc.page_content}")
+        for doc in retrieved_docs
+    )
+
+
+def pack_docs(query, retrieved_docs):
+    # Deduplicated, answer-language, token-budgeted context instead of every raw chunk
+    if not config.CONTEXT_PACKING:
+        return serialize_docs(retrieved_docs), retrieved_docs
+    with span("context_pack") as current:
+        context, packed_docs = pack_context(retrieved_docs, query)
+        raw_tokens = approx_tokens(serialize_docs(retrieved_docs))
+        packed_tokens = approx_tokens(context)
+        current.set(
+            chunks_in=len(retrieved_docs), chunks_out=len(packed_docs),
+            tokens_in=raw_tokens, tokens_out=packed_tokens,
+        )
+    print(
+        f"Context packer: {len(retrieved_docs)} -> {len(packed_docs)} chunks, "
+        f"~{raw_tokens} -> ~{packed_tokens} tokens (saved ~{raw_tokens - packed_tokens})"
+    )
+    return context, packed_docs
+
+
+def answer_system_prompt(context):
+    return (
+        "You are an assistant for question-answering tasks. "
+        "Your name is 'GRC Agent', and your job is to answer GRC employees questions "
+        "Use the following pieces of retrieved context to answer "
+        "the question. If you don't know the answer, say that you "
+        "don't know. Answer in the same language the user asks,  "
+        "whether it's Arabic or English, and keep your answer "
+        "structured and concise."
+        "\n\n"
+        f"{context}"
+    )
 
-    print("\n✅ Qdrant store loaded successfully!\n")
+
+def load_chat_model():
+    if config.LLM_PROVIDER == "fake":
+        # Local stand-in: deterministic retrieve calls and answers, no network (see fake_llm.py)
+        return FakeChatModel(
+            latency=config.FAKE_LLM_LATENCY_MS / 1000,
+            tokens_per_second=config.FAKE_LLM_TOKENS_PER_SECOND,
+            answer_tokens=config.FAKE_LLM_ANSWER_TOKENS,
+        )
+    if config.LLM_PROVIDER != "deepseek":
+        raise ValueError(f"Unknown LLM_PROVIDER '{config.LLM_PROVIDER}', expected 'deepseek' or 'fake'")
+    return init_chat_model("deepseek-chat", model_provider="deepseek")
+
+
+def initialize_agent(embed_model=None):
+    
+    # Load the pre-built Chroma vector store
+    print("\nLoading the embedding model...\n")
+    # Define the embedding model used to create the store. It must be the same one.
+    # Query vectors are cached, so repeated questions skip the model entirely.
+    # api_server.py passes the model its parent process loaded before forking the workers.
+    if embed_model is None:
+        embed_model = load_embedding_model()
+
+    # Bounded executor for the embedding model, used by aget_agent_response
+    embed_executor = ThreadPoolExecutor(max_workers=config.EMBED_EXECUTOR_WORKERS, thread_name_prefix="embed")
+
+    # Load the vector store from the specified directory.
+    hybrid_retriever = build_retriever(embed_model, embed_executor)
 
     # Initialize the Gemini LLM.
     print("\nInitializing the chat model \n")
 
 
     # llm = init_chat_model("mistral-large-latest", model_provider="mistralai")
-    llm = init_chat_model("deepseek-chat", model_provider="deepseek")
+    llm = load_chat_model()
 
     print("Starting the graph building\n")
     graph_builder = StateGraph(MessagesState)
 
-    hybrid_retriever = HybridRetriever(
-        retriever=vector_store,
-        embedding_model=embed_model,
-        top_k=10
+    retrieve_description = (
+        "Retrieve information from a knowledge base to answer questions.\n"
+        "Use this tool when the user asks a question about a specific topic, concept, or control ID.\n"
+        "If query contains an explicit control ID or IDS, this tool will provide that certain ID or \n"
+        "IDs with their predecessors and successors.\n"
+        "If the query does not contain an explicit control ID, this tool will perform similarity search\n"
+        "of the knowledge base based on the query and return relevant documents."
     )
 
-    @tool(response_format="content_and_artifact")
     def retrieve(query: str):
-        """
-        Retrieve information from a knowledge base to answer questions.
-        Use this tool when the user asks a question about a specific topic, concept, or control ID.
-        If query contains an explicit control ID or IDS, this tool will provide that certain ID or 
-        IDs with their predecessors and successors.
-        If the query does not contain an explicit control ID, this tool will perform similarity search
-        of the knowledge base based on the query and return relevant documents.
-        """
-        
-        retrieved_docs = hybrid_retriever._get_relevant_documents(query)
-        serialized = "\n\n".join(
-            (f"metadata: {doc.metadata}\nContent: {doc.page_content}")
-            for doc in retrieved_docs
+        with span("tools"):
+            retrieved_docs = hybrid_retriever._get_relevant_documents(query)
+            return pack_docs(query, retrieved_docs)
+
+    async def aretrieve(query: str):
+        with span("tools"):
+            retrieved_docs = await hybrid_retriever._aget_relevant_documents(query)
+            return pack_docs(query, retrieved_docs)
+
+    # One tool with both a sync and an async implementation
+    retrieve_tool = StructuredTool.from_function(
+        func=retrieve,
+        coroutine=aretrieve,
+        name="retrieve",
+        description=retrieve_description,
+        response_format="content_and_artifact",
+    )
+
+
+
+    # Step 0: Send regulatory questions straight to the retrieve tool, without an LLM round trip.
+    router = None
+    if config.ROUTER_ENABLED:
+        router = QueryRouter(
+            sparse_index=hybrid_retriever.sparse_index,
+            embedding_model=embed_model if config.ROUTER_EMBEDDINGS else None,
+            min_coverage=config.ROUTER_MIN_COVERAGE,
+            embedding_margin=config.ROUTER_EMBEDDING_MARGIN,
         )
-        return serialized, retrieved_docs
 
+    def route_question(state: MessagesState):
+        """Emit the retrieve tool call directly, or leave the decision to query_or_respond."""
+        question = state["messages"][-1].content
+        with span("route") as current:
+            target, reason = router.route(
+                question,
+                control_ids=extract_control_ids(question),
+                has_history=len(state["messages"]) > 1,
+            )
+            current.set(target=target, reason=reason)
+        if target != "retrieve":
+            return {"messages": []}
+        tool_call = {"name": "retrieve", "args": {"query": question}, "id": f"route_{uuid.uuid4().hex}"}
+        return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
+    async def aroute_question(state: MessagesState):
+        # The router may embed the question, keep that off the event loop
+        return await asyncio.get_running_loop().run_in_executor(embed_executor, bind_context(route_question, state))
+
+    def after_route(state: MessagesState):
+        last_message = state["messages"][-1]
+        if last_message.type == "ai" and last_message.tool_calls:
+            return "tools"
+        return "query_or_respond"
 
 
     # Step 1: Generate an AIMessage that may include a tool-call to be sent.
+    llm_with_tools = llm.bind_tools([retrieve_tool])
+
     def query_or_respond(state: MessagesState):
         """Generate tool call for retrieval or respond."""
-        llm_with_tools = llm.bind_tools([retrieve])
-        response = llm_with_tools.invoke(state["messages"])
+        with span("query_or_respond") as current:
+            messages = conversation_window(state["messages"], config.HISTORY_TOKEN_BUDGET)
+            response = llm_with_tools.invoke(messages)
+            current.set(tool_call=bool(response.tool_calls), **llm_usage(messages, response))
         # MessagesState appends messages to state instead of overwriting
         return {"messages": [response]}
 
+    async def aquery_or_respond(state: MessagesState):
+        with span("query_or_respond") as current:
+            messages = conversation_window(state["messages"], config.HISTORY_TOKEN_BUDGET)
+            response = await llm_with_tools.ainvoke(messages)
+            current.set(tool_call=bool(response.tool_calls), **llm_usage(messages, response))
+        return {"messages": [response]}
+
 
     # Step 2: Execute the retrieval.
-    tools = ToolNode([retrieve])
+    tools = ToolNode([retrieve_tool])
 
 
     # Step 3: Generate a response using the retrieved content.
-    def generate(state: MessagesState):
-        """Generate answer."""
+    def build_generate_prompt(state: MessagesState):
         # Get generated ToolMessages
         recent_tool_messages = []
         for message in reversed(state["messages"]):
@@ -201,36 +1021,43 @@ def initialize_agent():
 
         # Format into prompt
         docs_content = "\n\n".join(doc.content for doc in tool_messages)
-        system_message_content = (
-            "You are an assistant for question-answering tasks. "
-            "Your name is 'GRC Agent', and your job is to answer GRC employees questions "
-            "Use the following pieces of retrieved context to answer "
-            "the question. If you don't know the answer, say that you "
-            "don't know. Answer in the same language the user asks,  "
-            "whether it's Arabic or English, and keep your answer "
-            "structured and concise."
-            "\n\n"
-            f"{docs_content}"
-        )
-        conversation_messages = [
-            message
-            for message in state["messages"]
-            if message.type in ("human", "system")
-            or (message.type == "ai" and not message.tool_calls)
-        ]
-        prompt = [SystemMessage(system_message_content)] + conversation_messages
+        system_message_content = answer_system_prompt(docs_content)
+        # Only the most recent turns that fit the history budget, so prompt size stays flat
+        conversation_messages = conversation_window(state["messages"], config.HISTORY_TOKEN_BUDGET)
+        return [SystemMessage(system_message_content)] + conversation_messages
 
-        # Run
-        response = llm.invoke(prompt)
+    def generate(state: MessagesState):
+        """Generate answer."""
+        with span("generate") as current:
+            prompt = build_generate_prompt(state)
+            response = llm.invoke(prompt)
+            current.set(**llm_usage(prompt, response))
         return {"messages": [response]}
 
+    async def agenerate(state: MessagesState):
+        with span("generate") as current:
+            prompt = build_generate_prompt(state)
+            response = await llm.ainvoke(prompt)
+            current.set(**llm_usage(prompt, response))
+        return {"messages": [response]}
 
 
-    graph_builder.add_node(query_or_respond)
-    graph_builder.add_node(tools)
-    graph_builder.add_node(generate)
 
-    graph_builder.set_entry_point("query_or_respond")
+    # Each node runs the sync function under graph.invoke and the async one under graph.ainvoke
+    graph_builder.add_node("query_or_respond", RunnableLambda(query_or_respond, afunc=aquery_or_respond))
+    graph_builder.add_node("tools", tools)
+    graph_builder.add_node("generate", RunnableLambda(generate, afunc=agenerate))
+
+    if router is not None:
+        graph_builder.add_node("route", RunnableLambda(route_question, afunc=aroute_question))
+        graph_builder.set_entry_point("route")
+        graph_builder.add_conditional_edges(
+            "route",
+            after_route,
+            {"tools": "tools", "query_or_respond": "query_or_respond"},
+        )
+    else:
+        graph_builder.set_entry_point("query_or_respond")
     graph_builder.add_conditional_edges(
         "query_or_respond",
         tools_condition,
@@ -240,22 +1067,164 @@ def initialize_agent():
     graph_builder.add_edge("generate", END)
 
 
-    memory = MemorySaver()
+    # Conversations are kept on disk; idle and least recently used threads are evicted
+    memory = build_checkpointer(
+        config.CONVERSATION_DB,
+        ttl=config.CONVERSATION_TTL,
+        max_threads=config.CONVERSATION_MAX_THREADS,
+        keep_checkpoints=config.CONVERSATION_KEEP_CHECKPOINTS,
+    )
     graph = graph_builder.compile(checkpointer=memory)
 
+    # Per-stage histograms for Prometheus (see tracing.py)
+    if config.METRICS_PORT:
+        start_metrics_server(config.METRICS_PORT, config.METRICS_HOST)
+
     print("Graph built successfully")
     return graph, hybrid_retriever
 
 
 
 
-def get_agent_response(query, graph, config):
-    try:
-        final_state = graph.invoke({"messages": [{"role": "user", "content": query}]}, config=config)
-        final_response = final_state["messages"][-1]
-        raw_answer = final_response.content
+## One agent per process: the embedding model, Qdrant clients, LLM client and
+## compiled graph are loaded once and shared by every session/conversation.
+## Conversations are kept apart by their thread_id, not by separate graphs.
+_shared_agent = None
+_shared_agent_lock = threading.Lock()
 
-        return raw_answer
-    
-    except Exception as e:
-        return (f"An error occurred: {e}")
+def get_shared_agent(embed_model=None):
+    global _shared_agent
+    if _shared_agent is None:
+        with _shared_agent_lock:
+            if _shared_agent is None:
+                _shared_agent = initialize_agent(embed_model)
+    return _shared_agent
+
+
+def _thread_id(config):
+    return config.get("configurable", {}).get("thread_id")
+
+
+def get_agent_response(query, graph, config, raise_errors=False):
+    # Every request is one trace (see tracing.py): per-stage spans, metrics and TRACE_LOG.
+    # With raise_errors the exception reaches the caller instead of becoming the answer
+    with trace_request("ask", thread_id=_thread_id(config)) as trace:
+        try:
+            final_state = graph.invoke({"messages": [{"role": "user", "content": query}]}, config=config)
+            final_response = final_state["messages"][-1]
+            raw_answer = final_response.content
+
+            return raw_answer
+
+        except Exception as e:
+            trace.root.set(error=type(e).__name__)
+            if raise_errors:
+                raise
+            return (f"An error occurred: {e}")
+
+
+def stream_agent_response(query, graph, config, stats=None):
+    # Yields the answer text as the LLM generates it (message-level streaming from the graph).
+    # If a dict is passed as stats, time to first token and total latency (seconds) are stored
+    # in it, and the request's trace under "trace".
+    start = time.perf_counter()
+    first_token = None
+    direct_answer = []  # query_or_respond text, only shown if it did not turn into a tool call
+    with trace_request("ask", thread_id=_thread_id(config), streaming=True) as trace:
+        try:
+            for chunk, metadata in graph.stream(
+                {"messages": [{"role": "user", "content": query}]},
+                config=config,
+                stream_mode="messages",
+            ):
+                if not isinstance(chunk, AIMessageChunk):
+                    continue
+                node = metadata.get("langgraph_node")
+                if node == "query_or_respond":
+                    if chunk.tool_call_chunks:
+                        direct_answer = None
+                    elif direct_answer is not None and chunk.content:
+                        direct_answer.append(chunk.text())
+                    continue
+                if node == "generate" and chunk.content:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    yield chunk.text()
+
+            if direct_answer:
+                first_token = time.perf_counter() - start
+                yield "".join(direct_answer)
+
+        except Exception as e:
+            trace.root.set(error=type(e).__name__)
+            yield f"An error occurred: {e}"
+
+        finally:
+            trace.root.set(time_to_first_token_ms=None if first_token is None else round(first_token * 1000, 3))
+            if stats is not None:
+                stats["time_to_first_token"] = first_token
+                stats["total_latency"] = time.perf_counter() - start
+                stats["trace"] = trace
+
+
+async def aget_agent_response(query, graph, config, raise_errors=False):
+    # Async version of get_agent_response; many conversations can share one event loop.
+    # api_server.py passes raise_errors and turns the exception into an HTTP error
+    with trace_request("ask", thread_id=_thread_id(config)) as trace:
+        try:
+            final_state = await graph.ainvoke({"messages": [{"role": "user", "content": query}]}, config=config)
+            final_response = final_state["messages"][-1]
+            raw_answer = final_response.content
+
+            return raw_answer
+
+        except Exception as e:
+            trace.root.set(error=type(e).__name__)
+            if raise_errors:
+                raise
+            return (f"An error occurred: {e}")
+
+
+async def astream_agent_response(query, graph, config, stats=None, raise_errors=False):
+    # Async version of stream_agent_response, for the SSE endpoint of api_server.py
+    # (raise_errors as in aget_agent_response)
+    start = time.perf_counter()
+    first_token = None
+    direct_answer = []  # query_or_respond text, only shown if it did not turn into a tool call
+    with trace_request("ask", thread_id=_thread_id(config), streaming=True) as trace:
+        try:
+            async for chunk, metadata in graph.astream(
+                {"messages": [{"role": "user", "content": query}]},
+                config=config,
+                stream_mode="messages",
+            ):
+                if not isinstance(chunk, AIMessageChunk):
+                    continue
+                node = metadata.get("langgraph_node")
+                if node == "query_or_respond":
+                    if chunk.tool_call_chunks:
+                        direct_answer = None
+                    elif direct_answer is not None and chunk.content:
+                        direct_answer.append(chunk.text())
+                    continue
+                if node == "generate" and chunk.content:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    yield chunk.text()
+
+            if direct_answer:
+                first_token = time.perf_counter() - start
+                yield "".join(direct_answer)
+
+        except Exception as e:
+            trace.root.set(error=type(e).__name__)
+            if raise_errors:
+                raise
+            yield f"An error occurred: {e}"
+
+        finally:
+            trace.root.set(time_to_first_token_ms=None if first_token is None else round(first_token * 1000, 3))
+            if stats is not None:
+                stats["time_to_first_token"] = first_token
+                stats["total_latency"] = time.perf_counter() - start
+                stats["trace"] = trace
@@ -0,0 +1,264 @@
+# Headless HTTP API for the agent (asyncio, aiohttp), for ticketing and GRC tools.
+#
+#   python code/api_server.py --port 8080 --workers 4
+#
+# Endpoints:
+#   POST /ask       {"question", "thread_id"?, "stream"?} -> {"answer", "thread_id"}, or
+#                   with "stream": true (or Accept: text/event-stream) Server-Sent Events:
+#                   "token" events as the LLM writes, then "done" (or "error")
+#   POST /retrieve  {"query"} -> {"documents": [{"content", "metadata"}, ...]}, no LLM
+#   GET  /healthz   worker pid and requests in flight
+#
+# Failures are {"error"} JSON with a 4xx/5xx status (400 bad body, 429 overloaded,
+# 500 agent or retrieval error, 504 timeout), or an "error" event once a stream started.
+#
+# A conversation is one thread_id: send back the one the first answer returned to
+# ask a follow-up. With several workers, keep CONVERSATION_DB on disk so any of them
+# can continue it.
+#
+# The parent process loads the embedding model and binds the socket, then forks the
+# workers, which share the model's memory pages and accept connections on the same
+# socket. Each worker builds its own Qdrant clients, LLM client and graph once, and
+# every request it serves reuses them (connection pools are not fork-safe, so they
+# are never created before the fork). The workers share the on-disk embedding cache,
+# whose appends are serialized by a file lock (embedding_cache.py). At most API_MAX_IN_FLIGHT requests run in a
+# worker at a time; the next ones get a 429 with Retry-After instead of queueing,
+# and a request that takes longer than API_REQUEST_TIMEOUT is cut off.
+
+import os
+import sys
+import json
+import uuid
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import multiprocessing
+from multiprocessing.connection import wait as wait_for_exit
+
+from aiohttp import web
+
+import config
+from embeddings import load_embedding_model
+from tracing import trace_request, start_metrics_server
+from agent_prep import get_shared_agent, aget_agent_response, astream_agent_response
+
+
+def error_response(status, message, headers=None):
+    return web.json_response({"error": message}, status=status, headers=headers)
+
+
+@web.middleware
+async def backpressure(request, handler):
+    # Health checks always get through, whatever the load
+    if request.path == "/healthz":
+        return await handler(request)
+    app = request.app
+    if app["in_flight"] >= app["max_in_flight"]:
+        return error_response(429, "Too many requests in flight, retry later", headers={"Retry-After": "1"})
+    app["in_flight"] += 1
+    try:
+        return await handler(request)
+    finally:
+        app["in_flight"] -= 1
+
+
+async def read_json(request, field):
+    """(body, its non-empty `field` string), or raises a 400."""
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Body must be JSON"}), content_type="application/json")
+    value = body.get(field) if isinstance(body, dict) else None
+    if not isinstance(value, str) or not value.strip():
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"'{field}' is required"}), content_type="application/json")
+    return body, value.strip()
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def ask(request):
+    body, question = await read_json(request, "question")
+    thread_id = str(body.get("thread_id") or f"api-{uuid.uuid4()}")
+    graph_config = {"configurable": {"thread_id": thread_id}}
+    timeout = request.app["timeout"]
+
+    stream = body.get("stream", "text/event-stream" in request.headers.get("Accept", ""))
+    if not isinstance(stream, bool):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "'stream' must be true or false"}), content_type="application/json")
+    if not stream:
+        try:
+            answer = await asyncio.wait_for(
+                aget_agent_response(question, request.app["graph"], graph_config, raise_errors=True),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            return error_response(504, f"No answer within {timeout:g}s")
+        except Exception as e:
+            return error_response(500, f"An error occurred: {e}", headers={"X-Thread-Id": thread_id})
+        return web.json_response({"answer": answer, "thread_id": thread_id})
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Thread-Id": thread_id,
+    })
+    await response.prepare(request)
+    stats = {}
+
+    async def send_tokens():
+        tokens = astream_agent_response(question, request.app["graph"], graph_config, stats, raise_errors=True)
+        try:
+            async for token in tokens:
+                await response.write(sse_event("token", {"text": token}))
+        finally:
+            # Closed in this task, so the request's trace ends where it started
+            await tokens.aclose()
+
+    try:
+        await asyncio.wait_for(send_tokens(), timeout)
+        await response.write(sse_event("done", {
+            "thread_id": thread_id,
+            "time_to_first_token": stats.get("time_to_first_token"),
+            "total_latency": stats.get("total_latency"),
+        }))
+    except asyncio.TimeoutError:
+        await response.write(sse_event("error", {"error": f"No answer within {timeout:g}s", "thread_id": thread_id}))
+    except ConnectionResetError:
+        return response  # the client went away
+    except Exception as e:
+        # The status line is already sent, so the failure ends the stream instead of "done"
+        await response.write(sse_event("error", {"error": f"An error occurred: {e}", "thread_id": thread_id}))
+    await response.write_eof()
+    return response
+
+
+async def retrieve_documents(retriever, query):
+    with trace_request("retrieve"):
+        return await retriever._aget_relevant_documents(query)
+
+
+async def retrieve(request):
+    _, query = await read_json(request, "query")
+    timeout = request.app["timeout"]
+    try:
+        docs = await asyncio.wait_for(retrieve_documents(request.app["retriever"], query), timeout)
+    except asyncio.TimeoutError:
+        return error_response(504, f"No documents within {timeout:g}s")
+    except Exception as e:
+        return error_response(500, f"An error occurred: {e}")
+    return web.json_response({
+        "query": query,
+        "documents": [
+            {
+                "content": doc.page_content,
+                # Internal keys (_id, _collection_name, ...) stay out of the API
+                "metadata": {key: value for key, value in doc.metadata.items() if not key.startswith("_")},
+            }
+            for doc in docs
+        ],
+    })
+
+
+async def healthz(request):
+    app = request.app
+    return web.json_response({
+        "status": "ok",
+        "pid": os.getpid(),
+        "in_flight": app["in_flight"],
+        "max_in_flight": app["max_in_flight"],
+        "uptime": round(time.monotonic() - app["started"], 1),
+    })
+
+
+def build_app(graph, retriever, max_in_flight=config.API_MAX_IN_FLIGHT, timeout=config.API_REQUEST_TIMEOUT):
+    app = web.Application(middlewares=[backpressure])
+    app["graph"] = graph
+    app["retriever"] = retriever
+    app["max_in_flight"] = max_in_flight
+    app["timeout"] = timeout
+    app["in_flight"] = 0
+    app["started"] = time.monotonic()
+    app.add_routes([
+        web.post("/ask", ask),
+        web.post("/retrieve", retrieve),
+        web.get("/healthz", healthz),
+    ])
+    return app
+
+
+def serve(sock, embed_model, args, worker=0):
+    """Runs one worker: its own agent and event loop, accepting on the shared socket."""
+    # Forked workers must not run the parent's signal handlers; run_app installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if config.METRICS_PORT:
+        # One /metrics endpoint per worker: METRICS_PORT, METRICS_PORT + 1, ... Started
+        # before the agent, whose own start_metrics_server call is then a no-op
+        start_metrics_server(config.METRICS_PORT + worker, config.METRICS_HOST)
+    graph, retriever = get_shared_agent(embed_model)
+    print(f"Worker {os.getpid()} serving on http://{args.host}:{args.port}")
+    web.run_app(
+        build_app(graph, retriever, args.max_in_flight, args.timeout),
+        sock=sock,
+        print=None,
+        handle_signals=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API for the GRC Agent.")
+    parser.add_argument("--host", default=config.API_HOST)
+    parser.add_argument("--port", type=int, default=config.API_PORT)
+    parser.add_argument("--workers", type=int, default=config.API_WORKERS, help="forked worker processes")
+    parser.add_argument("--max-in-flight", type=int, default=config.API_MAX_IN_FLIGHT, help="per worker, above it 429")
+    parser.add_argument("--timeout", type=float, default=config.API_REQUEST_TIMEOUT, help="seconds per request")
+    args = parser.parse_args()
+
+    # Loaded once here; the forked workers share its pages instead of each loading a copy.
+    # Nothing is embedded before the fork, so no model threads exist yet.
+    print("\nLoading the embedding model...\n")
+    embed_model = load_embedding_model()
+
+    sock = socket.create_server((args.host, args.port), backlog=1024)
+    if args.workers <= 1:
+        serve(sock, embed_model, args)
+        return
+
+    context = multiprocessing.get_context("fork")
+    workers = {}
+    stopping = False
+
+    def start(index):
+        process = context.Process(target=serve, args=(sock, embed_model, args, index), name=f"api-worker-{index}")
+        process.start()
+        workers[process.sentinel] = (index, process)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for _, process in workers.values():
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(args.workers):
+        start(index)
+
+    # Replace workers that die, until the server is stopped
+    while workers:
+        for sentinel in wait_for_exit(list(workers)):
+            index, process = workers.pop(sentinel)
+            process.join()
+            if not stopping:
+                print(f"Worker {process.pid} exited with code {process.exitcode}, restarting it", file=sys.stderr)
+                time.sleep(1)  # no busy loop if it cannot start at all (Qdrant down, ...)
+                start(index)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,30 @@
 import streamlit as st
 import os
+import io
+import uuid
+import pandas as pd
 from PIL import Image
-from agent_prep import get_agent_response, initialize_agent
+import config
+from agent_prep import stream_agent_response, get_shared_agent, load_chat_model
+from questionnaire import read_questions, deduplicate, answer_questionnaire, COLUMNS
+
+# ========== Shared Resources ==========
+# The model, Qdrant clients and compiled graph are loaded once per process and
+# shared by every browser session; each session only keeps its own thread id.
+agent, hybrid_retriever = get_shared_agent()
 
 # ========== Initialize Session State ==========
 if 'language' not in st.session_state:
     st.session_state.language = 'en'  # Default language is English
-if 'agent' not in st.session_state:
-    st.session_state.agent, _ = initialize_agent() # Initialize the agent once
 if 'config' not in st.session_state:
-    st.session_state.config = {"configurable": {"thread_id": "streamlit_session"}}
+    # A unique thread id per browser session keeps conversations apart
+    st.session_state.config = {"configurable": {"thread_id": f"streamlit-{uuid.uuid4()}"}}
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 if 'messages' not in st.session_state:
     st.session_state.messages = []
+if 'last_trace' not in st.session_state:
+    st.session_state.last_trace = None  # stage breakdown of the last answer (DEBUG_PANEL)
 # ========== Text Translations ==========
 translations = {
     'en': {
@@ -24,7 +35,14 @@ translations = {
         'submit_button': "🔍 Submit",
         'response_title': "### 💡 GRC Agent Response:",
         'empty_input_warning': "⚠️ Please enter a valid question.",
-        'language_button': "🌐 العربية"
+        'language_button': "🌐 العربية",
+        'latency_caption': "⏱️ First token {ttft} · Total {total}",
+        'debug_title': "🔎 Last request breakdown",
+        'questionnaire_title': "📋 Answer a questionnaire (xlsx / csv)",
+        'questionnaire_upload': "One question per row, in the first column or in a column named 'question'",
+        'questionnaire_button': "📝 Answer all questions",
+        'questionnaire_summary': "{total} questions, {unique} unique",
+        'questionnaire_download': "⬇️ Download the answers"
     },
     'ar': {
         'page_title': "مساعد الأمن السيبراني السعودي | GRC Agent",
@@ -34,7 +52,14 @@ translations = {
         'submit_button': "🔍 إرسال",
         'response_title': "### 💡 رد المساعد:",
         'empty_input_warning': "⚠️ الرجاء إدخال سؤال صحيح.",
-        'language_button': "🌐 English"
+        'language_button': "🌐 English",
+        'latency_caption': "⏱️ أول كلمة {ttft} · الإجمالي {total}",
+        'debug_title': "🔎 تفاصيل آخر طلب",
+        'questionnaire_title': "📋 الإجابة على استبيان (xlsx / csv)",
+        'questionnaire_upload': "سؤال واحد في كل صف، في العمود الأول أو في عمود باسم 'question'",
+        'questionnaire_button': "📝 الإجابة على جميع الأسئلة",
+        'questionnaire_summary': "{total} سؤال، {unique} منها مختلفة",
+        'questionnaire_download': "⬇️ تنزيل الإجابات"
     }
 }
 
@@ -46,6 +71,14 @@ def get_text(key):
 
 st.set_page_config(page_title=get_text('page_title'), layout="wide")
 
+def latency_caption(latency):
+    def fmt(seconds):
+        return "-" if seconds is None else f"{seconds:.2f}s"
+    return get_text('latency_caption').format(
+        ttft=fmt(latency.get("time_to_first_token")),
+        total=fmt(latency.get("total_latency")),
+    )
+
 # Load external CSS using a more reliable method
 def local_css(file_name):
     with open(file_name, 'r', encoding='utf-8') as f:
@@ -138,6 +171,8 @@ st.markdown(f'<div class="{content_class}">', unsafe_allow_html=True)
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if message.get("latency"):
+            st.caption(latency_caption(message["latency"]))
 
 # Chat input
 if prompt := st.chat_input(get_text('input_placeholder')):
@@ -153,24 +188,69 @@ if prompt := st.chat_input(get_text('input_placeholder')):
         # Show a temporary message while waiting for the response
         message_placeholder.markdown("-thinking...▌")
         
+        latency = {}
         try:
-            full_response = get_agent_response(prompt, st.session_state.agent, st.session_state.config)
-            
-            # Simulate typing effect
-            import time
-            displayed_response = ""
-            for chunk in full_response.split():
-                displayed_response += chunk + " "
-                message_placeholder.markdown(displayed_response + "▌")
-                time.sleep(0.05)
+            # Stream tokens from the generate node straight into the placeholder
+            full_response = ""
+            for token in stream_agent_response(prompt, agent, st.session_state.config, latency):
+                full_response += token
+                message_placeholder.markdown(full_response + "▌")
             
             # Display full response
             message_placeholder.markdown(full_response)
         except Exception as e:
             full_response = f"An error occurred: {e}"
             message_placeholder.markdown(full_response)
+        trace = latency.pop("trace", None)
+        if trace is not None:
+            st.session_state.last_trace = trace.to_dict()
+        if latency:
+            st.caption(latency_caption(latency))
     
     # Add assistant response to chat history
-    st.session_state.messages.append({"role": "assistant", "content": full_response})
+    st.session_state.messages.append({"role": "assistant", "content": full_response, "latency": latency})
+
+# Questionnaire mode: a whole spreadsheet of questions at once (see questionnaire.py)
+with st.expander(get_text('questionnaire_title')):
+    uploaded = st.file_uploader(get_text('questionnaire_upload'), type=["xlsx", "csv"])
+    if uploaded is not None and st.button(get_text('questionnaire_button')):
+        questions = read_questions(uploaded)
+        unique, _ = deduplicate(questions)
+        st.caption(get_text('questionnaire_summary').format(total=len(questions), unique=len(unique)))
+        progress = st.progress(0.0)
+        table = st.empty()
+        results = []
+        for result in answer_questionnaire(questions, hybrid_retriever, load_chat_model()):
+            results.append(result)
+            progress.progress(len(results) / len(questions))
+            table.dataframe(pd.DataFrame(results, columns=COLUMNS), use_container_width=True, hide_index=True)
+        answers = pd.DataFrame(results, columns=COLUMNS).sort_values("row")
+        buffer = io.BytesIO()
+        answers.to_excel(buffer, index=False)
+        st.download_button(
+            get_text('questionnaire_download'),
+            buffer.getvalue(),
+            file_name=f"{os.path.splitext(uploaded.name)[0]}_answers.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+
+# Debug panel: where the time of the last answer went, stage by stage
+if config.DEBUG_PANEL and st.session_state.last_trace:
+    trace = st.session_state.last_trace
+    with st.expander(get_text('debug_title')):
+        st.caption(f"{trace['duration_ms']:.0f} ms · trace {trace['trace_id']}")
+        st.dataframe(
+            [
+                {
+                    "stage": "\u2003" * (span["depth"] - 1) + span["name"],
+                    "start (ms)": span["start_ms"],
+                    "duration (ms)": span["duration_ms"],
+                    "details": ", ".join(f"{key}={value}" for key, value in span["attributes"].items()),
+                }
+                for span in trace["spans"]
+            ],
+            use_container_width=True,
+            hide_index=True,
+        )
 
 st.markdown('</div>', unsafe_allow_html=True)
@@ -0,0 +1,234 @@
+# Bilingual BM25 (sparse) index over the control chunks.
+#
+# db_prep.py builds it at ingest time and saves it next to the collection
+# (<INDEX_DIR>/<collection>.bm25.json). The agent loads it and HybridRetriever fuses
+# its hits with the dense ones (reciprocal rank fusion). Short keyword questions
+# ("MFA", "penetration testing") whose terms are all matched by the best BM25 hit
+# are answered from this index alone, without running the embedding model, as long
+# as those terms are rare enough to pin the answer down (min_idf).
+#
+# The agent opens it through BM25IndexFile, which reloads it when db_prep.py rewrites
+# the file, the same way NumpyVectorIndex follows its own files.
+#
+# Arabic and English go through the same tokenizer:
+#   - Arabic: diacritics and tatweel removed, alef/ya/ta-marbuta variants unified,
+#     Arabic-Indic digits mapped to 0-9 and the definite article prefixes stripped,
+#   - English: casefolded words,
+#   - control IDs (2-3-1) are kept as a single token, stop words are dropped.
+
+import os
+import re
+import json
+import math
+import threading
+
+import numpy as np
+
+import config
+from numpy_index import IndexPoint, build_masks, combine_masks
+
+
+def bm25_path(collection_name):
+    return os.path.join(config.INDEX_DIR, f"{collection_name}.bm25.json")
+
+
+## Arabic normalization
+arabic_diacritics = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]')
+arabic_letters = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ة": "ه",
+    "ـ": None,  # tatweel
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic-Indic digits
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Extended (Persian) digits
+})
+arabic_prefixes = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+def normalize_arabic(text):
+    return arabic_diacritics.sub("", text).translate(arabic_letters)
+
+def strip_arabic_prefix(token):
+    for prefix in arabic_prefixes:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+
+stop_words = {
+    # English
+    "a", "an", "the", "of", "to", "in", "on", "for", "and", "or", "is", "are", "be", "by", "with",
+    "as", "at", "from", "that", "this", "these", "it", "its", "what", "which", "how", "who", "when",
+    "should", "must", "shall", "can", "do", "does", "we", "our", "i", "me", "my", "you", "your",
+    "about", "there", "any", "all", "into", "not", "no", "if", "than", "then", "so", "such",
+    "tell", "explain", "describe", "please", "give", "show", "list", "say", "says",
+    # Arabic (normalized)
+    "في", "من", "الي", "علي", "عن", "مع", "او", "و", "ان", "هذا", "هذه", "ذلك", "التي", "الذي",
+    "ما", "ماذا", "هو", "هي", "هل", "كيف", "كل", "لا", "لم", "بين", "عند", "تم", "به", "بها",
+    "اشرح", "وضح", "اعطني",
+}
+
+token_pattern = re.compile(r'\d+(?:[-.]\d+)+|\w+')
+
+def tokenize(text):
+    tokens = []
+    for token in token_pattern.findall(normalize_arabic(text).casefold()):
+        if token in stop_words:
+            continue
+        token = strip_arabic_prefix(token.replace(".", "-"))
+        if token not in stop_words and not (len(token) == 1 and not token.isdigit()):
+            tokens.append(token)
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings, key, k=60):
+    """Merge ranked lists: every item scores sum(1 / (k + rank)) over the lists it appears in."""
+    scores = {}
+    items = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            item_key = key(item)
+            scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(item_key, item)
+    return [items[item_key] for item_key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class BM25Index:
+    def __init__(self, ids, payloads, postings, doc_lengths, k1=1.2, b=0.75):
+        self.ids = ids
+        self.payloads = payloads
+        self.postings = postings  # term -> [[row, term frequency], ...]
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        # Every posting's BM25 contribution is fixed once the corpus is, so a search is
+        # just a scatter-add of precomputed weights for the query terms.
+        count = len(ids)
+        lengths = np.asarray(doc_lengths, dtype=np.float32)
+        average_length = float(lengths.mean()) if count else 0.0
+        self._weights = {}
+        self._idf = {}
+        for term, term_postings in postings.items():
+            rows = np.array([row for row, _ in term_postings], dtype=np.int64)
+            tf = np.array([tf for _, tf in term_postings], dtype=np.float32)
+            idf = self.idf(len(term_postings))
+            norm = k1 * (1 - b + b * lengths[rows] / max(average_length, 1e-9))
+            self._idf[term] = idf
+            self._weights[term] = (rows, idf * tf * (k1 + 1) / (tf + norm))
+        self.masks = build_masks(payloads)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def refresh(self):
+        # Same interface as BM25IndexFile: the index to run one search against
+        return self
+
+    def min_idf(self, query):
+        """idf of the most common query term (terms missing from the corpus count as the rarest)."""
+        terms = tokenize(query)
+        return min((self._idf.get(term, self.idf(0)) for term in terms), default=0.0)
+
+    def idf(self, document_frequency):
+        count = len(self.ids)
+        return math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    @classmethod
+    def build(cls, ids, payloads, k1=1.2, b=0.75):
+        postings = {}
+        doc_lengths = []
+        for row, payload in enumerate(payloads):
+            tokens = tokenize(payload["page_content"])
+            doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append([row, tf])
+        return cls(list(ids), payloads, postings, doc_lengths, k1=k1, b=b)
+
+    def mask(self, control_ids=None, relevant_ids=None, language=None, framework=None):
+        return combine_masks(self.masks, len(self.ids), control_ids, relevant_ids, language, framework)
+
+    def search(self, query, k, mask=None):
+        """Top-k hits and their coverage: the idf-weighted share of the query terms the best hit contains."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.ids:
+            return [], 0.0
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        matched = np.zeros(len(self.ids), dtype=np.float32)
+        total_idf = 0.0
+        for term in terms:
+            # Terms missing from the corpus still count against the coverage
+            total_idf += self._idf.get(term, self.idf(0))
+            if term in self._weights:
+                rows, weights = self._weights[term]
+                scores[rows] += weights
+                matched[rows] += self._idf[term]
+        if mask is not None:
+            scores[~mask] = 0.0
+
+        found = np.flatnonzero(scores)
+        if not len(found):
+            return [], 0.0
+        k = min(k, len(found))
+        top = found[np.argpartition(-scores[found], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        hits = [IndexPoint(self.ids[row], self.payloads[row], float(scores[row])) for row in top]
+        return hits, float(matched[top[0]] / total_idf)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "k1": self.k1,
+                    "b": self.b,
+                    "ids": self.ids,
+                    "payloads": self.payloads,
+                    "doc_lengths": self.doc_lengths,
+                    "postings": self.postings,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["ids"], data["payloads"], data["postings"], data["doc_lengths"], k1=data["k1"], b=data["b"])
+
+
+class BM25IndexFile:
+    """The BM25Index saved at path, reloaded whenever db_prep.py rewrites it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._index = None
+        self.refresh()
+
+    def refresh(self):
+        # A stat call per search; save() replaces the file atomically
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._index = BM25Index.load(self.path)
+                    self._mtime = mtime
+        return self._index
+
+    def __len__(self):
+        return len(self.refresh())
+
+    def mask(self, **kwargs):
+        return self.refresh().mask(**kwargs)
+
+    def search(self, query, k, mask=None):
+        return self.refresh().search(query, k, mask=mask)
+
+    def min_idf(self, query):
+        return self.refresh().min_idf(query)
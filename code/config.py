@@ -0,0 +1,144 @@
+# Shared settings for ingestion (db_prep.py) and the agent (agent_prep.py).
+# Every value can be overridden from the environment or the .env file.
+
+import os
+import json
+from dotenv import load_dotenv
+
+load_dotenv()  # This populates os.environ with environment variables from a .env file
+
+## Project layout
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(CODE_DIR)
+
+## Embedding model
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "intfloat/multilingual-e5-large")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # "torch" or "onnx" (int8, see onnx_embeddings.py)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0")) or None  # intra-op threads per model copy
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(PROJECT_DIR, "onnx_models"))
+
+## Embedding cache (set EMBEDDING_CACHE_DIR to an empty string to disable it)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(PROJECT_DIR, "embedding_cache"))
+EMBEDDING_LRU_SIZE = int(os.getenv("EMBEDDING_LRU_SIZE", "2048"))
+
+## Ingestion pipeline (db_prep.py)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "32"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))  # > 1 embeds in a process pool
+CORPUS_DIR = os.getenv("CORPUS_DIR", os.path.join(PROJECT_DIR, "files"))  # guides to ingest, see corpus_parser.py
+CORPUS_GLOB = os.getenv("CORPUS_GLOB", "**/*.txt")
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))  # parser processes (0 = one per CPU, at most one per file)
+
+## NCA frameworks, see language.py: label -> regexes (case-insensitive) of its guides' file
+## names and of the ways a question names it. Guides matching no "files" pattern are
+## skipped by db_prep.py. FRAMEWORKS='{"XYZ": {"files": "...", "query": "..."}}' replaces the table.
+FRAMEWORKS = json.loads(os.getenv("FRAMEWORKS") or "null") or {
+    "ECC": {
+        "files": r"essential cybersecurity control|\becc\b",
+        "query": r"\becc\b|essential (?:cybersecurity )?controls?|الضوابط الأساسية|الضوابط الاساسية",
+    },
+    "CSCC": {
+        "files": r"critical systems|\bcscc\b",
+        "query": r"\bcscc\b|critical systems?|الأنظمة الحساسة|الانظمة الحساسة",
+    },
+    "DCC": {
+        "files": r"data cybersecurity control|\bdcc\b",
+        "query": r"\bdcc\b|data cybersecurity controls?|ضوابط الأمن السيبراني للبيانات",
+    },
+    "CCC": {
+        "files": r"cloud cybersecurity control|\bccc\b",
+        "query": r"\bccc\b|cloud cybersecurity controls?|ضوابط الأمن السيبراني للحوسبة السحابية",
+    },
+    "OTCC": {
+        "files": r"operational technology|\botcc\b",
+        "query": r"\botcc\b|operational technology (?:cybersecurity )?controls?|ضوابط الأمن السيبراني للأنظمة التشغيلية",
+    },
+}
+
+## Vector store
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "qdrant")  # "qdrant" or "numpy" (in-process, see numpy_index.py)
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "docs_collection")
+
+## Side indexes saved next to the collection (control hierarchy, ...)
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join(PROJECT_DIR, "index"))
+
+## HybridRetriever
+RETRIEVAL_CANDIDATE_POOL = int(os.getenv("RETRIEVAL_CANDIDATE_POOL", "50"))  # depth of the filtered / fused rankings before the top_k cut
+
+## Retrieval result cache (set RETRIEVAL_CACHE_DB to an empty string for memory only)
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))  # 0 disables the cache
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "86400"))  # seconds
+RETRIEVAL_CACHE_DB = os.getenv("RETRIEVAL_CACHE_DB", os.path.join(INDEX_DIR, "retrieval_cache.sqlite"))
+
+## Language / framework partitions of the corpus (payloads written by db_prep.py)
+RETRIEVAL_PARTITIONING = os.getenv("RETRIEVAL_PARTITIONING", "true").lower() in ("1", "true", "yes")
+CROSS_LANGUAGE_FALLBACK = os.getenv("CROSS_LANGUAGE_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+## One collection per framework and language instead of a single one, see shards.py
+SHARDING = os.getenv("SHARDING", "false").lower() in ("1", "true", "yes")  # must match how db_prep.py wrote the store
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "8"))  # threads searching the shards of a question
+
+## Sparse (BM25) side of HybridRetriever, see bm25_index.py
+HYBRID_SPARSE = os.getenv("HYBRID_SPARSE", "true").lower() in ("1", "true", "yes")  # fuse BM25 hits with dense ones
+RRF_K = int(os.getenv("RRF_K", "60"))  # reciprocal rank fusion constant
+SPARSE_ONLY_MAX_TERMS = int(os.getenv("SPARSE_ONLY_MAX_TERMS", "3"))  # 0 = always run the dense search too
+SPARSE_ONLY_MIN_COVERAGE = float(os.getenv("SPARSE_ONLY_MIN_COVERAGE", "1.0"))  # share of query terms the top hit must match
+SPARSE_ONLY_MIN_IDF = float(os.getenv("SPARSE_ONLY_MIN_IDF", "2.5"))  # every query term must be this rare ("policy" is not)
+
+## Context packing between retrieval and generation, see context_packer.py
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "true").lower() in ("1", "true", "yes")  # false sends the raw chunks
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))  # 0 = no limit
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))  # shingle Jaccard
+CONTEXT_CONTAINMENT_THRESHOLD = float(os.getenv("CONTEXT_CONTAINMENT_THRESHOLD", "0.7"))  # share inside a parent/child
+
+## Query router in front of the tool-decision LLM call, see query_router.py
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+ROUTER_MIN_COVERAGE = float(os.getenv("ROUTER_MIN_COVERAGE", "0.75"))  # share of query terms found by BM25
+ROUTER_EMBEDDINGS = os.getenv("ROUTER_EMBEDDINGS", "true").lower() in ("1", "true", "yes")
+ROUTER_EMBEDDING_MARGIN = float(os.getenv("ROUTER_EMBEDDING_MARGIN", "0.02"))  # regulatory minus small-talk similarity
+
+## Async path: threads that run the embedding model for concurrent requests
+EMBED_EXECUTOR_WORKERS = int(os.getenv("EMBED_EXECUTOR_WORKERS", "2"))
+
+## Questionnaire batch mode, see questionnaire.py
+QUESTIONNAIRE_CONCURRENCY = int(os.getenv("QUESTIONNAIRE_CONCURRENCY", "4"))  # LLM calls in flight
+QUESTIONNAIRE_BATCH_SIZE = int(os.getenv("QUESTIONNAIRE_BATCH_SIZE", "32"))  # questions per embedding pass / Qdrant batch
+
+## Chat model: "deepseek", or "fake" for the local stand-in in fake_llm.py (no network, no API key)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "deepseek")
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))  # time to the first token
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50"))  # 0 = instant
+FAKE_LLM_ANSWER_TOKENS = int(os.getenv("FAKE_LLM_ANSWER_TOKENS", "120"))
+
+## HTTP API, see api_server.py
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))  # forked processes sharing the listening socket
+API_MAX_IN_FLIGHT = int(os.getenv("API_MAX_IN_FLIGHT", "32"))  # per worker, above it requests get a 429
+API_REQUEST_TIMEOUT = float(os.getenv("API_REQUEST_TIMEOUT", "120"))  # seconds per /ask or /retrieve call
+
+## Tracing and metrics, see tracing.py
+TRACE_LOG = os.getenv("TRACE_LOG", "")  # JSONL file, one line per request ("" = no log)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Prometheus /metrics endpoint (0 = off)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "0"))  # sampling profiler period (0 = off)
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(PROJECT_DIR, "profiles"))
+DEBUG_PANEL = os.getenv("DEBUG_PANEL", "false").lower() in ("1", "true", "yes")  # stage breakdown in app.py
+
+## Conversation memory (set CONVERSATION_DB to an empty string to keep it in memory only)
+CONVERSATION_DB = os.getenv("CONVERSATION_DB", os.path.join(PROJECT_DIR, "conversations.sqlite"))
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", str(7 * 24 * 3600)))  # seconds a thread may stay idle
+CONVERSATION_MAX_THREADS = int(os.getenv("CONVERSATION_MAX_THREADS", "1000"))
+CONVERSATION_KEEP_CHECKPOINTS = int(os.getenv("CONVERSATION_KEEP_CHECKPOINTS", "10"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))  # past turns sent to the LLM
+
+## Qdrant storage and index settings used when db_prep.py creates the collection (see qdrant_settings.py)
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none")  # "none", "scalar" or "binary"
+QDRANT_ON_DISK = os.getenv("QDRANT_ON_DISK", "false").lower() in ("1", "true", "yes")
+HNSW_M = int(os.getenv("HNSW_M", "0"))  # 0 = Qdrant default (16)
+HNSW_EF_CONSTRUCT = int(os.getenv("HNSW_EF_CONSTRUCT", "0"))  # 0 = Qdrant default (100)
+
+## Search parameters sent with every dense query
+SEARCH_HNSW_EF = int(os.getenv("SEARCH_HNSW_EF", "0"))  # 0 = Qdrant default
+SEARCH_OVERSAMPLING = float(os.getenv("SEARCH_OVERSAMPLING", "0"))  # only used with quantization
+SEARCH_RESCORE = os.getenv("SEARCH_RESCORE", "true").lower() in ("1", "true", "yes")
@@ -0,0 +1,127 @@
+# Packs the retrieved chunks into the context the LLM sees in generate().
+#
+# The retriever returns up to top_k chunks, and the same control often comes back
+# several times: its Arabic and English copies, the parent next to the child, or an
+# ECC chunk that is nearly identical to the CSCC one. Before anything reaches the
+# prompt, the packer:
+#   1. keeps the copy in the answer language when the same control exists in both
+#      (both copies when the question has no letters to tell, e.g. just "2-3-1"),
+#   2. drops near-duplicates (word shingle Jaccard) and chunks that are mostly
+#      contained in an ancestor/descendant chunk already kept,
+#   3. writes every chunk with a one-line header (control ID and source guide)
+#      instead of the full metadata dict,
+#   4. stops at the token budget (the last chunk that does not fit is truncated).
+# Chunks keep their retrieval order, so the most relevant ones survive the budget.
+
+import os
+import re
+import math
+
+import config
+from language import detect_language, source_framework
+
+
+def approx_tokens(text):
+    # Same estimate as langchain's count_tokens_approximately (about 4 characters per token)
+    return math.ceil(len(text) / 4)
+
+
+def shingles(text, size=3):
+    words = re.findall(r'\w+', text.casefold())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def doc_language(doc):
+    # Stored by db_prep.py; detected from the text for chunks ingested before that
+    return doc.metadata.get("language") or detect_language(doc.page_content)
+
+
+def control_key(doc):
+    # ECC and CSCC reuse the same numbers, so a control is (framework, control ID)
+    framework = doc.metadata.get("framework") or source_framework(doc.metadata.get("source", ""))
+    return (framework, doc.metadata.get("control_id", ""))
+
+
+def is_related(key, other_key):
+    # Same control, or one is an ancestor of the other (2-3 and 2-3-1-4) in the same guide
+    (framework, control_id), (other_framework, other_id) = key, other_key
+    return framework == other_framework and (
+        control_id == other_id
+        or control_id.startswith(other_id + "-")
+        or other_id.startswith(control_id + "-")
+    )
+
+
+def format_chunk(doc):
+    metadata = doc.metadata
+    source = os.path.splitext(os.path.basename(metadata.get("source", "")))[0]
+    header = f"[Control {metadata.get('control_id', '?')}" + (f" | {source}]" if source else "]")
+    return f"{header}\n{doc.page_content.strip()}"
+
+
+def select_language(docs, language):
+    # Drop a chunk only if the same control is also there in the answer language
+    if language is None:
+        return docs
+    in_language = {control_key(doc) for doc in docs if doc_language(doc) == language}
+    return [
+        doc for doc in docs
+        if doc_language(doc) == language or control_key(doc) not in in_language
+    ]
+
+
+def remove_redundant(docs, duplicate_threshold, containment_threshold):
+    kept = []  # (doc, shingles)
+    for doc in docs:
+        doc_shingles = shingles(doc.page_content)
+        key = control_key(doc)
+        redundant = False
+        for kept_doc, kept_shingles in kept:
+            if not doc_shingles or not kept_shingles:
+                continue
+            overlap = len(doc_shingles & kept_shingles)
+            if overlap / len(doc_shingles | kept_shingles) >= duplicate_threshold:
+                redundant = True
+            elif (
+                is_related(key, control_key(kept_doc))
+                and overlap / len(doc_shingles) >= containment_threshold
+            ):
+                # Most of this chunk is already in its parent / child
+                redundant = True
+            if redundant:
+                break
+        if not redundant:
+            kept.append((doc, doc_shingles))
+    return [doc for doc, _ in kept]
+
+
+def pack_context(
+    docs,
+    query,
+    token_budget=config.CONTEXT_TOKEN_BUDGET,
+    duplicate_threshold=config.CONTEXT_DUPLICATE_THRESHOLD,
+    containment_threshold=config.CONTEXT_CONTAINMENT_THRESHOLD,
+):
+    """Returns (context string, the documents it contains)."""
+    docs = select_language(docs, detect_language(query, default=None))
+    docs = remove_redundant(docs, duplicate_threshold, containment_threshold)
+
+    parts = []
+    packed_docs = []
+    used = 0
+    for doc in docs:
+        text = format_chunk(doc)
+        tokens = approx_tokens(text + "\n\n")
+        if token_budget and used + tokens > token_budget:
+            remaining = token_budget - used
+            # Only worth a truncated chunk if a meaningful part of it fits
+            if remaining >= 100:
+                parts.append(text[:remaining * 4].rsplit(maxsplit=1)[0] + " ...")
+                packed_docs.append(doc)
+            break
+        parts.append(text)
+        packed_docs.append(doc)
+        used += tokens
+    return "\n\n".join(parts), packed_docs
@@ -0,0 +1,132 @@
+# Hierarchy index over the normalized control IDs (e.g. 2, 2-3, 2-3-1, 2-3-1-4).
+#
+# The IDs are stored in a prefix tree keyed by ID segment, so finding the parents,
+# children or all descendants of a control only walks its own path instead of
+# scanning every ID. db_prep.py builds it once per ingest and saves it next to the
+# collection; agent_prep.py loads it to expand the control IDs found in a query.
+
+import os
+import json
+
+import config
+
+
+## A function to normalize IDs
+def normalize_control_id(raw_id):
+    # Arabic-Indic to Western numerals
+    arabic_to_western = str.maketrans("٠١٢٣٤٥٦٧٨٩۱۲۳۷۸", "012345678912378")
+    normalized = raw_id.translate(arabic_to_western)
+
+    # Replace separators to standard format
+    normalized = normalized.replace('.', '-').replace(',', '-').strip()
+
+    return normalized
+
+
+def control_sort_key(control_id):
+    # 1-2-10 sorts after 1-2-9
+    return tuple(int(part) if part.isdigit() else 0 for part in control_id.split('-'))
+
+
+def hierarchy_path(collection_name):
+    return os.path.join(config.INDEX_DIR, f"{collection_name}.hierarchy.json")
+
+
+class _Node:
+    __slots__ = ("children", "exists")
+
+    def __init__(self):
+        self.children = {}  # segment -> _Node
+        self.exists = False  # False for prefixes that never appear as an ID themselves
+
+
+class ControlHierarchy:
+    def __init__(self, control_ids=()):
+        self._root = _Node()
+        self._count = 0
+        for control_id in control_ids:
+            self.add(control_id)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, control_id):
+        node = self._find(control_id)
+        return node is not None and node.exists
+
+    def add(self, control_id):
+        node = self._root
+        for part in control_id.split('-'):
+            node = node.children.setdefault(part, _Node())
+        if not node.exists:
+            node.exists = True
+            self._count += 1
+
+    def _find(self, control_id):
+        node = self._root
+        for part in control_id.split('-'):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def parents(self, control_id, levels=2):
+        """The parent and grandparent IDs (closest first), whether or not they are indexed."""
+        parts = control_id.split('-')
+        return ['-'.join(parts[:-i]) for i in range(1, min(levels, len(parts) - 1) + 1)]
+
+    def children(self, control_id):
+        """Direct sub-controls that exist in the index."""
+        node = self._find(control_id)
+        if node is None:
+            return []
+        return [
+            f"{control_id}-{part}"
+            for part, child in sorted(node.children.items(), key=lambda item: control_sort_key(item[0]))
+            if child.exists
+        ]
+
+    def descendants(self, control_id, max_depth=None):
+        """All indexed IDs below control_id, in document order."""
+        node = self._find(control_id)
+        if node is None:
+            return []
+        out = []
+        self._collect(node, control_id, 1, max_depth, out)
+        return out
+
+    def _collect(self, node, prefix, depth, max_depth, out):
+        if max_depth is not None and depth > max_depth:
+            return
+        for part, child in sorted(node.children.items(), key=lambda item: control_sort_key(item[0])):
+            child_id = f"{prefix}-{part}"
+            if child.exists:
+                out.append(child_id)
+            self._collect(child, child_id, depth + 1, max_depth, out)
+
+    def relevant_ids(self, control_id):
+        """The ID itself, its parent and grandparent and its direct sub-controls (stored per chunk)."""
+        return [control_id] + self.parents(control_id) + self.children(control_id)
+
+    def expand(self, control_id):
+        """Every control whose chunk lists control_id in its relevant_ids."""
+        ids = [control_id]
+        if control_id in self:
+            ids.extend(self.parents(control_id, levels=1))
+        ids.extend(self.descendants(control_id, max_depth=2))
+        return ids
+
+    def ids(self):
+        out = []
+        self._collect(self._root, "", 1, None, out)
+        return [control_id[1:] for control_id in out]  # drop the leading '-'
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids()}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["ids"])
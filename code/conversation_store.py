@@ -0,0 +1,131 @@
+# Disk-backed, bounded conversation memory for the LangGraph agent.
+#
+# MemorySaver keeps every thread (and every checkpoint of every thread) in RAM for
+# the lifetime of the process. This checkpointer stores them in SQLite instead and
+# keeps the store bounded:
+#   - threads idle for longer than `ttl` seconds are deleted,
+#   - above `max_threads` the least recently used threads are deleted,
+#   - only the newest `keep_checkpoints` checkpoints of each thread are kept
+#     (the latest one already holds the whole conversation state).
+#
+# It needs the optional langgraph-checkpoint-sqlite package; without it
+# build_checkpointer() falls back to the in-memory MemorySaver.
+
+import os
+import time
+import asyncio
+import sqlite3
+
+from langgraph.checkpoint.memory import MemorySaver
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+except ImportError:  # pip install langgraph-checkpoint-sqlite
+    SqliteSaver = None
+
+
+if SqliteSaver is not None:
+
+    class BoundedSqliteSaver(SqliteSaver):
+        def __init__(self, conn, ttl=7 * 24 * 3600, max_threads=1000, keep_checkpoints=10, prune_every=50):
+            super().__init__(conn)
+            self.ttl = ttl
+            self.max_threads = max_threads
+            self.keep_checkpoints = keep_checkpoints
+            self.prune_every = prune_every
+            self._puts = 0
+            with self.cursor() as cur:
+                cur.execute(
+                    "CREATE TABLE IF NOT EXISTS thread_activity ("
+                    "thread_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)"
+                )
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            result = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = str(config["configurable"]["thread_id"])
+            with self.cursor() as cur:
+                cur.execute(
+                    "INSERT OR REPLACE INTO thread_activity (thread_id, last_seen) VALUES (?, ?)",
+                    (thread_id, time.time()),
+                )
+                self._trim_checkpoints(cur, thread_id)
+
+            self._puts += 1
+            if self._puts % self.prune_every == 0:
+                self.prune()
+            return result
+
+        def _trim_checkpoints(self, cur, thread_id):
+            # checkpoint ids are time ordered (uuid6), so the newest sort last
+            cur.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? "
+                "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+                (thread_id, self.keep_checkpoints),
+            )
+            old = [row[0] for row in cur.fetchall()]
+            for checkpoint_id in old:
+                cur.execute(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_id),
+                )
+                cur.execute(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_id),
+                )
+
+        def prune(self):
+            """Delete expired threads and the least recently used ones above max_threads."""
+            with self.cursor() as cur:
+                cur.execute(
+                    "SELECT thread_id FROM thread_activity WHERE last_seen < ?",
+                    (time.time() - self.ttl,),
+                )
+                expired = [row[0] for row in cur.fetchall()]
+                cur.execute(
+                    "SELECT thread_id FROM thread_activity ORDER BY last_seen DESC LIMIT -1 OFFSET ?",
+                    (self.max_threads,),
+                )
+                evicted = [row[0] for row in cur.fetchall()]
+
+            removed = set(expired) | set(evicted)
+            for thread_id in removed:
+                self.delete_thread(thread_id)
+            return len(removed)
+
+        def delete_thread(self, thread_id):
+            super().delete_thread(thread_id)
+            with self.cursor() as cur:
+                cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+        # SqliteSaver is sync only; run its (short) queries in a thread so graph.ainvoke works too
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, *, filter=None, before=None, limit=None):
+            items = await asyncio.to_thread(
+                lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+            )
+            for item in items:
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def build_checkpointer(db_path, ttl, max_threads, keep_checkpoints):
+    if not db_path or SqliteSaver is None:
+        if db_path:
+            print("langgraph-checkpoint-sqlite is not installed, conversations are kept in memory only")
+        return MemorySaver()
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    saver = BoundedSqliteSaver(conn, ttl=ttl, max_threads=max_threads, keep_checkpoints=keep_checkpoints)
+    saver.prune()
+    return saver
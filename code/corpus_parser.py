@@ -0,0 +1,142 @@
+# Discovery-based, parallel and streaming parser in front of db_prep.py.
+#
+# Every guide matching CORPUS_GLOB under CORPUS_DIR is parsed, one file per task
+# in a process pool. A worker reads its file line by line and feeds the lines to
+# iter_control_units(), a generator version of the control-unit chunker, so a
+# guide is never held in memory as one string. The file's language is counted
+# along the way (letters of the whole file, as before), and every file comes back
+# with its parse statistics:
+#   lines, headings, chunks, distinct IDs, lines before the first heading, and
+#   malformed headings, i.e. lines that start like a control ID but are not one
+#   the chunker can take whole ("1-5-3The ...", "1-2-1- 1 ...", "2-3-1-4-5").
+# parse_corpus() yields the files in completion order, so db_prep.py works on the
+# chunks of one guide while the others are still being parsed.
+
+import os
+import re
+import glob
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import config
+from control_index import normalize_control_id
+from language import letter_counts, language_from_counts, source_framework
+
+# Regex to match any ID: x, x-y, x-y-z, x-y-z-w
+id_pattern = re.compile(r'^(\d+(?:-\d+){0,3})\b')
+# Anything that starts like a multi-part ID, whatever the separators
+loose_id_pattern = re.compile(r'^(\d+(?:\s*[-\u2010\u2013\u2014._/]\s*\d+)+)')
+
+ParsedFile = namedtuple("ParsedFile", ["source", "chunks", "stats"])
+
+
+def discover_files(corpus_dir=config.CORPUS_DIR, pattern=config.CORPUS_GLOB):
+    """Guides under corpus_dir, sorted so chunk order does not depend on the file system."""
+    return sorted(
+        path for path in glob.glob(os.path.join(corpus_dir, pattern), recursive=True)
+        if os.path.isfile(path)
+    )
+
+
+def is_malformed_heading(line, match):
+    loose = loose_id_pattern.match(line)
+    return bool(loose) and (match is None or loose.group(1) != match.group(1))
+
+
+def iter_control_units(lines, stats=None):
+    """Yields {"id", "content"} chunks, one per control heading, from an iterable of lines."""
+    if stats is None:
+        stats = {}
+    stats.update(lines=0, headings=0, lines_before_first_heading=0, malformed_headings=0, malformed_examples=[])
+    current_chunk = []
+    current_id = None
+
+    for line in lines:
+        line = line.rstrip("\n")
+        stats["lines"] += 1
+        stripped = line.strip()
+        match = id_pattern.match(stripped)
+        if is_malformed_heading(stripped, match):
+            stats["malformed_headings"] += 1
+            if len(stats["malformed_examples"]) < 5:
+                stats["malformed_examples"].append(f"{stats['lines']}: {stripped[:60]}")
+        if match:
+            stats["headings"] += 1
+            # Emit the previous chunk before starting a new one
+            if current_chunk and current_id:
+                yield {"id": normalize_control_id(current_id), "content": "\n".join(current_chunk).strip()}
+            # Start a new chunk
+            current_id = match.group(1)
+            current_chunk = [line]
+        else:
+            if current_id is None and stripped:
+                stats["lines_before_first_heading"] += 1
+            current_chunk.append(line)
+
+    # Last chunk
+    if current_chunk and current_id:
+        yield {"id": normalize_control_id(current_id), "content": "\n".join(current_chunk).strip()}
+
+
+def chunk_by_control_units(text):
+    return list(iter_control_units(text.splitlines()))
+
+
+def parse_file(path):
+    """Chunks of one guide with its language, framework and parse statistics (runs in a worker)."""
+    start = time.perf_counter()
+    stats = {}
+    letters = [0, 0]  # Arabic, Latin
+    chunks = []
+    framework = source_framework(path)
+
+    def counted(lines):
+        for line in lines:
+            arabic, latin = letter_counts(line)
+            letters[0] += arabic
+            letters[1] += latin
+            yield line
+
+    with open(path, "r", encoding="utf-8") as f:
+        for chunk in iter_control_units(counted(f), stats):
+            chunk["source"] = path
+            chunk["framework"] = framework
+            chunks.append(chunk)
+
+    # Each guide is written in one language (with some English headings in the
+    # Arabic ones), so the language is decided on the whole file, not per chunk
+    language = language_from_counts(*letters)
+    for chunk in chunks:
+        chunk["language"] = language
+
+    stats.update(
+        chunks=len(chunks),
+        ids=len({chunk["id"] for chunk in chunks}),
+        language=language,
+        framework=framework,
+        bytes=os.path.getsize(path),
+        seconds=round(time.perf_counter() - start, 3),
+    )
+    return ParsedFile(path, chunks, stats)
+
+
+def parse_corpus(paths, workers=0):
+    """Yields a ParsedFile per path as soon as it is parsed (0 workers = one per CPU, at most one per file)."""
+    workers = workers or min(len(paths), os.cpu_count() or 1)
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield parse_file(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(parse_file, path) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def format_stats(stats):
+    return (
+        f"{stats['language']}/{stats['framework']}: {stats['lines']} lines, {stats['chunks']} chunks, "
+        f"{stats['ids']} ids, {stats['malformed_headings']} malformed headings, "
+        f"{stats['lines_before_first_heading']} lines before the first heading ({stats['seconds']}s)"
+    )
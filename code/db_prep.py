@@ -2,244 +2,474 @@
 # docker run -d -p 6333:6333 -p 6334:6334 -v "($pwd)/qdrant_storage:/qdrant/storage:z" qdrant/qdrant
 
 import os
+import time
 import uuid
+import hashlib
+import argparse
 import arabic_reshaper
 from bidi.algorithm import get_display
 
-from langchain_community.document_loaders import TextLoader
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.schema import Document
 import random
-import re
 
-from langchain_qdrant import QdrantVectorStore
+import numpy as np
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
+from qdrant_client.http.models import PointIdsList, PayloadSchemaType
 import certifi
 
+import config
+from embeddings import load_embedding_model
+from control_index import ControlHierarchy, normalize_control_id, hierarchy_path
+from ingest_pipeline import ingest_documents, batched
+from numpy_index import NumpyVectorIndex, numpy_index_path, write_numpy_index
+from bm25_index import BM25Index, bm25_path
+from corpus_parser import discover_files, parse_corpus, format_stats
+from language import source_framework
+from shards import shard_collection_name, save_shards
+from qdrant_settings import collection_config, update_config, QUANTIZATION_MODES
+from retrieval_cache import bump_collection_version, version_path
+
 # Set the SSL certificate path to use certifi's default certificate
 os.environ['SSL_CERT_FILE'] = certifi.where()
 
-# Regex to match any ID: x, x-y, x-y-z, x-y-z-w
-id_pattern = re.compile(r'^(\d+(?:-\d+){0,3})\b')
-
-# A function to normalize IDs
-def normalize_control_id(raw_id):
-    # Arabic-Indic to Western numerals
-    arabic_to_western = str.maketrans("٠١٢٣٤٥٦٧٨٩۱۲۳۷۸", "012345678912378")
-    normalized = raw_id.translate(arabic_to_western)
-    # print("۱۲۳۷۸")
-    
-    # Replace separators to standard format
-    normalized = normalized.replace('.', '-').replace(',', '-').strip()
-    
-    return normalized
-
-
-def get_parent_id(control_id):
-    out = []
-    parts = control_id.split('-')
-    if len(parts) > 1:
-        out.append('-'.join(parts[:-1]))
-    if len(parts) > 2:
-        out.append('-'.join(parts[:-2]))
-    return out  # top-level domain
-
-def get_subcontrols(control_id):
-    pattern = re.compile(rf'^{re.escape(control_id)}-\d+$')
-    subcontrols = [cid for cid in all_ids if pattern.match(cid)]
-    return subcontrols
-
-def get_relevant_ids(id):
-    ids = [id]
-    ids.extend(get_parent_id(id))
-    ids.extend(get_subcontrols(id))
-    return ids
-
-def get_all_descendants(control_id):
-    # Count how many segments the parent has
-    parent_parts = control_id.split('-')
-    parent_depth = len(parent_parts)
-    # Match any ID that starts with the control_id and has deeper hierarchy
-    descendants = [
-        cid for cid in all_ids
-        if cid.startswith(control_id + '-') and len(cid.split('-')) > parent_depth
+# Fixed namespace so the same chunk always maps to the same Qdrant point id
+POINT_ID_NAMESPACE = uuid.UUID("6f1c2a4e-8d3b-4f57-9a0e-2b7c5d1e9f40")
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def stable_point_id(source, control_id, digest):
+    # Only the file name is used so ids do not depend on where the repo is cloned
+    key = f"{os.path.basename(source)}|{control_id}|{digest}"
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, key))
+
+def fetch_existing_metadata(client, collection_name):
+    # point id -> metadata payload of everything already stored in the collection
+    existing = {}
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=1000,
+            offset=offset,
+            with_payload=["metadata"],
+            with_vectors=False,
+        )
+        for point in points:
+            existing[str(point.id)] = (point.payload or {}).get("metadata", {})
+        if offset is None:
+            break
+    return existing
+
+_embed_model = None
+
+def open_embedding_model(args):
+    # Loaded on first use and shared by every collection (shard) written in this run
+    global _embed_model
+    if _embed_model is None:
+        _embed_model = load_embedding_model(backend=args.backend, workers=args.workers, threads=args.threads)
+    return _embed_model
+
+def close_embedding_model():
+    global _embed_model
+    if _embed_model is None:
+        return
+    if hasattr(_embed_model, "stats"):
+        print(f"Embedding cache: {_embed_model.stats()}")
+    inner_model = getattr(_embed_model, "model", _embed_model)
+    if hasattr(inner_model, "close"):
+        inner_model.close()
+    _embed_model = None
+
+
+def update_qdrant_collection(collection_name, ids, docs, args):
+    """Apply the chunk delta to the Qdrant collection; returns True if anything changed."""
+    # client = QdrantClient(path="/langchain_qdrant")
+    client = QdrantClient(url=config.QDRANT_URL)
+
+    if args.full and client.collection_exists(collection_name):
+        print(f"Collection '{collection_name}' already exists. Deleting and re-creating.")
+        client.delete_collection(collection_name)
+
+    index_settings = dict(
+        quantization=args.quantization,
+        on_disk=args.on_disk,
+        m=args.hnsw_m,
+        ef_construct=args.hnsw_ef_construct,
+    )
+
+    if not client.collection_exists(collection_name):
+        print(f"Collection '{collection_name}' not found. Creating it now.")
+        client.create_collection(collection_name=collection_name, **collection_config(**index_settings))
+        print(f"Collection created successfully ({index_settings}).")
+    elif args.reconfigure:
+        # Qdrant rebuilds the quantized copy / HNSW graph in the background
+        client.update_collection(collection_name=collection_name, **update_config(**index_settings))
+        print(f"Collection reconfigured ({index_settings}).")
+
+    # Keyword indexes so control-ID lookups and the language/framework partitions are answered from the payload index
+    for field_name in ("metadata.control_id", "metadata.relevant_ids", "metadata.language", "metadata.framework"):
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=PayloadSchemaType.KEYWORD,
+        )
+
+    # Point ids are derived from (source file, control_id, content hash), so a chunk
+    # whose id is already stored has not changed and does not need to be re-embedded.
+    existing = fetch_existing_metadata(client, collection_name)
+    new_ids = set(ids)
+
+    to_add = [(point_id, doc) for point_id, doc in zip(ids, docs) if point_id not in existing]
+    stale_ids = [point_id for point_id in existing if point_id not in new_ids]
+    # Unchanged chunks can still need new metadata, e.g. when a sub-control was added under them
+    to_update = [
+        (point_id, doc) for point_id, doc in zip(ids, docs)
+        if point_id in existing and existing[point_id] != doc.metadata
     ]
-    return descendants
-
-def chunk_by_control_units(text):
-    lines = text.splitlines()
-    chunks = []
-    current_chunk = []
-    current_id = None
-
-    for line in lines:
-        match = id_pattern.match(line.strip())
-        if match:
-            # Save the previous chunk before starting a new one
-            if current_chunk and current_id:
-                chunks.append({
-                    "id": normalize_control_id(current_id),
-                    "content": "\n".join(current_chunk).strip()
-                })
-            # Start a new chunk
-            current_id = match.group(1)
-            current_chunk = [line]
-        else:
-            current_chunk.append(line)
-    
-    # Add last chunk
-    if current_chunk and current_id:
-        chunks.append({
-            "id": normalize_control_id(current_id),
-            "content": "\n".join(current_chunk).strip()
-        })
-
-    return chunks
 
+    print(f"New or changed chunks: {len(to_add)}")
+    print(f"Removed chunks: {len(stale_ids)}")
+    print(f"Metadata updates: {len(to_update)}")
+
+
+    # Apply the delta
+    if stale_ids:
+        client.delete(
+            collection_name=collection_name,
+            points_selector=PointIdsList(points=stale_ids),
+        )
+
+    for point_id, doc in to_update:
+        client.set_payload(
+            collection_name=collection_name,
+            payload={"metadata": doc.metadata},
+            points=[point_id],
+        )
+
+    if to_add:
+        # The model is only loaded when there is something to embed
+        embed_model = open_embedding_model(args)
+
+        # Embedding of the next batch overlaps with the upsert of the previous one
+        ingest_documents(
+            client,
+            collection_name,
+            iter(to_add),
+            embed_model,
+            batch_size=args.batch_size,
+            max_pending=max(2, args.workers),
+        )
+
+    return bool(to_add or stale_ids or to_update)
+
+
+def update_numpy_index(collection_name, ids, docs, args):
+    """Rewrite the in-process index (numpy_index.py), re-embedding only new or changed chunks."""
+    path = numpy_index_path(collection_name)
+
+    # Same point ids as the Qdrant path, so vectors of unchanged chunks are reused
+    existing = {}
+    if not args.full and os.path.exists(os.path.join(path, "points.json")):
+        old_ids, old_vectors, old_payloads = NumpyVectorIndex(path, collection_name).export()
+        existing = {point_id: (vector, payload) for point_id, vector, payload in zip(old_ids, old_vectors, old_payloads)}
+    new_ids = set(ids)
+
+    to_add = [(point_id, doc) for point_id, doc in zip(ids, docs) if point_id not in existing]
+    stale_ids = [point_id for point_id in existing if point_id not in new_ids]
+    to_update = [
+        (point_id, doc) for point_id, doc in zip(ids, docs)
+        if point_id in existing and existing[point_id][1]["metadata"] != doc.metadata
+    ]
+
+    print(f"New or changed chunks: {len(to_add)}")
+    print(f"Removed chunks: {len(stale_ids)}")
+    print(f"Metadata updates: {len(to_update)}")
+
+    if not (to_add or stale_ids or to_update) and existing:
+        return False
+
+    vectors = {point_id: vector for point_id, (vector, _) in existing.items()}
+    if to_add:
+        embed_model = open_embedding_model(args)
+        start = time.perf_counter()
+        for batch in batched(to_add, args.batch_size):
+            for (point_id, _), vector in zip(batch, embed_model.embed_documents([doc.page_content for _, doc in batch])):
+                vectors[point_id] = vector
+        elapsed = time.perf_counter() - start
+        print(f"Embedded {len(to_add)} chunks in {elapsed:.1f}s ({len(to_add) / max(elapsed, 1e-9):.1f} chunks/s)")
+
+    write_numpy_index(
+        path,
+        ids,
+        np.array([vectors[point_id] for point_id in ids], dtype=np.float32).reshape(len(ids), -1),
+        [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs],
+    )
+    print(f"Vector index written to {path} ({len(ids)} points)")
+    return True
+
+
+def save_bm25(collection_name, ids, docs, changed=True):
+    # Sparse side of the hybrid retriever; rebuilt from scratch, it only tokenizes the chunks.
+    # Left alone when the chunks did not change: a new file makes every running agent reload it
+    if not changed and os.path.exists(bm25_path(collection_name)):
+        print("BM25 index is up to date")
+        return
+    bm25 = BM25Index.build(ids, [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs])
+    bm25.save(bm25_path(collection_name))
+    print(f"BM25 index saved ({len(bm25)} chunks, {len(bm25.postings)} terms)")
+
+
+def write_collection(collection_name, ids, docs, args):
+    """Vectors and BM25 index of one collection; returns True if the vectors changed."""
+    if args.store == "numpy":
+        changed = update_numpy_index(collection_name, ids, docs, args)
+    else:
+        changed = update_qdrant_collection(collection_name, ids, docs, args)
+    save_bm25(collection_name, ids, docs, changed)
+    return changed
+
+
+def write_shards(collection_name, ids, docs, args):
+    """One collection per (framework, language), see shards.py; returns True if any of them changed."""
+    groups = {}
+    for point_id, doc in zip(ids, docs):
+        shard_ids, shard_docs = groups.setdefault((doc.metadata["framework"], doc.metadata["language"]), ([], []))
+        shard_ids.append(point_id)
+        shard_docs.append(doc)
+
+    changed = False
+    written = []
+    for (framework, language), (shard_ids, shard_docs) in sorted(groups.items()):
+        if args.framework and framework not in args.framework:
+            continue
+        shard_name = shard_collection_name(collection_name, framework, language)
+        print(f"\nShard {shard_name}: {len(shard_ids)} chunks")
+        changed = write_collection(shard_name, shard_ids, shard_docs, args) or changed
+        written.append({"collection": shard_name, "framework": framework, "language": language, "chunks": len(shard_ids)})
+
+    if not written:
+        raise SystemExit(f"No chunks of framework {', '.join(args.framework)} in {args.corpus_dir}")
+    dropped = save_shards(collection_name, written, args.framework)
+    print(f"Shards written: {', '.join(shard['collection'] for shard in written)}")
+    for shard in dropped:
+        print(f"⚠️  Shard {shard['collection']} has no chunks anymore and is no longer searched; its collection was left in place")
+    return changed
 
 
 # 0) Make sure you’ve installed:
 #    pip install arabic_reshaper python-bidi
 
-# 1) Configuration
-files = [
-    "Guide to Essential Cybersecurity Controls Implementation.txt",
-    "Guide to Essential Cybersecurity Control - English.txt",
-    "Guide to Critical Systems Cybersecurity Controls Implementation AR.txt",
-    "Guide to Critical Systems Cybersecurity Controls Implementation ENG.txt"
-]
-
-file_paths = []
-
-# Get the directory of the script
-script_dir = os.path.dirname(__file__)
-
-# Go up one level to the project root and then down to the 'files' directory
-files_dir = os.path.join(os.path.dirname(script_dir), 'files')
-
-for file in files:
-    file_paths.append(os.path.join(files_dir, file))
-
-
-# reshaper for Arabic
-reshaper = arabic_reshaper.ArabicReshaper()
-
-# 2) Load & chunk the document
-raw_docs = []
-
-for file_path in file_paths:
-    loader   = TextLoader(file_path, encoding="utf-8")
-    raw_docs.extend(loader.load())
-
-# print(f"type of raw docs: {type(raw_docs)}")
-print("txt loaded successfully")
-
-# splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-# docs     = splitter.split_documents(raw_docs)
-
-
-
-docs = []
-chunks = []
-
-for doc in raw_docs:
-    text = doc.page_content
-    chunks.extend(chunk_by_control_units(text))
-    
-all_ids = set([c['id'] for c in chunks])
-
-for chunk in chunks:
-    control_id = normalize_control_id(chunk["id"])
-    # control_id = chunk["id"]
-    docs.append(Document(
-        page_content=chunk["content"],
-        metadata={
-            "control_id": control_id,
-            "relevant_ids": get_relevant_ids(control_id),
-            "source": doc.metadata.get("source", "")
-        }
-    ))
-
-
-# 3) (Optional) Print how many chunks you got
-print(f"Total chunks: {len(chunks)}\n")
-print(f"Total docs: {len(docs)}\n")
-print(f"Total ids: {len(all_ids)}\n")
-print(f"\n\n{all_ids}\n\n")
-
-
-
-
-for i in range(2):
-    rand = random.randint(0, len(docs)-1)
-
-    reshaped_ans  = reshaper.reshape(docs[i].page_content)
-    display_answer = get_display(reshaped_ans)
-    try:
-        print(display_answer)
-    except UnicodeEncodeError:
-        print("[Unicode text]")
-    print(docs[i].metadata)
-    print('\n\n')
-
-    reshaped_ans  = reshaper.reshape(docs[-i].page_content)
-    display_answer = get_display(reshaped_ans)
-    try:
-        print(display_answer)
-    except UnicodeEncodeError:
-        print("[Unicode text]")
-    print(docs[-i].metadata)
-    print('\n\n')
-
-
-
-model_name = "intfloat/multilingual-e5-large"
-model_kwargs = {'device': 'cpu'}
-encode_kwargs = {'normalize_embeddings': False}
-embed_model = HuggingFaceEmbeddings(
-    model_name=model_name,
-    model_kwargs=model_kwargs,
-    encode_kwargs=encode_kwargs,
-)
-
-# 5) Build & persist Chroma vectorstore
-ids = [str(uuid.uuid4()) for _ in docs]
-# cannot use the control ids directly because they are duplicated (across ar & en, docs)
-
-# client = QdrantClient(path="/langchain_qdrant")
-client = QdrantClient(url="http://localhost:6333")
-
-try:
-    # This will raise an exception if the collection does not exist
-    client.get_collection(collection_name="docs_collection")
-    print("Collection 'docs_collection' already exists. Deleting and re-creating.")
-
-    client.delete_collection("docs_collection")
-    client.create_collection(
-        collection_name="docs_collection",
-        vectors_config=VectorParams(size=1024, distance=Distance.COSINE),
+def main():
+    # 1) Configuration
+    parser = argparse.ArgumentParser(description="Chunk the NCA guides and load them into Qdrant.")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="drop docs_collection (or the NumPy index) and re-embed every chunk instead of only the changed ones",
     )
-    print("Collection created successfully.")
-
-except Exception:
-    # If an exception is raised, the collection doesn't exist, so we create it.
-    print("Collection 'docs_collection' not found. Creating it now.")
-    client.create_collection(
-        collection_name="docs_collection",
-        vectors_config=VectorParams(size=1024, distance=Distance.COSINE),
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=config.INGEST_BATCH_SIZE,
+        help="chunks per embedding/upsert batch",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.INGEST_WORKERS,
+        help="embedding worker processes, each with its own model copy (1 = embed in this process)",
+    )
+    parser.add_argument(
+        "--threads",
+        "--torch-threads",
+        type=int,
+        default=config.EMBEDDING_THREADS,
+        help="intra-op threads per model copy (torch or onnxruntime)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["torch", "onnx"],
+        default=config.EMBEDDING_BACKEND,
+        help="embedding backend; must match the one the agent uses",
+    )
+    parser.add_argument(
+        "--store",
+        choices=["qdrant", "numpy"],
+        default=config.RETRIEVER_BACKEND,
+        help="write the Qdrant collection or the in-process NumPy index; must match the agent's RETRIEVER_BACKEND",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATION_MODES,
+        default=config.QDRANT_QUANTIZATION,
+        help="keep a scalar (int8) or binary copy of the vectors in RAM for search",
+    )
+    parser.add_argument(
+        "--on-disk",
+        action=argparse.BooleanOptionalAction,
+        default=config.QDRANT_ON_DISK,
+        help="store the original float32 vectors on disk",
+    )
+    parser.add_argument("--hnsw-m", type=int, default=config.HNSW_M, help="HNSW edges per node (0 = default)")
+    parser.add_argument(
+        "--hnsw-ef-construct",
+        type=int,
+        default=config.HNSW_EF_CONSTRUCT,
+        help="HNSW build-time candidate list size (0 = default)",
+    )
+    parser.add_argument(
+        "--reconfigure",
+        action="store_true",
+        help="apply the quantization/on-disk/HNSW settings to an existing collection",
+    )
+    parser.add_argument("--corpus-dir", default=config.CORPUS_DIR, help="directory searched for the guides")
+    parser.add_argument("--pattern", default=config.CORPUS_GLOB, help="glob of the guides inside --corpus-dir")
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=config.PARSE_WORKERS,
+        help="parser processes (0 = one per CPU, at most one per file)",
+    )
+    parser.add_argument(
+        "--shards",
+        action=argparse.BooleanOptionalAction,
+        default=config.SHARDING,
+        help="write one collection per framework and language (see shards.py); must match the agent's SHARDING",
+    )
+    parser.add_argument(
+        "--framework",
+        nargs="+",
+        type=str.upper,
+        choices=sorted(config.FRAMEWORKS),
+        help="with --shards, only (re)write the shards of these frameworks (e.g. ECC)",
+    )
+    args = parser.parse_args()
+    if args.framework and not args.shards:
+        parser.error("--framework needs --shards")
+
+    collection_name = config.COLLECTION_NAME
+
+    # 2) Discover, load & chunk the guides; files are parsed in parallel and
+    # streamed line by line (see corpus_parser.py)
+    file_paths = discover_files(args.corpus_dir, args.pattern)
+    # A guide of an unknown framework would get wrong framework filters and shards
+    for path in file_paths:
+        if source_framework(path) is None:
+            print(f"⚠️  Skipping {os.path.relpath(path, args.corpus_dir)}: its name matches no framework of config.FRAMEWORKS")
+    file_paths = [path for path in file_paths if source_framework(path) is not None]
+    if not file_paths:
+        raise SystemExit(f"No guides matching '{args.pattern}' in {args.corpus_dir}")
+    print(f"{len(file_paths)} guides found in {args.corpus_dir}")
+
+    # reshaper for Arabic
+    reshaper = arabic_reshaper.ArabicReshaper()
+
+    start = time.perf_counter()
+    parsed_chunks = {}
+    malformed = 0
+    for parsed in parse_corpus(file_paths, args.parse_workers):
+        print(f"  {os.path.relpath(parsed.source, args.corpus_dir)} -> {format_stats(parsed.stats)}")
+        for example in parsed.stats["malformed_examples"]:
+            print(f"      malformed heading at line {example}")
+        malformed += parsed.stats["malformed_headings"]
+        # Hashed as each file arrives, while the other files are still being parsed
+        for chunk in parsed.chunks:
+            chunk["digest"] = content_hash(chunk["content"])
+        parsed_chunks[parsed.source] = parsed.chunks
+
+    # Back in file order, whatever order the workers finished in
+    chunks = [chunk for path in file_paths for chunk in parsed_chunks[path]]
+    print(
+        f"Parsed {len(file_paths)} guides in {time.perf_counter() - start:.2f}s: "
+        f"{len(chunks)} chunks, {malformed} malformed headings"
     )
-    print("Collection created successfully.")
-
-
-vector_store = QdrantVectorStore(
-    client=client,
-    collection_name="docs_collection",
-    embedding=embed_model,
-    # retrieval_mode=RetrievalMode.DENSE # default
-)
-
-vector_store.add_documents(documents=docs, ids=ids)
-
 
-print(f"✅ Qdrant store added documents")
\ No newline at end of file
+    docs = []
+
+    all_ids = set([c['id'] for c in chunks])
+    # Built once; parent/child lookups only walk the ID's own path
+    hierarchy = ControlHierarchy(all_ids)
+
+    ids = []
+    seen_ids = set()
+
+    for chunk in chunks:
+        control_id = normalize_control_id(chunk["id"])
+        # control_id = chunk["id"]
+        digest = chunk["digest"]
+        point_id = stable_point_id(chunk["source"], control_id, digest)
+        if point_id in seen_ids:
+            # exact duplicate of a chunk already taken from the same file
+            continue
+        seen_ids.add(point_id)
+        ids.append(point_id)
+        docs.append(Document(
+            page_content=chunk["content"],
+            metadata={
+                "control_id": control_id,
+                "relevant_ids": hierarchy.relevant_ids(control_id),
+                "source": chunk["source"],
+                "language": chunk["language"],
+                "framework": chunk["framework"],
+                "content_hash": digest,
+            }
+        ))
+
+
+    # 3) (Optional) Print how many chunks you got
+    print(f"Total chunks: {len(chunks)}\n")
+    print(f"Total docs: {len(docs)}\n")
+    print(f"Total ids: {len(all_ids)}\n")
+    print(f"\n\n{all_ids}\n\n")
+
+
+
+
+    for i in range(2):
+        rand = random.randint(0, len(docs)-1)
+
+        reshaped_ans  = reshaper.reshape(docs[i].page_content)
+        display_answer = get_display(reshaped_ans)
+        try:
+            print(display_answer)
+        except UnicodeEncodeError:
+            print("[Unicode text]")
+        print(docs[i].metadata)
+        print('\n\n')
+
+        reshaped_ans  = reshaper.reshape(docs[-i].page_content)
+        display_answer = get_display(reshaped_ans)
+        try:
+            print(display_answer)
+        except UnicodeEncodeError:
+            print("[Unicode text]")
+        print(docs[-i].metadata)
+        print('\n\n')
+
+
+
+    # 4) Bring the vector store up to date: one collection, or one per framework and language
+    if args.shards:
+        changed = write_shards(collection_name, ids, docs, args)
+        # Corpus-wide BM25 index, read by the query router and the sparse-only decision
+        save_bm25(collection_name, ids, docs, changed)
+    else:
+        changed = write_collection(collection_name, ids, docs, args)
+    close_embedding_model()
+
+
+    # The agent loads this to expand control IDs at query time
+    hierarchy.save(hierarchy_path(collection_name))
+    print(f"Control hierarchy saved ({len(hierarchy)} ids)")
+
+    # A new version tells the agent's retrieval cache that its entries are stale (the
+    # cache sits in front of the shards, so it follows the base collection's version)
+    if changed or not os.path.exists(version_path(collection_name)):
+        print(f"Collection version: {bump_collection_version(collection_name)}")
+
+    print(f"✅ {'Vector index' if args.store == 'numpy' else 'Qdrant store'} is up to date")
+
+
+if __name__ == "__main__":
+    main()
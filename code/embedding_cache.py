@@ -0,0 +1,176 @@
+# Persistent embedding cache shared by ingestion and the query path.
+#
+# Vectors are keyed by the sha256 of the text and stored as float32 rows in a flat
+# file that is read through a memory map. A tab separated index maps each key to
+# its row. Writes are append-only, so another process (e.g. db_prep.py while the app
+# is running, or the workers of api_server.py) can add vectors and they are picked
+# up on the next cache miss. Appends hold an exclusive flock on the vectors file, so
+# the row numbers written to the index are those of the rows actually written.
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run a single writer at a time
+    fcntl = None
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self.index_path = os.path.join(cache_dir, "index.tsv")
+        self.meta_path = os.path.join(cache_dir, "meta.json")
+
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+        self._rows = {}  # key -> row number in vectors.f32
+        self._index_offset = 0  # how far index.tsv has been read
+        self._mmap = None
+        self._lock = threading.Lock()
+        self._read_index()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # another process is still writing this line
+                key, row = line.rstrip("\n").split("\t")
+                self._rows[key] = int(row)
+                self._index_offset += len(line.encode("utf-8"))
+
+    def _vectors(self, min_rows):
+        # Re-map the vectors file whenever it has grown past the current mapping
+        if self._mmap is None or self._mmap.shape[0] < min_rows:
+            rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._mmap
+
+    def get_many(self, keys):
+        """Return a list with a vector (np.ndarray) or None for every key."""
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._read_index()
+            rows = [self._rows.get(key) for key in keys]
+            found = [row for row in rows if row is not None]
+            if not found:
+                return [None] * len(keys)
+            vectors = self._vectors(max(found) + 1)
+            return [None if row is None else np.array(vectors[row]) for row in rows]
+
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+
+            if all(key in self._rows for key in keys):
+                return
+            with open(self.vectors_path, "ab") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+                # Rows another process appended since our last read are ours to skip too
+                self._read_index()
+                new = list({key: vec for key, vec in zip(keys, vectors) if key not in self._rows}.items())
+                if not new:
+                    return
+                row_size = 4 * self.dim
+                size = os.fstat(f.fileno()).st_size
+                if size % row_size:
+                    f.truncate(size - size % row_size)  # partial row of a writer that crashed
+                first_row = size // row_size
+                f.write(np.stack([vec for _, vec in new]).tobytes())
+                f.flush()
+                # The index is written after the vectors so readers never see a row that is not there yet
+                lines = [f"{key}\t{first_row + i}\n" for i, (key, _) in enumerate(new)]
+                with open(self.index_path, "a", encoding="utf-8") as index:
+                    index.write("".join(lines))
+                self._read_index()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model with the on-disk cache and an LRU for hot queries."""
+
+    def __init__(self, model, cache, lru_size=2048):
+        self.model = model
+        self.cache = cache
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self.lru_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        keys = [text_key(text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        missing = [i for i, vec in enumerate(cached) if vec is None]
+        self.disk_hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            # Embed each distinct missing text once
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            computed = self.model.embed_documents(unique)
+            self.cache.put_many([text_key(text) for text in unique], computed)
+            by_text = dict(zip(unique, computed))
+            for i in missing:
+                cached[i] = by_text[texts[i]]
+
+        return [list(map(float, vec)) for vec in cached]
+
+    def embed_query(self, text):
+        key = text_key(text)
+        with self._lru_lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.lru_hits += 1
+                return self._lru[key]
+
+        vector = self.cache.get_many([key])[0]
+        if vector is not None:
+            self.disk_hits += 1
+            vector = list(map(float, vector))
+        else:
+            self.misses += 1
+            vector = self.model.embed_query(text)
+            self.cache.put_many([key], [vector])
+
+        with self._lru_lock:
+            self._lru[key] = vector
+            if len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+        return vector
+
+    def stats(self):
+        total = self.lru_hits + self.disk_hits + self.misses
+        return {
+            "lru_hits": self.lru_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.lru_hits + self.disk_hits) / total if total else 0.0,
+            "cached_vectors": len(self.cache),
+        }
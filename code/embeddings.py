@@ -0,0 +1,107 @@
+# Builds the embedding model used by both db_prep.py and agent_prep.py.
+# They must use the same model, otherwise query vectors do not match the stored ones.
+#
+# Every backend returns a langchain `Embeddings` object (embed_documents / embed_query),
+# so the rest of the code does not care which one is used:
+#   - "torch": sentence-transformers through HuggingFaceEmbeddings (fp32 PyTorch)
+#   - "onnx":  ONNX Runtime with an int8 quantized export (onnx_embeddings.py)
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+import config
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+
+
+def safe_name(model_name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+
+
+def build_hf_model(model_name, threads=None):
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+    model_kwargs = {'device': 'cpu'}
+    encode_kwargs = {'normalize_embeddings': False}
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs=encode_kwargs,
+    )
+
+
+def build_onnx_model(model_name, threads=None):
+    from onnx_embeddings import OnnxEmbeddings
+
+    return OnnxEmbeddings(
+        model_name,
+        os.path.join(config.ONNX_MODEL_DIR, safe_name(model_name)),
+        intra_op_threads=threads,
+    )
+
+
+## Available backends: name -> function(model_name, threads) returning an Embeddings object
+embedding_backends = {
+    "torch": build_hf_model,
+    "onnx": build_onnx_model,
+}
+
+
+## Process pool: every worker process loads its own copy of the model once
+_worker_model = None
+
+def _init_worker(backend, model_name, threads):
+    global _worker_model
+    _worker_model = embedding_backends[backend](model_name, threads)
+
+def _embed_in_worker(texts):
+    return _worker_model.embed_documents(texts)
+
+
+class ProcessPoolEmbeddings(Embeddings):
+    """Spreads embed_documents calls over worker processes (used for bulk ingestion)."""
+
+    def __init__(self, backend, model_name, workers, threads=None):
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(backend, model_name, threads),
+        )
+
+    def embed_documents(self, texts):
+        return self.executor.submit(_embed_in_worker, texts).result()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def load_embedding_model(
+    model_name=config.EMBEDDING_MODEL_NAME,
+    backend=config.EMBEDDING_BACKEND,
+    cache_dir=config.EMBEDDING_CACHE_DIR,
+    workers=1,
+    threads=config.EMBEDDING_THREADS,
+):
+    if backend not in embedding_backends:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {sorted(embedding_backends)}")
+
+    if workers > 1:
+        embed_model = ProcessPoolEmbeddings(backend, model_name, workers, threads)
+    else:
+        embed_model = embedding_backends[backend](model_name, threads)
+
+    if not cache_dir:
+        return embed_model
+
+    # One cache per model and backend, vectors from different models must never be mixed
+    cache_name = safe_name(model_name) if backend == "torch" else f"{safe_name(model_name)}-{backend}"
+    return CachedEmbeddings(embed_model, EmbeddingCache(os.path.join(cache_dir, cache_name)), lru_size=config.EMBEDDING_LRU_SIZE)
@@ -0,0 +1,119 @@
+# Local stand-in for the DeepSeek chat model (LLM_PROVIDER=fake).
+#
+# Lets the whole graph run on a machine without network access or API key, for
+# load tests and profiling of retrieval and orchestration. It behaves like the
+# real model as far as the graph can tell:
+#   - with tools bound (query_or_respond) it calls the first tool, `retrieve`,
+#     with the user's question as the query,
+#   - without tools (generate) it answers with the first words of the retrieved
+#     context, answer_tokens of them,
+#   - the first token arrives after `latency` seconds and the next ones at
+#     tokens_per_second, in invoke, stream and their async versions,
+#   - usage_metadata is filled in, so the token counts in the traces are exact.
+# The output only depends on the messages, so runs are reproducible.
+
+import re
+import json
+import time
+import zlib
+import asyncio
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+class FakeChatModel(BaseChatModel):
+    latency: float = 0.3  # seconds before the first token
+    tokens_per_second: float = 50.0  # 0 = the whole answer at once
+    answer_tokens: int = 120
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool)["function"]["name"] for tool in tools], **kwargs)
+
+    def _reply(self, messages, tools):
+        """(text tokens, tool call or None) for these messages."""
+        question = next((m.content for m in reversed(messages) if m.type == "human"), "")
+        if tools and messages and messages[-1].type == "human":
+            tool_call = {
+                "name": tools[0],
+                "args": {"query": question},
+                "id": f"call_{len(messages)}_{zlib.crc32(question.encode('utf-8')):08x}",
+            }
+            return [], tool_call
+
+        # generate() puts the retrieved context after the instructions of its system message
+        context = messages[0].content.split("\n\n", 1)[-1] if messages and messages[0].type == "system" else ""
+        words = re.findall(r'\S+', context) or re.findall(r'\S+', question) or ["..."]
+        words = (words * (self.answer_tokens // len(words) + 1))[:self.answer_tokens]
+        return [word + " " for word in words], None
+
+    def _usage(self, messages, tokens, tool_call):
+        output_tokens = len(tokens) or (count_tokens_approximately([json.dumps(tool_call["args"])]) if tool_call else 0)
+        input_tokens = count_tokens_approximately(messages)
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _delay(self, tokens):
+        # Time to the first token, plus the time to generate the rest
+        rest = len(tokens) / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        return self.latency + rest
+
+    def _message(self, messages, tokens, tool_call):
+        return AIMessage(
+            content="".join(tokens),
+            tool_calls=[tool_call] if tool_call else [],
+            usage_metadata=self._usage(messages, tokens, tool_call),
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+        tokens, tool_call = self._reply(messages, tools)
+        time.sleep(self._delay(tokens))
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, tokens, tool_call))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+        tokens, tool_call = self._reply(messages, tools)
+        await asyncio.sleep(self._delay(tokens))
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, tokens, tool_call))])
+
+    def _chunks(self, messages, tokens, tool_call):
+        # Tool call in one chunk, or one chunk per token; the usage rides on the last one
+        usage = self._usage(messages, tokens, tool_call)
+        if tool_call:
+            yield AIMessageChunk(
+                content="",
+                tool_call_chunks=[{
+                    "name": tool_call["name"],
+                    "args": json.dumps(tool_call["args"], ensure_ascii=False),
+                    "id": tool_call["id"],
+                    "index": 0,
+                }],
+                usage_metadata=usage,
+            )
+            return
+        for i, token in enumerate(tokens):
+            yield AIMessageChunk(content=token, usage_metadata=usage if i == len(tokens) - 1 else None)
+
+    def _token_interval(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _stream(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+        tokens, tool_call = self._reply(messages, tools)
+        time.sleep(self.latency)
+        for i, chunk in enumerate(self._chunks(messages, tokens, tool_call)):
+            if i:
+                time.sleep(self._token_interval())
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+        tokens, tool_call = self._reply(messages, tools)
+        await asyncio.sleep(self.latency)
+        for i, chunk in enumerate(self._chunks(messages, tokens, tool_call)):
+            if i:
+                await asyncio.sleep(self._token_interval())
+            yield ChatGenerationChunk(message=chunk)
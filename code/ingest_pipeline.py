@@ -0,0 +1,86 @@
+# Streaming ingest stage used by db_prep.py.
+#
+# Documents are pulled lazily from an iterator, grouped into fixed size batches and
+# embedded while the previous batches are being upserted to Qdrant:
+#
+#   iterator -> batch -> embed (worker threads / processes) -> upsert (uploader thread)
+#
+# At most `max_pending` batches are embedding and `max_pending` are uploading at any
+# time, so memory stays flat however large the corpus is.
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from qdrant_client.http.models import PointStruct
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def upsert_batch(client, collection_name, batch, vectors):
+    # Same payload layout as QdrantVectorStore so the agent can read these points
+    points = [
+        PointStruct(
+            id=point_id,
+            vector=list(vector),
+            payload={"page_content": doc.page_content, "metadata": doc.metadata},
+        )
+        for (point_id, doc), vector in zip(batch, vectors)
+    ]
+    client.upsert(collection_name=collection_name, points=points, wait=True)
+    return len(points)
+
+
+def ingest_documents(client, collection_name, items, embed_model, batch_size=32, max_pending=2):
+    """Embed and upsert (point_id, Document) pairs; returns the number of points written."""
+    embed_pool = ThreadPoolExecutor(max_workers=max_pending, thread_name_prefix="embed")
+    upload_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upsert")
+    embedding = deque()
+    uploading = deque()
+    start = time.perf_counter()
+    embedded = 0
+    written = 0
+
+    def report():
+        elapsed = time.perf_counter() - start
+        rate = embedded / elapsed if elapsed else 0.0
+        print(f"  embedded {embedded} chunks, uploaded {written} ({rate:.1f} chunks/s)")
+
+    def finish_embedding():
+        nonlocal embedded
+        batch, future = embedding.popleft()
+        vectors = future.result()
+        embedded += len(batch)
+        uploading.append(upload_pool.submit(upsert_batch, client, collection_name, batch, vectors))
+        report()
+
+    def finish_upload():
+        nonlocal written
+        written += uploading.popleft().result()
+
+    try:
+        for batch in batched(items, batch_size):
+            texts = [doc.page_content for _, doc in batch]
+            embedding.append((batch, embed_pool.submit(embed_model.embed_documents, texts)))
+            if len(embedding) >= max_pending:
+                finish_embedding()
+            if len(uploading) > max_pending:
+                finish_upload()
+
+        while embedding:
+            finish_embedding()
+        while uploading:
+            finish_upload()
+    finally:
+        embed_pool.shutdown(wait=True, cancel_futures=True)
+        upload_pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    if written:
+        print(f"Ingested {written} chunks in {elapsed:.1f}s ({written / elapsed:.1f} chunks/s)")
+    return written
@@ -0,0 +1,51 @@
+# Language and framework detection shared by ingestion and retrieval.
+#
+# Every chunk is stored with a "language" ("ar" / "en") and a "framework" (a label
+# of config.FRAMEWORKS: "ECC", "CSCC", ...) payload, and the retriever searches the
+# partition that matches the question.
+
+import os
+import re
+
+import config
+
+arabic_letter = re.compile(r'[\u0600-\u06FF]')
+latin_letter = re.compile(r'[A-Za-z]')
+
+
+def letter_counts(text):
+    """(Arabic letters, Latin letters); summed line by line when a file is streamed."""
+    return len(arabic_letter.findall(text)), len(latin_letter.findall(text))
+
+
+def language_from_counts(arabic, latin, default="en"):
+    if not arabic and not latin:
+        return default
+    return "ar" if arabic > latin else "en"
+
+
+def detect_language(text, default="en"):
+    """Returns "ar" when Arabic letters outnumber Latin ones, `default` when there are no letters at all."""
+    return language_from_counts(*letter_counts(text), default=default)
+
+
+## The guides of each framework, by file name
+framework_file_patterns = {
+    framework: re.compile(patterns["files"], re.IGNORECASE) for framework, patterns in config.FRAMEWORKS.items()
+}
+
+def source_framework(source):
+    """The framework of a guide from its file name, None when no pattern of config.FRAMEWORKS matches."""
+    name = os.path.basename(source)
+    return next((framework for framework, pattern in framework_file_patterns.items() if pattern.search(name)), None)
+
+
+## Explicit framework mentions in a question
+framework_patterns = {
+    framework: re.compile(patterns["query"], re.IGNORECASE) for framework, patterns in config.FRAMEWORKS.items()
+}
+
+def query_framework(query):
+    """The framework the question names, or None when it names none or several."""
+    named = [framework for framework, pattern in framework_patterns.items() if pattern.search(query)]
+    return named[0] if len(named) == 1 else None
@@ -0,0 +1,187 @@
+# In-process vector index: an alternative to the Qdrant server for small corpora.
+#
+# The corpus is a few thousand control chunks, so an exact search over all of them is
+# a single matrix-vector product. db_prep.py writes (see write_numpy_index):
+#   <INDEX_DIR>/<collection>.numpy/vectors.f32   L2-normalized float32 matrix, one row per point
+#   <INDEX_DIR>/<collection>.numpy/points.json   point ids and payloads, in row order
+# The matrix is memory mapped, so it is shared between processes through the page
+# cache. For every control_id / relevant_ids / language / framework value a boolean
+# mask over the rows is built at load time, so the filters of the retriever are a
+# few ORs / ANDs.
+#
+# Scores are cosine similarities, the same as the Qdrant collection (Distance.COSINE).
+
+import os
+import json
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+import config
+
+## Payload fields with precomputed masks; relevant_ids holds a list, the others one value
+MASK_FIELDS = ("control_id", "relevant_ids", "language", "framework")
+
+## Same attributes as the Qdrant points the retriever reads (id, payload, score)
+IndexPoint = namedtuple("IndexPoint", ["id", "payload", "score"])
+
+
+def numpy_index_path(collection_name):
+    return os.path.join(config.INDEX_DIR, f"{collection_name}.numpy")
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.clip(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12, None)
+
+
+def build_masks(payloads):
+    """field -> value -> boolean row mask, for the MASK_FIELDS payload fields."""
+    rows = {field: {} for field in MASK_FIELDS}
+    for row, payload in enumerate(payloads):
+        metadata = payload.get("metadata", {})
+        for field in MASK_FIELDS:
+            values = metadata.get(field)
+            for value in values if isinstance(values, list) else [values]:
+                rows[field].setdefault(value, []).append(row)
+
+    masks = {}
+    for field, values in rows.items():
+        masks[field] = {}
+        for value, value_rows in values.items():
+            mask = np.zeros(len(payloads), dtype=bool)
+            mask[value_rows] = True
+            masks[field][value] = mask
+    return masks
+
+
+def combine_masks(masks, size, control_ids=None, relevant_ids=None, language=None, framework=None):
+    """Rows whose control_id is in control_ids OR whose relevant_ids intersect relevant_ids
+    (every row when both are None), AND in the given language / framework partition."""
+    if control_ids is None and relevant_ids is None:
+        combined = np.ones(size, dtype=bool)
+    else:
+        combined = np.zeros(size, dtype=bool)
+        for field, values in (("control_id", control_ids), ("relevant_ids", relevant_ids)):
+            for value in values or ():
+                value_mask = masks[field].get(value)
+                if value_mask is not None:
+                    combined |= value_mask
+    for field, value in (("language", language), ("framework", framework)):
+        if value is not None:
+            value_mask = masks[field].get(value)
+            combined &= value_mask if value_mask is not None else False
+    return combined
+
+
+def write_numpy_index(path, point_ids, vectors, payloads):
+    """Write (or replace) an index; readers pick the new files up on their next search."""
+    os.makedirs(path, exist_ok=True)
+    matrix = normalize_rows(vectors).reshape(len(point_ids), -1)
+
+    # Vectors first: a reader only reloads when points.json changes, and by then
+    # the matching vectors file is already in place.
+    vectors_path = os.path.join(path, "vectors.f32")
+    matrix.tofile(vectors_path + ".tmp")
+    os.replace(vectors_path + ".tmp", vectors_path)
+
+    points_path = os.path.join(path, "points.json")
+    with open(points_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(
+            {"count": len(point_ids), "dim": int(matrix.shape[1]), "ids": list(point_ids), "payloads": payloads},
+            f,
+            ensure_ascii=False,
+        )
+    os.replace(points_path + ".tmp", points_path)
+
+
+class _IndexState:
+    # Everything loaded from one version of the files, swapped as a whole on reload.
+    # A search that builds a mask and then scrolls or searches with it uses one state
+    # for both, so a reload in between cannot apply the mask to other rows.
+    def __init__(self, path):
+        with open(os.path.join(path, "points.json"), "r", encoding="utf-8") as f:
+            points = json.load(f)
+        self.ids = points["ids"]
+        self.payloads = points["payloads"]
+        count, dim = points["count"], points["dim"]
+        if count:
+            self.vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r", shape=(count, dim))
+        else:
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.masks = build_masks(self.payloads)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def mask(self, control_ids=None, relevant_ids=None, language=None, framework=None):
+        return combine_masks(self.masks, len(self.ids), control_ids, relevant_ids, language, framework)
+
+    def scroll(self, mask, limit=256):
+        return [
+            IndexPoint(self.ids[row], self.payloads[row], None)
+            for row in np.flatnonzero(mask)[:limit]
+        ]
+
+    def search(self, vector, k, mask=None):
+        query = normalize_rows(vector)
+        if mask is None:
+            rows = None
+            scores = self.vectors @ query
+        else:
+            rows = np.flatnonzero(mask)
+            scores = self.vectors[rows] @ query
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        # argpartition finds the k best in linear time, only those k are sorted
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        found = top if rows is None else rows[top]
+        return [
+            IndexPoint(self.ids[row], self.payloads[row], float(score))
+            for row, score in zip(found, scores[top])
+        ]
+
+
+class NumpyVectorIndex:
+    def __init__(self, path, collection_name=None):
+        self.path = path
+        self.collection_name = collection_name or os.path.basename(path).rsplit(".", 1)[0]
+        self._points_path = os.path.join(path, "points.json")
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._state = None
+        self.refresh()
+
+    def __len__(self):
+        return len(self._state)
+
+    def refresh(self):
+        """The current version of the index (reloaded when db_prep.py rewrote it, a stat
+        call per search), with the same mask / scroll / search methods."""
+        mtime = os.stat(self._points_path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._state = _IndexState(self.path)
+                    self._mtime = mtime
+        return self._state
+
+    def mask(self, control_ids=None, relevant_ids=None, language=None, framework=None):
+        return self.refresh().mask(control_ids, relevant_ids, language, framework)
+
+    def scroll(self, mask, limit=256):
+        """Unranked points matching a mask (like a filtered Qdrant scroll)."""
+        return self.refresh().scroll(mask, limit)
+
+    def search(self, vector, k, mask=None):
+        """Exact top-k by cosine similarity, optionally restricted to a mask."""
+        return self.refresh().search(vector, k, mask=mask)
+
+    def export(self):
+        """(ids, vectors, payloads) of every point, used by db_prep.py to reuse stored vectors."""
+        state = self.refresh()
+        return list(state.ids), np.array(state.vectors), list(state.payloads)
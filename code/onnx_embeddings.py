@@ -0,0 +1,92 @@
+# ONNX Runtime backend for the embedding model, with dynamic int8 quantization.
+#
+# The first time a model is used it is exported to ONNX with optimum and its weights
+# are quantized to int8 (activations stay fp32 and are quantized on the fly). Both
+# the export and the quantized model are kept in `model_dir` and reused afterwards.
+# Inference is mean pooling over the last hidden state followed by L2 normalization,
+# the same as the sentence-transformers pipeline of multilingual-e5.
+#
+# Needs the optional packages: pip install "optimum[onnxruntime]" onnxruntime
+#
+# Vectors are close to, but not identical with, the PyTorch ones, so the collection
+# should be (re)built with the same backend that serves the queries. Use
+# benchmarks/embedding_backends.py to check the retrieval agreement first.
+
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def export_quantized_model(model_name, model_dir):
+    """Export `model_name` to ONNX and quantize it to int8; returns the quantized model path."""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    export_dir = os.path.join(model_dir, "fp32")
+    quantized_dir = os.path.join(model_dir, "int8")
+    quantized_path = os.path.join(quantized_dir, "model_quantized.onnx")
+    if os.path.exists(quantized_path):
+        return quantized_path
+
+    print(f"Exporting {model_name} to ONNX (one time only)...")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(export_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(quantized_dir)
+
+    print("Quantizing the ONNX model to int8...")
+    quantizer = ORTQuantizer.from_pretrained(export_dir)
+    # avx2 kernels run everywhere; avx512_vnni is faster where the CPU supports it
+    quantization_config = AutoQuantizationConfig.avx2(is_static=False, per_channel=True)
+    quantizer.quantize(save_dir=quantized_dir, quantization_config=quantization_config)
+    return quantized_path
+
+
+class OnnxEmbeddings(Embeddings):
+    def __init__(self, model_name, model_dir, intra_op_threads=None, batch_size=16, max_length=512):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = export_quantized_model(model_name, model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(model_path))
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _embed_batch(self, texts):
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        inputs = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+        hidden = self.session.run(None, inputs)[0]  # (batch, tokens, dim)
+
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        # Batch texts of similar length together so little time is spent on padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._embed_batch([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0].tolist()
@@ -0,0 +1,93 @@
+# Storage, index and search settings for the Qdrant collection.
+#
+# db_prep.py uses collection_config() when it creates (or reconfigures) the collection
+# and the agent passes search_params() with every dense search, so both sides agree:
+#   - quantization "scalar" keeps an int8 copy of every vector in RAM (4x smaller),
+#     "binary" a 1-bit copy (32x smaller); the search runs on the quantized copy and
+#     the best `oversampling * k` candidates are rescored with the original vectors,
+#   - on_disk moves the original float32 vectors to disk (memory mapped),
+#   - hnsw_m / hnsw_ef_construct control the graph size and build quality,
+#     hnsw_ef the breadth of the search at query time.
+# A value of 0 (or None) keeps Qdrant's default.
+
+from qdrant_client.http.models import (
+    Distance,
+    VectorParams,
+    VectorParamsDiff,
+    HnswConfigDiff,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Disabled,
+    SearchParams,
+    QuantizationSearchParams,
+)
+
+import config
+
+VECTOR_SIZE = 1024  # multilingual-e5-large
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+
+def quantization_config(mode):
+    if mode == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if mode == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    if mode in (None, "", "none"):
+        return None
+    raise ValueError(f"Unknown quantization '{mode}', expected one of {QUANTIZATION_MODES}")
+
+
+def hnsw_config(m=None, ef_construct=None):
+    if not m and not ef_construct:
+        return None
+    return HnswConfigDiff(m=m or None, ef_construct=ef_construct or None)
+
+
+def collection_config(
+    quantization=config.QDRANT_QUANTIZATION,
+    on_disk=config.QDRANT_ON_DISK,
+    m=config.HNSW_M,
+    ef_construct=config.HNSW_EF_CONSTRUCT,
+):
+    """Keyword arguments for client.create_collection()."""
+    return {
+        "vectors_config": VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE, on_disk=on_disk or None),
+        "hnsw_config": hnsw_config(m, ef_construct),
+        "quantization_config": quantization_config(quantization),
+    }
+
+
+def update_config(
+    quantization=config.QDRANT_QUANTIZATION,
+    on_disk=config.QDRANT_ON_DISK,
+    m=config.HNSW_M,
+    ef_construct=config.HNSW_EF_CONSTRUCT,
+):
+    """Keyword arguments for client.update_collection() to apply the same settings to an existing collection."""
+    return {
+        "vectors_config": {"": VectorParamsDiff(on_disk=on_disk)},
+        "hnsw_config": hnsw_config(m, ef_construct),
+        # Disabled removes quantization that was configured before
+        "quantization_config": quantization_config(quantization) or Disabled.DISABLED,
+    }
+
+
+def search_params(
+    hnsw_ef=config.SEARCH_HNSW_EF,
+    oversampling=config.SEARCH_OVERSAMPLING,
+    rescore=config.SEARCH_RESCORE,
+    exact=False,
+):
+    """SearchParams for dense queries, or None to use Qdrant's defaults."""
+    quantization = None
+    if oversampling or not rescore:
+        quantization = QuantizationSearchParams(rescore=rescore, oversampling=oversampling or None)
+    if not hnsw_ef and quantization is None and not exact:
+        return None
+    return SearchParams(hnsw_ef=hnsw_ef or None, exact=exact, quantization=quantization)
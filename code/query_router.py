@@ -0,0 +1,117 @@
+# Decides, without calling the LLM, whether a question goes straight to retrieval.
+#
+# query_or_respond only asks the LLM whether to call `retrieve`, and for a GRC
+# assistant the answer is almost always yes. The router node runs first and sends
+# the question directly to the retrieve tool when:
+#   1. it names control IDs,
+#   2. it contains regulatory vocabulary (bilingual keyword list),
+#   3. most of its terms are found in the corpus (BM25 index coverage), or
+#   4. its embedding is closer to example regulatory questions than to small talk.
+# Greetings/thanks, and short follow-ups that refer back to the conversation ("what
+# about its sub-controls?"), still go to the LLM, which can answer or rewrite them.
+
+import re
+
+import numpy as np
+
+from bm25_index import tokenize
+
+
+## Regulatory vocabulary; tokenized with the BM25 tokenizer so Arabic variants match
+regulatory_terms = set(tokenize(
+    # English
+    "control controls subcontrol policy policies procedure requirement requirements compliance comply "
+    "cybersecurity security cyber risk risks audit governance ecc cscc nca mfa authentication "
+    "authorization encryption cryptography backup backups password passwords access privileged identity "
+    "incident incidents vulnerability vulnerabilities penetration patch patching logs logging monitoring "
+    "third-party outsourcing cloud hosting asset assets network firewall malware email web application "
+    "physical continuity resilience awareness training classification data protection mobile byod "
+    "industrial ics ot threat intelligence soc siem hardening configuration remote teleworking "
+    # Arabic
+    "ضابط ضوابط الضوابط سياسة سياسات إجراءات متطلبات الامتثال التزام الأمن السيبراني مخاطر المخاطر "
+    "تدقيق مراجعة حوكمة الحوكمة الهيئة الوطنية التحقق الهوية تشفير التشفير النسخ الاحتياطي كلمة مرور "
+    "الصلاحيات الوصول الحوادث الثغرات الاختراق التحديثات السجلات المراقبة الأطراف الخارجية الحوسبة "
+    "السحابية الأصول الشبكات جدار الحماية البريد الإلكتروني تطبيقات الويب المادي استمرارية التوعية "
+    "التدريب تصنيف البيانات حماية الأجهزة المحمولة الصناعي التهديدات"
+))
+
+## Messages that are only greetings, thanks, goodbyes or questions about the assistant
+small_talk_words = {
+    "hi", "hello", "hey", "thanks", "thank", "you", "ok", "okay", "bye", "goodbye", "good", "morning",
+    "evening", "afternoon", "night", "how", "are", "who", "what", "is", "your", "name", "nice", "great",
+    "cool", "welcome", "yes", "no", "please", "sure", "cheers",
+    "مرحبا", "أهلا", "اهلا", "السلام", "عليكم", "شكرا", "شكراً", "مع", "السلامة", "صباح", "مساء", "الخير",
+    "النور", "كيف", "حالك", "من", "أنت", "انت", "اسمك", "ما", "نعم", "لا", "تمام", "ممتاز", "وعليكم",
+}
+
+## Words that make a short question depend on the previous turns
+referring_words = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "above", "previous", "same",
+    "هذا", "هذه", "ذلك", "تلك", "هؤلاء", "السابق", "نفسه",
+}
+
+regulatory_examples = [
+    "What are the cybersecurity requirements for managing privileged access?",
+    "How should backups be protected according to the controls?",
+    "What does the ECC say about third-party cybersecurity?",
+    "Which controls apply to critical systems penetration testing?",
+    "ما هي متطلبات الأمن السيبراني لإدارة الهويات والصلاحيات؟",
+    "ما هي ضوابط حماية البريد الإلكتروني؟",
+]
+
+small_talk_examples = [
+    "Hello, how are you?",
+    "Thank you for your help!",
+    "Who are you?",
+    "Tell me a joke",
+    "مرحبا كيف حالك؟",
+    "شكرا لك",
+]
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.clip(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12, None)
+
+
+class QueryRouter:
+    def __init__(self, sparse_index=None, embedding_model=None, min_coverage=0.75, embedding_margin=0.02):
+        self.sparse_index = sparse_index
+        self.embedding_model = embedding_model
+        self.min_coverage = min_coverage
+        self.embedding_margin = embedding_margin
+        self._regulatory = None
+        self._small_talk = None
+        if embedding_model is not None:
+            # Embedded once; with the embedding cache this is free after the first start
+            self._regulatory = _normalize(embedding_model.embed_documents(regulatory_examples))
+            self._small_talk = _normalize(embedding_model.embed_documents(small_talk_examples))
+
+    def route(self, query, control_ids=(), has_history=False):
+        """("retrieve" | "llm", reason)."""
+        if control_ids:
+            return "retrieve", "control_ids"
+
+        words = re.findall(r'\w+', query.casefold())
+        if not words or all(word in small_talk_words for word in words):
+            return "llm", "small_talk"
+        if has_history and len(words) <= 8 and any(word in referring_words for word in words):
+            return "llm", "follow_up"
+
+        terms = tokenize(query)
+        if any(term in regulatory_terms for term in terms):
+            return "retrieve", "keywords"
+
+        if self.sparse_index is not None:
+            _, coverage = self.sparse_index.search(query, 1)
+            if coverage >= self.min_coverage:
+                return "retrieve", "corpus_terms"
+
+        if self._regulatory is not None:
+            # The retriever embeds the same query next, so this vector comes from the query cache
+            vector = _normalize(self.embedding_model.embed_query(query))
+            margin = float((self._regulatory @ vector).max() - (self._small_talk @ vector).max())
+            if margin >= self.embedding_margin:
+                return "retrieve", "embedding"
+
+        return "llm", "ambiguous"
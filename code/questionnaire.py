@@ -0,0 +1,204 @@
+# Bulk questionnaire mode: answers a spreadsheet of questions in one go.
+#
+#   python code/questionnaire.py questions.xlsx --output answers.xlsx
+#
+# The questions (first column, or the one named "question") are read from an xlsx
+# or csv file and deduplicated on their normalized text. The unique ones are then
+# retrieved in chunks of QUESTIONNAIRE_BATCH_SIZE: one batched forward pass of the
+# embedding model and, with Qdrant, one batch search request per collection for the
+# whole chunk (HybridRetriever._batch_get_relevant_documents). As soon as a chunk is
+# retrieved its answers are generated, at most QUESTIONNAIRE_CONCURRENCY LLM calls
+# at a time, while the next chunk is being retrieved. Each answer is written to the
+# output file as it completes, with the control IDs of the context it was given.
+#
+# Questionnaire rows are independent, so the graph (router, tool call, conversation
+# memory) is bypassed: every question gets the context packing and the answer
+# prompt of the chat's generate step, and a single LLM call.
+
+import os
+import csv
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+from langchain_core.messages import SystemMessage, HumanMessage
+
+import config
+from embeddings import load_embedding_model
+from ingest_pipeline import batched
+from retrieval_cache import normalize_query
+from tracing import span, trace_request
+from agent_prep import build_retriever, load_chat_model, pack_docs, answer_system_prompt, llm_usage
+
+COLUMNS = ["row", "question", "answer", "cited_controls", "duplicate_of", "error"]
+
+
+def read_questions(source, column=None):
+    """Questions of an xlsx/csv file (a path or an uploaded file), empty cells left out."""
+    name = getattr(source, "name", source)
+    if str(name).lower().endswith(".csv"):
+        df = pd.read_csv(source)
+    else:
+        df = pd.read_excel(source)
+    if column is None:
+        column = next((c for c in df.columns if str(c).strip().lower() == "question"), df.columns[0])
+    elif column not in df.columns:
+        raise ValueError(f"No column '{column}' in {name}, found {list(df.columns)}")
+    questions = (str(q).strip() for q in df[column].dropna())
+    return [q for q in questions if q]
+
+
+def deduplicate(questions):
+    """(indices of the first occurrences, {index of a repeat: index of its first occurrence})."""
+    first = {}
+    unique, duplicate_of = [], {}
+    for i, question in enumerate(questions):
+        key = normalize_query(question)
+        if key in first:
+            duplicate_of[i] = first[key]
+        else:
+            first[key] = i
+            unique.append(i)
+    return unique, duplicate_of
+
+
+def cited_controls(docs):
+    """"ECC 2-3-1, CSCC 2-3-1" for the chunks an answer was given, in context order."""
+    cited = []
+    for doc in docs:
+        control = f"{doc.metadata.get('framework', '')} {doc.metadata.get('control_id', '')}".strip()
+        if control and control not in cited:
+            cited.append(control)
+    return ", ".join(cited)
+
+
+def answer_question(llm, question, docs):
+    with trace_request("questionnaire_answer"):
+        context, packed_docs = pack_docs(question, docs)
+        prompt = [SystemMessage(answer_system_prompt(context)), HumanMessage(question)]
+        with span("generate") as current:
+            response = llm.invoke(prompt)
+            current.set(**llm_usage(prompt, response))
+    return response.content, cited_controls(packed_docs)
+
+
+def answer_questionnaire(
+    questions,
+    retriever,
+    llm,
+    concurrency=config.QUESTIONNAIRE_CONCURRENCY,
+    batch_size=config.QUESTIONNAIRE_BATCH_SIZE,
+):
+    """Yields a result per question (repeats included) in completion order, see COLUMNS."""
+    unique, duplicate_of = deduplicate(questions)
+    repeats = {}
+    for i, first in duplicate_of.items():
+        repeats.setdefault(first, []).append(i)
+
+    def results(i, answer="", cited="", error=""):
+        yield {"row": i + 1, "question": questions[i], "answer": answer, "cited_controls": cited, "duplicate_of": "", "error": error}
+        for repeat in repeats.get(i, []):
+            yield {"row": repeat + 1, "question": questions[repeat], "answer": answer, "cited_controls": cited, "duplicate_of": i + 1, "error": error}
+
+    futures_rows = {}  # answer future -> question index
+
+    def finished(futures):
+        for future in futures:
+            i = futures_rows.pop(future)
+            try:
+                answer, cited = future.result()
+            except Exception as e:
+                yield from results(i, error=f"An error occurred: {e}")
+            else:
+                yield from results(i, answer, cited)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="answer") as pool:
+        for rows in batched(unique, batch_size):
+            try:
+                with trace_request("questionnaire_retrieval", questions=len(rows)):
+                    docs = retriever._batch_get_relevant_documents([questions[i] for i in rows], batch_size)
+            except Exception as e:
+                for i in rows:
+                    yield from results(i, error=f"An error occurred: {e}")
+                continue
+            for i, question_docs in zip(rows, docs):
+                futures_rows[pool.submit(answer_question, llm, questions[i], question_docs)] = i
+            # Hand back what is already answered before retrieving the next chunk
+            yield from finished([future for future in futures_rows if future.done()])
+        while futures_rows:
+            done, _ = wait(list(futures_rows), return_when=FIRST_COMPLETED)
+            yield from finished(list(done))
+
+
+class AnswerWriter:
+    """Writes results to a csv (flushed row by row) or xlsx file as they arrive."""
+
+    def __init__(self, path):
+        self.path = path
+        self.xlsx = not path.lower().endswith(".csv")
+        if self.xlsx:
+            from openpyxl import Workbook
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet("answers")
+            self._sheet.append(COLUMNS)
+        else:
+            self._file = open(path, "w", encoding="utf-8-sig", newline="")
+            self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+            self._writer.writeheader()
+
+    def write(self, result):
+        if self.xlsx:
+            self._sheet.append([result[column] for column in COLUMNS])
+        else:
+            self._writer.writerow(result)
+            self._file.flush()
+
+    def close(self):
+        if self.xlsx:
+            self._workbook.save(self.path)
+        else:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a questionnaire (xlsx/csv of questions) with the GRC Agent.")
+    parser.add_argument("questions", help="xlsx or csv file, one question per row")
+    parser.add_argument("--output", help="xlsx or csv file for the answers (default: <questions>_answers.xlsx)")
+    parser.add_argument("--column", help="column holding the questions (default: 'question', else the first one)")
+    parser.add_argument("--concurrency", type=int, default=config.QUESTIONNAIRE_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=config.QUESTIONNAIRE_BATCH_SIZE,
+        help="questions per embedding pass and Qdrant batch search",
+    )
+    args = parser.parse_args()
+    output = args.output or f"{os.path.splitext(args.questions)[0]}_answers.xlsx"
+
+    questions = read_questions(args.questions, args.column)
+    unique, duplicate_of = deduplicate(questions)
+    print(f"{len(questions)} questions, {len(unique)} unique ({len(duplicate_of)} repeats answered once)")
+
+    embed_model = load_embedding_model()
+    retriever = build_retriever(embed_model)
+    llm = load_chat_model()
+
+    start = time.perf_counter()
+    errors = 0
+    with AnswerWriter(output) as writer:
+        for done, result in enumerate(answer_questionnaire(questions, retriever, llm, args.concurrency, args.batch_size), 1):
+            writer.write(result)
+            errors += bool(result["error"])
+            print(f"[{done}/{len(questions)}] row {result['row']}: {result['error'] or result['cited_controls'] or '-'}")
+    print(f"✅ {len(questions)} answers ({errors} errors) written to {output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
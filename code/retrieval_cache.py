@@ -0,0 +1,154 @@
+# Two-tier cache for HybridRetriever results.
+#
+# Tier 1 is an in-process LRU, tier 2 an optional SQLite file shared by every process
+# on the machine. Entries are keyed on the normalized query, the control IDs found in
+# it and top_k, and expire after a TTL. Every entry also records the collection
+# version written by db_prep.py, so a re-ingest invalidates everything cached before it.
+
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from langchain_core.documents import Document
+
+import config
+
+
+## Collection version file, bumped by db_prep.py whenever the collection changes
+def version_path(collection_name):
+    return os.path.join(config.INDEX_DIR, f"{collection_name}.version")
+
+def bump_collection_version(collection_name):
+    path = version_path(collection_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(version)
+    return version
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s-]", " ", query.casefold())).strip()
+
+
+class RetrievalCache:
+    def __init__(self, collection_name, max_entries=1024, ttl=3600, db_path=None, max_db_entries=50000):
+        self.collection_name = collection_name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_db_entries = max_db_entries
+
+        self._memory = OrderedDict()  # key -> (created, docs)
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_mtime = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS retrieval_cache ("
+                "key TEXT PRIMARY KEY, version TEXT, created REAL, docs TEXT)"
+            )
+            self._db.commit()
+
+    def _current_version(self):
+        # Re-read the version file only when it changed on disk
+        path = version_path(self.collection_name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._version_mtime:
+            self._version_mtime = mtime
+            version = None
+            if mtime is not None:
+                with open(path, "r", encoding="utf-8") as f:
+                    version = f.read().strip()
+            if version != self._version:
+                # The collection was re-ingested: drop every in-memory result
+                self._memory.clear()
+                self._version = version
+        return self._version or ""
+
+    def _key(self, query, control_ids, top_k):
+        return json.dumps([normalize_query(query), sorted(set(control_ids)), top_k], ensure_ascii=False)
+
+    def get(self, query, control_ids, top_k):
+        key = self._key(query, control_ids, top_k)
+        now = time.time()
+        with self._lock:
+            version = self._current_version()
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return [Document(**doc) for doc in entry[1]]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT created, docs FROM retrieval_cache WHERE key = ? AND version = ?",
+                    (key, version),
+                ).fetchone()
+                if row is not None and now - row[0] <= self.ttl:
+                    docs = json.loads(row[1])
+                    self._remember(key, row[0], docs)
+                    self.disk_hits += 1
+                    return [Document(**doc) for doc in docs]
+
+            self.misses += 1
+            return None
+
+    def put(self, query, control_ids, top_k, docs):
+        key = self._key(query, control_ids, top_k)
+        now = time.time()
+        stored = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+        with self._lock:
+            version = self._current_version()
+            self._remember(key, now, stored)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO retrieval_cache (key, version, created, docs) VALUES (?, ?, ?, ?)",
+                    (key, version, now, json.dumps(stored, ensure_ascii=False, default=str)),
+                )
+                # Drop entries from older collection versions, expired ones and the oldest above the size cap
+                self._db.execute(
+                    "DELETE FROM retrieval_cache WHERE version != ? OR created < ?",
+                    (version, now - self.ttl),
+                )
+                self._db.execute(
+                    "DELETE FROM retrieval_cache WHERE key IN ("
+                    "SELECT key FROM retrieval_cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_db_entries,),
+                )
+                self._db.commit()
+
+    def _remember(self, key, created, docs):
+        self._memory[key] = (created, docs)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+            "version": self._version,
+        }
@@ -0,0 +1,107 @@
+# One collection per framework and language ("shards"), see SHARDING in config.py.
+#
+# `db_prep.py --shards` writes every (framework, language) group of chunks to its
+# own collection (docs_collection_ecc_en, docs_collection_cscc_ar, ...), each with
+# its own BM25 index, and lists them in <INDEX_DIR>/<collection>.shards.json. A
+# framework can be re-ingested on its own (--framework ECC) without touching the
+# others. The control hierarchy and the corpus-wide BM25 index used by the query
+# router are still written under the base collection name.
+#
+# Frameworks are the labels of config.FRAMEWORKS, given to each guide by its file
+# name (language.source_framework), so every framework gets shards of its own.
+#
+# At query time ShardedRetriever (agent_prep.py) picks the shards of the question's
+# language and framework, searches them concurrently and merges their rankings into
+# one top_k. The shards of one question share a SharedQueryVector, so the query is
+# embedded once, by the first shard that needs it (or ahead of time, in a batch with
+# other questions, see HybridRetriever._batch_get_relevant_documents).
+
+import os
+import json
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import Future
+
+import config
+
+
+def shard_collection_name(collection_name, framework, language):
+    return f"{collection_name}_{framework.lower()}_{language}"
+
+
+def shards_path(collection_name):
+    return os.path.join(config.INDEX_DIR, f"{collection_name}.shards.json")
+
+
+def load_shards(collection_name):
+    """[{"collection", "framework", "language", "chunks"}, ...] written by db_prep.py, [] if there is none."""
+    path = shards_path(collection_name)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["shards"]
+
+
+def save_shards(collection_name, shards, frameworks=None):
+    """Lists `shards` in the manifest; returns the entries it no longer lists.
+
+    After a partial rebuild (`frameworks`, the ones re-ingested) the shards of the
+    other frameworks are kept. A full rebuild lists exactly `shards`, so the shards
+    of removed or renamed guides stop being searched.
+    """
+    previous = load_shards(collection_name)
+    merged = {}
+    if frameworks:
+        merged.update((shard["collection"], shard) for shard in previous if shard["framework"] not in frameworks)
+    merged.update((shard["collection"], shard) for shard in shards)
+    path = shards_path(collection_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"shards": sorted(merged.values(), key=lambda shard: shard["collection"])}, f, indent=2)
+    return [shard for shard in previous if shard["collection"] not in merged]
+
+
+def route_shards(shards, language=None, framework=None):
+    """The shards of that language and framework (None matches every value)."""
+    return [
+        shard for shard in shards
+        if (language is None or shard["language"] == language)
+        and (framework is None or shard["framework"] == framework)
+    ]
+
+
+## One query vector per question, whatever number of searches it goes to
+shared_query_vector = contextvars.ContextVar("shared_query_vector", default=None)
+
+class SharedQueryVector:
+    """The query vector of one question: the first shard that needs it embeds, the others wait for it."""
+
+    def __init__(self, vector=None):
+        self._lock = threading.Lock()
+        self._future = None
+        self._task = None
+        if vector is not None:
+            # Computed ahead, e.g. in a batch with other questions
+            self._future = Future()
+            self._future.set_result(vector)
+
+    def get(self, embed):
+        with self._lock:
+            owner = self._future is None
+            if owner:
+                self._future = Future()
+        if owner:
+            try:
+                self._future.set_result(embed())
+            except Exception as e:
+                self._future.set_exception(e)
+        return self._future.result()
+
+    async def aget(self, aembed):
+        # The shards of an async fan-out run on one event loop, no lock needed
+        if self._future is not None and self._future.done():
+            return self._future.result()
+        if self._task is None:
+            self._task = asyncio.ensure_future(aembed())
+        return await asyncio.shield(self._task)
@@ -0,0 +1,406 @@
+# Per-stage tracing and metrics for the agent pipeline.
+#
+# One question through the graph is a trace, and every stage inside it (graph
+# nodes, query embedding, BM25 / dense search, context packing, LLM calls) is a
+# span with its duration and a few attributes: candidate counts, prompt /
+# completion tokens, router decision, ...
+#
+#     with trace_request("ask", thread_id=thread_id) as trace:
+#         with span("embed_query"):
+#             ...
+#
+# Every span feeds the process-wide Prometheus histograms and counters
+# (render_metrics(), served on METRICS_PORT), whether or not a trace is active.
+# The spans of a trace are also kept on it: the finished trace is appended to
+# TRACE_LOG as one JSON line, and app.py's debug panel shows the last one. With
+# PROFILE_INTERVAL_MS set, one process-wide sampling profiler samples the threads
+# that are inside a span, and every trace writes the stacks of its own threads in
+# the collapsed format flamegraph.pl and speedscope read.
+#
+# The current trace and span live in context variables. LangGraph and ToolNode copy
+# the context into their worker threads; code that hands work to an executor itself
+# wraps the call with bind_context().
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+from functools import partial
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+## Prometheus metrics
+duration_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+count_buckets = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+metric_help = {
+    "grc_stage_duration_seconds": ("histogram", "Duration of each pipeline stage."),
+    "grc_stage_candidates": ("histogram", "Candidates returned by each retrieval stage."),
+    "grc_llm_tokens_total": ("counter", "Prompt and completion tokens of the LLM calls."),
+    "grc_stage_errors_total": ("counter", "Stages that raised an exception."),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # cumulative, as Prometheus expects
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class Metrics:
+    """Process-wide histograms and counters, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (metric, stage) -> Histogram
+        self.counters = {}  # (metric, ((label, value), ...)) -> float
+
+    def observe(self, metric, stage, value, buckets):
+        with self._lock:
+            if (metric, stage) not in self.histograms:
+                self.histograms[(metric, stage)] = Histogram(buckets)
+            self.histograms[(metric, stage)].observe(value)
+
+    def increment(self, metric, labels, value=1):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def totals(self, metric):
+        """stage -> (count, sum) of a histogram, e.g. to diff two points in time."""
+        with self._lock:
+            return {
+                stage: (histogram.count, histogram.total)
+                for (name, stage), histogram in self.histograms.items()
+                if name == metric
+            }
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for metric, (kind, description) in metric_help.items():
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} {kind}")
+                if kind == "histogram":
+                    for (name, stage), histogram in sorted(self.histograms.items()):
+                        if name != metric:
+                            continue
+                        for bound, count in zip(histogram.buckets, histogram.counts):
+                            lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                        lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                        lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.total}')
+                        lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+                else:
+                    for (name, labels), value in sorted(self.counters.items()):
+                        if name == metric:
+                            label_text = ",".join(f'{label}="{text}"' for label, text in labels)
+                            lines.append(f"{metric}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+def render_metrics():
+    return metrics.render()
+
+
+## Spans and traces
+class Span:
+    def __init__(self, name, parent, attributes):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.parent = parent.id if parent is not None else None
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.attributes = dict(attributes)
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Trace:
+    def __init__(self, name, attributes):
+        self.id = uuid.uuid4().hex
+        self.timestamp = time.time()
+        self.root = Span(name, None, attributes)
+        self.spans = []  # finished spans, root excluded
+        self.profiler = None  # the SamplingProfiler collecting this trace's stacks, if profiling is on
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        start = self.root.start
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return {
+            "trace_id": self.id,
+            "name": self.root.name,
+            "timestamp": self.timestamp,
+            "duration_ms": _ms(self.root.duration),
+            "attributes": self.root.attributes,
+            "spans": [
+                {
+                    "id": span.id,
+                    "parent": span.parent,
+                    "depth": span.depth,
+                    "name": span.name,
+                    "start_ms": _ms(span.start - start),
+                    "duration_ms": _ms(span.duration),
+                    "attributes": span.attributes,
+                }
+                for span in spans
+            ],
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def record(span):
+    metrics.observe("grc_stage_duration_seconds", span.name, span.duration, duration_buckets)
+    attributes = span.attributes
+    if "candidates" in attributes:
+        metrics.observe("grc_stage_candidates", span.name, attributes["candidates"], count_buckets)
+    for kind in ("prompt", "completion"):
+        if f"{kind}_tokens" in attributes:
+            metrics.increment("grc_llm_tokens_total", {"stage": span.name, "kind": kind}, attributes[f"{kind}_tokens"])
+    if attributes.get("error"):
+        metrics.increment("grc_stage_errors_total", {"stage": span.name})
+
+
+def _reset(variable, token):
+    try:
+        variable.reset(token)
+    except ValueError:
+        pass  # a streaming generator closed from another context, nothing left to restore
+
+
+@contextmanager
+def span(name, **attributes):
+    """Times a stage; attributes can be added on the yielded span with .set()."""
+    trace = _current_trace.get()
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    profiled = trace is not None and trace.profiler is not None
+    thread = trace.profiler.enter(trace.id) if profiled else None
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        if profiled:
+            trace.profiler.exit(thread, trace.id)
+        _reset(_current_span, token)
+        record(current)
+        if trace is not None:
+            trace.add(current)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def bind_context(func, *args):
+    # For executors that do not copy the context: the spans of func join the current trace
+    return partial(contextvars.copy_context().run, func, *args)
+
+
+## Finished traces
+last_trace = None
+_log_lock = threading.Lock()
+
+def finish_trace(trace):
+    global last_trace
+    last_trace = trace
+    if not config.TRACE_LOG:
+        return
+    line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+    with _log_lock:
+        os.makedirs(os.path.dirname(os.path.abspath(config.TRACE_LOG)), exist_ok=True)
+        with open(config.TRACE_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def trace_request(name, **attributes):
+    """A trace for one request; inside another trace it is just a span of that one."""
+    if _current_trace.get() is not None:
+        with span(name, **attributes):
+            yield _current_trace.get()
+        return
+
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    profiler = trace.profiler = shared_profiler()
+    if profiler is not None:
+        profiler.begin(trace.id)
+        thread = profiler.enter(trace.id)
+    try:
+        yield trace
+    except Exception as e:
+        trace.root.set(error=type(e).__name__)
+        raise
+    finally:
+        trace.root.duration = time.perf_counter() - trace.root.start
+        _reset(_current_span, span_token)
+        _reset(_current_trace, trace_token)
+        if profiler is not None:
+            profiler.exit(thread, trace.id)
+            trace.root.set(profile=profiler.finish(trace.id, os.path.join(config.PROFILE_DIR, f"{trace.id}.folded")))
+        record(trace.root)
+        finish_trace(trace)
+
+
+## Sampling profiler
+idle_functions = {"wait", "select", "poll", "accept", "_wait_for_tstate_lock", "_worker", "serve_forever"}
+
+class SamplingProfiler:
+    """Samples, each `interval` seconds, the Python stack of every busy thread that is
+    inside a span of a profiled trace, and keeps the sample for that trace.
+
+    One sampler serves the whole process, so requests running at the same time do not
+    see each other's stacks. A thread shared by several traces at once (an event loop
+    serving concurrent requests) cannot tell whose work a sample is, so it is left out.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._threads = {}  # thread id -> {trace id: spans of that trace open on the thread}
+        self._stacks = {}  # trace id -> {"outer;...;inner": samples}
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def begin(self, trace_id):
+        with self._lock:
+            self._stacks[trace_id] = {}
+
+    def enter(self, trace_id):
+        """The calling thread works on the trace until the matching exit(); returns its id."""
+        thread = threading.get_ident()
+        with self._lock:
+            traces = self._threads.setdefault(thread, {})
+            traces[trace_id] = traces.get(trace_id, 0) + 1
+        return thread
+
+    def exit(self, thread, trace_id):
+        # Given the thread of enter(): a streaming generator can be closed from another one
+        with self._lock:
+            traces = self._threads.get(thread, {})
+            if traces.get(trace_id, 0) > 1:
+                traces[trace_id] -= 1
+                return
+            traces.pop(trace_id, None)
+            if not traces:
+                self._threads.pop(thread, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                # Only the threads working on exactly one trace
+                working = {thread: next(iter(traces)) for thread, traces in self._threads.items() if len(traces) == 1}
+            if not working:
+                continue
+            samples = []
+            for thread, frame in sys._current_frames().items():
+                # Threads parked in a wait are not working on the request
+                if thread not in working or frame.f_code.co_name in idle_functions:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                samples.append((working[thread], ";".join(reversed(stack))))
+            with self._lock:
+                for trace_id, key in samples:
+                    stacks = self._stacks.get(trace_id)
+                    if stacks is not None:
+                        stacks[key] = stacks.get(key, 0) + 1
+
+    def finish(self, trace_id, path):
+        """Writes the trace's samples to path and forgets them; returns path."""
+        with self._lock:
+            stacks = self._stacks.pop(trace_id, {})
+            # Spans left open by an abandoned generator must not hold on to their thread
+            for thread in [thread for thread, traces in self._threads.items() if trace_id in traces]:
+                self._threads[thread].pop(trace_id)
+                if not self._threads[thread]:
+                    del self._threads[thread]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, samples in sorted(stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {samples}\n")
+        return path
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+def shared_profiler():
+    """The process-wide SamplingProfiler, None when PROFILE_INTERVAL_MS is 0."""
+    global _profiler
+    if config.PROFILE_INTERVAL_MS <= 0:
+        return None
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = SamplingProfiler(config.PROFILE_INTERVAL_MS / 1000)
+    return _profiler
+
+
+## /metrics endpoint
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scraped every few seconds, keep it out of the console
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serves /metrics from a daemon thread; started once per process."""
+    global _metrics_server
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+            print(f"Metrics served on http://{host}:{port}/metrics")
+    return _metrics_server
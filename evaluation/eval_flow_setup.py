@@ -1,10 +1,26 @@
+# Builds the evaluation dataset: for every question of the AR and EN spreadsheets it
+# stores the ground-truth contexts, the contexts HybridRetriever returns and the
+# agent's answer.
+#
+#   python evaluation/eval_flow_setup.py --workers 8
+#
+# Rows are processed by a bounded pool of worker threads (the time goes into LLM
+# and Qdrant calls, not Python). Every finished row is appended to a JSONL
+# checkpoint straight away, so an interrupted run resumes where it stopped; pass
+# --restart to start over. Ground-truth retrievals are cached on disk until the
+# collection changes, and every row gets its own conversation thread so answers
+# never see the questions of other rows.
+
 import os
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # import arabic_reshaper
 # from bidi.algorithm import get_display
 
 # from langchain.chains import RetrievalQA
 # from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEmbeddings
 # from langchain.vectorstores import Chroma
 from langchain.schema import BaseRetriever
 
@@ -14,7 +30,6 @@ import re
 # from langchain.schema.document import Document
 # from typing import List
 
-from langchain.schema import BaseRetriever
 from pydantic import Field
 from typing import Any
 
@@ -28,7 +43,16 @@ from tqdm import tqdm
 # import warnings
 
 from ragas import EvaluationDataset
-from ..code.agent_prep import get_agent_response, initialize_agent
+
+EVAL_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(EVAL_DIR), "code"))
+
+# Evaluation threads are throwaway, keep them out of the app's conversation store
+os.environ.setdefault("CONVERSATION_DB", "")
+
+import config as settings
+from agent_prep import get_agent_response, get_shared_agent
+from retrieval_cache import RetrievalCache
 
 os.environ['SSL_CERT_FILE'] = certifi.where()
 # docker run -d -p 6333:6333 -p 6334:6334 -v "C:/Users/mokar/KAUST Camp/project/OURPROJ/qdrant_storage:/qdrant/storage:z" qdrant/qdrant
@@ -42,10 +66,10 @@ def normalize_control_id(raw_id):
     # Arabic-Indic to Western numerals
     arabic_to_western = str.maketrans("٠١٢٣٤٥٦٧٨٩۱۲۳۷۸", "012345678912378")
     normalized = raw_id.translate(arabic_to_western)
-    
+
     # Replace separators to standard format
     normalized = normalized.replace('.', '-').replace(',', '-').strip()
-    
+
     return normalized
 
 
@@ -58,9 +82,7 @@ files = [
 
 paths =[]
 for file in files:
-    paths.append(os.path.join(os.path.dirname(__file__), 'evaluation datasets', file))
-
-dfs = [pd.read_excel(path) for path in paths]
+    paths.append(os.path.join(EVAL_DIR, 'evaluation datasets', file))
 
 
 
@@ -68,21 +90,33 @@ dfs = [pd.read_excel(path) for path in paths]
 # build custom retrieval
 
 class CustomRetriever(BaseRetriever):
-    retriever: Any = Field() # This is the QdrantVectorStore
+    vector_stores: Any = Field() # QdrantVectorStores: the collection, or each of its shards with SHARDING
     embedding_model: Any = Field() # This is the HuggingFaceEmbeddings model
     top_k: int = Field(default=10)
+    cache: Any = Field(default=None) # RetrievalCache for the ground truth (optional)
 
     def _get_relevant_documents(self, query: str):
         # 1. Normalize and extract IDs
         raw_ids = extract_control_ids(query)
         control_ids = [normalize_control_id(cid) for cid in raw_ids]
 
+        # 3. No control IDs, retrun empty list
+        if not control_ids:
+            return None
+
+        if self.cache is not None:
+            cached = self.cache.get(query, control_ids, self.top_k)
+            if cached is not None:
+                return [doc.page_content for doc in cached]
+
         # 2. Re-run with the corrected filter logic
-        if control_ids:
-            # print(f"inside HybridRetriever and found control ids: {control_ids}")
-            # filter_obj = control_id_filter(query)
-            # The QdrantVectorStore `similarity_search` method correctly takes a filter.
-            candidate_docs = self.retriever.similarity_search_with_score(
+        # print(f"inside HybridRetriever and found control ids: {control_ids}")
+        # filter_obj = control_id_filter(query)
+        # The QdrantVectorStore `similarity_search` method correctly takes a filter.
+        candidate_docs = [
+            doc_and_score
+            for vector_store in self.vector_stores
+            for doc_and_score in vector_store.similarity_search_with_score(
                 query=query,
                 k=50,  # Or a larger number to get a good pool
                 # filter=filter_obj
@@ -95,115 +129,185 @@ class CustomRetriever(BaseRetriever):
                         ]
                     )
             )
-            # print(f"finished filtered retrival. got: \n {candidate_docs}")
-            # You don't need to re-rank by score here, as the k=50 query is already sorted by Qdrant.
-            final_docs = []
-            for doc, _ in candidate_docs:
-                final_docs.append(doc.page_content)
-            return final_docs
-
-        # 3. No control IDs, retrun empty list
-        return None
+        ]
+        # Shards are searched one by one, their cosine scores rank them together
+        candidate_docs.sort(key=lambda doc_and_score: -doc_and_score[1])
+        candidate_docs = candidate_docs[:50]
+        # print(f"finished filtered retrival. got: \n {candidate_docs}")
+        # You don't need to re-rank by score here, as the k=50 query is already sorted by Qdrant.
+        final_docs = []
+        for doc, _ in candidate_docs:
+            final_docs.append(doc)
+
+        if self.cache is not None:
+            self.cache.put(query, control_ids, self.top_k, final_docs)
+        return [doc.page_content for doc in final_docs]
 
     async def _aget_relevant_documents(self, query: str):
         return self._get_relevant_documents(query)
 
 
-print("\nLoading the embedding model...\n")
-# Define the embedding model used to create the store. It must be the same one.
-model_name = "intfloat/multilingual-e5-large"
-model_kwargs = {'device': 'cpu'}
-encode_kwargs = {'normalize_embeddings': False}
-embed_model = HuggingFaceEmbeddings(
-    model_name=model_name,
-    model_kwargs=model_kwargs,
-    encode_kwargs=encode_kwargs,
-)
-print("\n✅ Embedding model loaded successfully!\n")
-
-# Load the vector store from the specified directory.
-print("\nLoading the Qdrant vector store...\n")
-# client = QdrantClient(path="/langchain_qdrant")
-client = QdrantClient(url="http://localhost:6333")
-vector_store = QdrantVectorStore(
-    client=client,
-    collection_name="docs_collection",
-    embedding=embed_model,
-    # retrieval_mode=RetrievalMode.DENSE # default
-)
-
-print("\n✅ Qdrant store loaded successfully!\n")
-
-
-# initialize the retriever
-custom_retriever = CustomRetriever(
-    retriever=vector_store,
-    embedding_model=embed_model,
-    top_k=10
-)
-
-agent, hybrid_retriever = initialize_agent()
-config = {"configurable": {"thread_id": "evaluation_session"}}
-
-eval_ds_list = []
-
-print("\nProcessing the evaluation dataset...\n")
-
-for i, df in enumerate(dfs):
-    for index, row in tqdm(df.iterrows(), total=len(df)):
-        cols = df.columns
-        question = row[cols[0]]
-        reference = row[cols[1]]
-        query = row[cols[2]]
-
-        if (i == 1) and (index > 9) and (index < 34):
-            continue
-
-        gt_docs = custom_retriever._get_relevant_documents(query)
-        if not gt_docs:
-            continue
-        ret_docs = hybrid_retriever._get_relevant_documents(question)
-        response = get_agent_response(question, agent, config)
-
-        eval_ds_list.append(
-            {
-                "user_input":question,
-                "reference control": query,
-                "reference":reference,
-                "reference_contexts":gt_docs,
-                "response":response,
-                "retrieved_contexts": [ret_doc.page_content for ret_doc in ret_docs],
-                "source": files[i]
-                
-            }
-        )
-
-        # break
-
-
-
-# Convert the list to a pandas DataFrame
-eval_df = pd.DataFrame(eval_ds_list)
-
-output_folder = "eval"
-
-# Check if the folder exists, and create it if it doesn't
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
-
-# Now, you can save the files inside the folder
-# eval_df.to_csv(f"{output_folder}/evaluation_dataset_csv.csv", index=False)
-# eval_df.to_excel(f"{output_folder}/evaluation_dataset_arabic_xlsx.xlsx", index=False)
-eval_df.to_excel(f"{output_folder}/evaluation_dataset_full_xlsx.xlsx", index=False)
-
-
-# print(f"\n\n {eval_ds_list} \n\n")
-
-print("finished dataset processing and saving")
-
-# print("\nTrying ragas dataset...\n")
-
-# ragas_dataset = EvaluationDataset.from_pandas(eval_df.iloc[:, :-1]) # Exclude the 'source' column
-
-# print("\n✅ Ragas dataset created successfully!\n")
-# print(f"\n\n{ragas_dataset}\n\n")
\ No newline at end of file
+def load_rows():
+    # (row key, dataset index, row) for every question that is evaluated
+    rows = []
+    for i, path in enumerate(paths):
+        df = pd.read_excel(path)
+        for index, row in df.iterrows():
+            if (i == 1) and (index > 9) and (index < 34):
+                continue
+            rows.append((f"{files[i]}:{index}", i, row))
+    return rows
+
+
+def read_checkpoint(path):
+    # row key -> record, for every row a previous run finished
+    done = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by a crash, that row is run again
+                done[record["key"]] = record
+    return done
+
+
+def evaluate_row(key, i, row, custom_retriever, hybrid_retriever, agent):
+    cols = row.index
+    question = row[cols[0]]
+    reference = row[cols[1]]
+    query = str(row[cols[2]])
+
+    gt_docs = custom_retriever._get_relevant_documents(query)
+    if not gt_docs:
+        # Recorded as skipped so a resumed run does not try it again
+        return {"key": key, "skipped": True}
+    ret_docs = hybrid_retriever._get_relevant_documents(question)
+    # One conversation per row, answers must not depend on the other questions.
+    # A failed answer raises, so the row is not checkpointed and the next run retries it
+    response = get_agent_response(
+        question, agent, {"configurable": {"thread_id": f"evaluation-{key}"}}, raise_errors=True
+    )
+
+    return {
+        "key": key,
+        "user_input": question,
+        "reference control": query,
+        "reference": reference,
+        "reference_contexts": gt_docs,
+        "response": response,
+        "retrieved_contexts": [ret_doc.page_content for ret_doc in ret_docs],
+        "source": files[i],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the evaluation dataset (resumable).")
+    parser.add_argument("--workers", type=int, default=4, help="rows evaluated concurrently")
+    parser.add_argument("--output-folder", default="eval")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and evaluate every row again")
+    args = parser.parse_args()
+
+    output_folder = args.output_folder
+    # Check if the folder exists, and create it if it doesn't
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    checkpoint_path = os.path.join(output_folder, "evaluation_checkpoint.jsonl")
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    rows = load_rows()
+    done = read_checkpoint(checkpoint_path)
+    pending = [(key, i, row) for key, i, row in rows if key not in done]
+    print(f"\n{len(rows)} rows, {len(rows) - len(pending)} already done, {len(pending)} to evaluate\n")
+
+    agent, hybrid_retriever = get_shared_agent()
+
+    # The ground truth reuses the agent's embedding model and vector store, and is cached
+    # on disk until db_prep.py changes the collection
+    print("\nLoading the ground-truth retriever...\n")
+    embed_model = hybrid_retriever.embedding_model
+    if getattr(hybrid_retriever, "shards", None):
+        # Sharded layout (SHARDING): there is no single collection, the ground truth searches every shard
+        collection_names = [shard["collection"] for shard in hybrid_retriever.manifest]
+        vector_stores = [hybrid_retriever.shards[name].retriever for name in collection_names]
+    else:
+        collection_names = [settings.COLLECTION_NAME]
+        vector_stores = [hybrid_retriever.retriever]
+    if None in vector_stores:
+        # numpy backend: the agent has no Qdrant store, the ground truth still reads Qdrant
+        client = QdrantClient(url=settings.QDRANT_URL)
+        vector_stores = [
+            QdrantVectorStore(client=client, collection_name=name, embedding=embed_model)
+            for name in collection_names
+        ]
+    custom_retriever = CustomRetriever(
+        vector_stores=vector_stores,
+        embedding_model=embed_model,
+        top_k=10,
+        cache=RetrievalCache(
+            settings.COLLECTION_NAME,
+            max_entries=4096,
+            ttl=float("inf"),
+            db_path=os.path.join(output_folder, "ground_truth_cache.sqlite"),
+        ),
+    )
+
+    print("\nProcessing the evaluation dataset...\n")
+
+    failed = 0
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+            ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="eval") as pool:
+        futures = {
+            pool.submit(evaluate_row, key, i, row, custom_retriever, hybrid_retriever, agent): key
+            for key, i, row in pending
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                record = future.result()
+            except Exception as e:
+                # Not checkpointed, the next run retries this row
+                failed += 1
+                print(f"Row {futures[future]} failed: {e}")
+                continue
+            # Only this thread writes, one flushed line per finished row
+            checkpoint.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            checkpoint.flush()
+            done[record["key"]] = record
+
+    # Dataset order, whatever order the rows finished in
+    eval_ds_list = [
+        {field: value for field, value in done[key].items() if field != "key"}
+        for key, _, _ in rows
+        if key in done and not done[key].get("skipped")
+    ]
+
+    # Convert the list to a pandas DataFrame
+    eval_df = pd.DataFrame(eval_ds_list)
+
+    # Now, you can save the files inside the folder
+    # eval_df.to_csv(f"{output_folder}/evaluation_dataset_csv.csv", index=False)
+    # eval_df.to_excel(f"{output_folder}/evaluation_dataset_arabic_xlsx.xlsx", index=False)
+    eval_df.to_excel(f"{output_folder}/evaluation_dataset_full_xlsx.xlsx", index=False)
+
+
+    # print(f"\n\n {eval_ds_list} \n\n")
+
+    if failed:
+        print(f"{failed} rows failed, run the script again to retry them")
+    print("finished dataset processing and saving")
+
+    # print("\nTrying ragas dataset...\n")
+
+    # ragas_dataset = EvaluationDataset.from_pandas(eval_df.iloc[:, :-1]) # Exclude the 'source' column
+
+    # print("\n✅ Ragas dataset created successfully!\n")
+    # print(f"\n\n{ragas_dataset}\n\n")
+
+
+if __name__ == "__main__":
+    main()